@@ -1,214 +1,86 @@
-import logging
 from collections import abc
 from typing import List, Union, Callable, Set
 from syntax import *
 from examples import *
 from node import *
+from dataflow import DataFlowAnalysis, SetLattice, BitVectorLattice
 #import pdb; pdb.set_trace()
 
-#logging.basicConfig(filename='AEAnalysis.log', level=logging.DEBUG)
+
+class ExpressionIndex:
+    # Inverted index from each variable to the expressions it occurs in
+    # (anywhere, including nested operands), as values of the lattice.
+    # Built once per program, so the kill set of an assignment is one lookup.
+
+    def __init__(self, lattice) -> None:
+        self.lattice = lattice
+        mentions = {}
+        for expr in lattice.universe.items:
+            for var in free_variables(expr):
+                mentions.setdefault(var, []).append(expr)
+        self.mentions = {var: lattice.from_set(exprs) for (var, exprs) in mentions.items()}
+
+    def killed_by(self, var: Variable):
+        # The expressions whose value changes when var is assigned
+        return self.mentions.get(var, self.lattice.empty)
 
 
 # Available Expressions Analysis
-class AvailableExpressionsAnalysis:
+class AvailableExpressionsAnalysis(DataFlowAnalysis):
+    # An expression is available at a node if it has been computed on every
+    # path to the node, and none of its variables changed since
+    must = True
 
     def __init__(self) -> None:
-        self.FV: dict[(Statement.variable, Statement.expression)] = {} #dict of assignments variables with corresponding expression, stored as Assignment for parsing Variable and Expression
+        super().__init__()
         self.expressions: dict[(int, BinaryOperation)] = {} #dict of expressions/conditions with corresponding label, stored as BinaryOperation for parsing Variable and Expression
         self.assignments: dict[(int, Statement)] = {} #dict of assignments with corresponding label, stored as Assignment for parsing Variable and Expression
-        self.label = 1
-        #self.previous_node_label = 0
-        self.previous_node: Node = None
-        self.nodes = {}
-        self.kill: dict[(Node, BinaryOperation)] = {} #dict of expressions/conditions with corresponding label, stored as BinaryOperation for parsing Variable and Expression
-        self.gen: dict[(Node, BinaryOperation)] = {} #dict of expressions/conditions with corresponding label, stored as BinaryOperation for parsing Variable and Expression
-    
-    # Dealing with expressions
-    def create_cfg_expression(self, expr) -> Node:
-        if isinstance(expr, Variable):
-            assert isinstance(expr.name, str)
-        elif isinstance(expr, Constant):
-            assert isinstance(expr.value, int)
-        elif isinstance(expr, BinaryOperation):
-            # Create a node for the expression
-            node = Node()
-            self.label = self.label + 1
-            node.label = self.label
-            node.expression = expr
-            return node
-
-    # Dealing with statements (using function above as helper function for expressions)
-    def create_cfg_statement(self, stmt) -> (Node, list[Node]):
-        node = Node()
-        node.label = self.label  # str(self.label)+str(stmt.__class__)
-        node.going_out = []
-        # self.nodes.append(self.node)
-        if isinstance(stmt, Skip):
-            node.stmt = stmt
-            logging.debug("Skip Node created: ", node.label, "\n")
-            return node, [node]
-        elif isinstance(stmt, Assignment):
-            node.stmt = stmt
-            logging.debug("Stmt Node created: ", node.label, "\n")
-            return node, [node]
-        elif isinstance(stmt, WhileLoop):
-            # diamond with two exits
-            condition = self.create_cfg_expression(stmt.condition)
-            (root, exits) = self.create_cfg_statement(stmt.body)
-            node.expression = condition.expression
-            node.going_out = [root]
-            for i in exits:
-                # Careful, don't overwrite, append!
-                i.going_out.append(node)
-            return node, [node]
-        elif isinstance(stmt, IfThenElse):
-            self.create_cfg_expression(stmt.condition)
-            (branch_t, exits_t) = self.create_cfg_statement(stmt.true_branch)
-            (branch_f, exits_f) = self.create_cfg_statement(stmt.false_branch)
-            node.going_out = [branch_f, branch_t]
-            return node, node.going_out
-        elif isinstance(stmt, CompoundStatement):
-            # Doesn't actually use the first few self.*-lines above!
-            first = None
-            prevs = None
-            for s in stmt.statements:
-                (node, exits) = self.create_cfg_statement(s)
-                #self.previous_node_label = self.label
-                self.label = self.label + 1
-                if first is None:
-                    first = node
-                if prevs is not None:
-                    for p in prevs:
-                        p.going_out.append(node)
-                prevs = exits
-            assert first is not None, "Empty CompoundStmt :-("
-            return first, exits
-        else:
-            assert False, stmt
-                
-    def analyze(self, nodes: dict, cfg): #nodes: list of nodes, cfg: control flow graph
-        # Now we need to iterate over the nodes to find the entry and exit sets
-        # for each node. We can do this by iterating over the nodes in the CFG
-        # and updating the entry and exit sets until they don't change anymore.
-        # This is called chaotic iteration.
-
-        # Using the CFG to iterate over the nodes in the right order
-        # Creating a list of nodes in the right order
-        cfglist = []
-        newnodes = {}
-        for elem in cfg:
-            print(f"CFG element: {elem}")
-            (fst, snd) = elem
-            cfglist.append(fst)
-            cfglist.append(snd)
-        cfglist.remove('exit')
-
-        # Creating a dictionary of nodes
-        #for elem in cfglist:
-        #    for node in nodes.values():
-        #        if node.label == elem:
-        #            nodelist.append(node.label)
-
-        # Booleans for checking if the entry and exit sets have changed
-        changed = True
-        onechange = False
-        #killed = False
-        iterationcount = 0 #for debugging
-        # Chaotic iteration while the entry and exit sets are changing
-        '''
-        while changed:
-            changed = False
-            iterationcount += 1
-
-            for node_label in cfglist:
-                node = nodes[node_label]
-                if node.coming_in:
-                    node.entry = set().union(*[pred.exit for pred in node.coming_in])
-                else:
-                    node.entry = set()
-
-                new_exit = node.gen.union(node.entry.difference(node.kill))
-                if new_exit != node.exit:
-                    node.exit = new_exit
-                    changed = True
-
-        return nodes
-        '''
-        while (changed):
-            iterationcount += 1
-            print(f"Iteration {iterationcount}")
-            # Iterate over the nodes in the CFG
-            for nodelabel in cfglist: #nodes.values():
-                # Get the node
-                node = nodes[nodelabel]
-                # Calculate the entry set for the node
-                if self.previous_node is not None:
-                    node.entry = self.previous_node.exit
-                else:
-                    node.entry = set()
-                
-                #if node.expression is not None:
-                #    if node.expression in self.expressions.values() and node.expression not in node.gen:
-                #        node.gen.add(node.expression)
-                #        onechange = True
-                
-                # Calculate the gen set for the node
-                if node.stmt is not None:
-                    if node.stmt.variable not in self.FV.keys():
-                        self.FV[node.stmt.variable] = node.stmt.expression
-                        #self.assignments[node.label] = node.stmt
-                        node.gen.add(node.stmt.expression)
-                        print(f"Node {node.label} gen: {node.gen}")
-                        #self.gen[node] = node.stmt.expression
-                        # Register that changes have been made
-                        onechange = True
-                    # Check if the variable changes any generated expressions
-                    elif node.stmt.variable in self.FV.keys():
-                        if node.stmt.expression not in node.kill: #and node.stmt.expression in self.FV.values():
-                            node.kill.add(node.stmt.expression)
-                            print(f"Node {node.label} kill: {node.kill}")
-                            # Iterating through subsequent nodes to remove the expression from their entry and exit sets
-                            for nextnodelabel in cfglist:
-                                nextnode = nodes[nextnodelabel]
-                                if nextnode.label > node.label:
-                                    for expr in nextnode.entry:
-                                        print(f"Nextnode entry: {nextnode.entry}")
-                                        print(f"Expr: {expr}")
-                                        exprvariables = []
-                                        exprvariables.append(expr.left)
-                                        print(f"Expr left: {expr.left}")
-                                        exprvariables.append(expr.right)
-                                        print(f"Expr right: {expr.right}")
-                                        print(f"Variable {node.stmt.variable} in expression {expr}")
-                                        if node.stmt.variable in exprvariables:
-                                            nextnode.entry.remove(expr)
-                                    for expr in nextnode.exit:
-                                        if node.stmt.variable in exprvariables:
-                                            nextnode.exit.remove(expr)
-                            #print(list(nodelist.keys())[list(nodelist.values()).index(16)])
-                            #self.FV[node.stmt.variable] = None
-                            #self.kill.add(node.stmt.expression)
-                            # Register that changes have been made
-                            onechange = True
-                diff = node.entry.difference(node.kill)
-                # TODO: Take node.going_out / node.coming_in into account
-                #print(f"Diff type: {type(diff)}")
-                #print(f"Node.exit type: {type(node.exit)}")
-                #print(f"Node.gen type: {type(node.gen)}")
-                node.exit = node.gen.union(diff)
-                #node.exit = node.gen.union(node.entry.difference(node.kill))
-                self.previous_node = node
-                newnodes[node.label] = node
-            self.previous_node = None
-            if not onechange:
-                print("No change in this iteration (are we done?)")
-                changed = False
-            else:
-                print("One or more changes in this iteration")
-                onechange = False
-        print("Analysis done")
-        return newnodes
-        
+        self.index: ExpressionIndex = None # Variables to expressions, for the last analysis
+
+    def facts(self, graph) -> set:
+        # All non-trivial expressions of the program
+        universe = set()
+        for (label, stmt, expr) in zip(graph.labels, graph.stmts, graph.expressions):
+            universe |= self.node_facts(label, stmt, expr)
+        return universe
+
+    def gen_kill(self, graph, lattice):
+        self.index = ExpressionIndex(lattice)
+        gen = [lattice.empty] * len(graph)
+        kill = [lattice.empty] * len(graph)
+        for (i, (label, stmt, expr)) in enumerate(zip(graph.labels, graph.stmts, graph.expressions)):
+            (gen[i], kill[i]) = self.node_gen_kill(label, stmt, expr, lattice, self.index.killed_by)
+        return gen, kill
+
+    def node_facts(self, label, stmt, expression) -> set:
+        if stmt is not None and stmt.expression is not None:
+            return subexpressions(stmt.expression)
+        elif stmt is None and expression is not None:
+            return subexpressions(expression)
+        return set()
+
+    def fact_variables(self, fact) -> set:
+        return free_variables(fact)
+
+    def node_gen_kill(self, label, stmt, expression, lattice, killed_by):
+        if isinstance(stmt, Assignment):
+            kill = killed_by(stmt.variable)
+            return lattice.difference(lattice.from_set(subexpressions(stmt.expression)), kill), kill
+        elif stmt is None and expression is not None:
+            return lattice.from_set(subexpressions(expression)), lattice.empty
+        return lattice.empty, lattice.empty
+
+    def analyze(self, nodes: dict, cfg): #nodes: dict of nodes by label, cfg: control flow graph
+        return self.solve(nodes, cfg)
+
+    def analyze_worklist(self, nodes: dict, cfg):
+        # The analysis with plain sets of expressions while solving
+        return self.solve(nodes, cfg, SetLattice)
+
+    def analyze_bitvector(self, nodes: dict, cfg):
+        # The analysis with bit vectors while solving, converted back to sets
+        # of expressions on the nodes afterwards
+        return self.solve(nodes, cfg, BitVectorLattice)
 
     def print_analysis_results(self, nodes : dict, cfg : list):
         print("Available Expressions Analysis \n")
@@ -229,42 +101,12 @@ class AvailableExpressionsAnalysis:
         for node in nodes.values():
             print(f"Node {node.label}: Predecessors={node.coming_in} Successors={node.going_out} gen={node.gen}, kill={node.kill}, entry={node.entry}, exit={node.exit}\n")
 
-    def mkDFS(self, node: Node, seen: Set[Node]): # -> List[(int,int)]:
-        output = []
-        if node in seen:
-            return output
-        seen.add(node)
-        if node.label not in self.nodes:
-            self.nodes[node.label] = node
-
-        for i in node.going_out:
-            if i.label not in self.nodes:
-                self.nodes[i.label] = i
-            output.append((node.label, i.label))
-            output = output + self.mkDFS(i, seen)
-        return output
-
 
 def main():
     #Available expressions analysis:
     analysis = AvailableExpressionsAnalysis()
 
-    '''
-    # Analysis pipeline for available expressions
-    for program in [book_example, increment_loop, conditional_assignment, nested_loops, while_with_conditional]:
-        (root, exits) = analysis.create_cfg_statement(program)
-        # Need a final patch-up!
-        the_exit = Node()
-        the_exit.label = "exit"
-        the_exit.going_out = []
-        for e in exits:
-            e.going_out.append(the_exit)
-        #analysis.nodes[len(analysis.nodes)] = the_exit
-        cfg = (analysis.mkDFS(root, set()))
-        newnodes = analysis.analyze(analysis.nodes, cfg)
-
-        analysis.print_analysis_results(newnodes, cfg)
-    '''
+    # For the analysis of several programs, see batch.py
 
     
     # Create the CFG, with nodes containing necessary information for doing an analysis
@@ -277,7 +119,7 @@ def main():
     the_exit.going_out = []
     for e in exits:
         print(f"exit: {e}")
-        e.going_out.append(the_exit)
+        e.link(the_exit)
     #analysis.nodes[len(analysis.nodes)] = the_exit
 
     cfg = (analysis.mkDFS(root, set()))
@@ -0,0 +1,85 @@
+from typing import Set
+from syntax import *
+from node import *
+from examples import *
+from dataflow import DataFlowAnalysis, BACKWARD
+
+
+# Live variables analysis
+class LiveVariables(DataFlowAnalysis):
+    # A variable is live at a node if there is a path from the node to a use
+    # of the variable on which it is not assigned first. The facts are the
+    # variable names. A backward analysis: the solver follows the same
+    # CompactCFG from the 'exit' node along the predecessors, so the entry of
+    # a node is computed from the entries of its successors.
+    direction = BACKWARD
+
+    def __init__(self, live_at_exit=None):
+        super().__init__()
+        self.live_at_exit = live_at_exit # names of the variables still used after the program
+
+    def facts(self, graph) -> list:
+        names = set()
+        for (label, stmt, expr) in zip(graph.labels, graph.stmts, graph.expressions):
+            names |= self.node_facts(label, stmt, expr)
+        return sorted(names)
+
+    def gen_kill(self, graph, lattice):
+        gen = [lattice.empty] * len(graph)
+        kill = [lattice.empty] * len(graph)
+        killed_by = lambda var: lattice.from_set([var.name])
+        for (i, (label, stmt, expr)) in enumerate(zip(graph.labels, graph.stmts, graph.expressions)):
+            (gen[i], kill[i]) = self.node_gen_kill(label, stmt, expr, lattice, killed_by)
+        return gen, kill
+
+    def used_variables(self, stmt, expression) -> Set[str]:
+        # Names of the variables a node reads
+        if isinstance(stmt, Assignment):
+            return {v.name for v in free_variables(stmt.expression)}
+        elif stmt is None and expression is not None:
+            return {v.name for v in free_variables(expression)}
+        return set()
+
+    def node_facts(self, label, stmt, expression) -> Set[str]:
+        # The variables live after the program come in at the 'exit' node
+        if label == "exit":
+            return set(self.live_at_exit or ())
+        names = self.used_variables(stmt, expression)
+        if isinstance(stmt, Assignment):
+            names.add(stmt.variable.name)
+        return names
+
+    def is_boundary_fact(self, fact) -> bool:
+        return fact in (self.live_at_exit or ())
+
+    def fact_variables(self, fact) -> set:
+        return {Variable(fact)}
+
+    def node_gen_kill(self, label, stmt, expression, lattice, killed_by):
+        gen = lattice.from_set(self.used_variables(stmt, expression))
+        if isinstance(stmt, Assignment):
+            return gen, killed_by(stmt.variable)
+        return gen, lattice.empty
+
+    def boundary(self, graph, lattice):
+        # Nothing is live after the program, unless given
+        return lattice.from_set(self.live_at_exit or ())
+
+    def analyze(self, nodes: dict, cfg):
+        return self.solve(nodes, cfg)
+
+    def print_nodes(self, nodes: dict, cfg: list):
+        print("Live Variables Analysis \n")
+        print(f"for program with control flow graph: {cfg}\n")
+        for node in nodes.values():
+            print(f"Node {node.label}: entry={sorted(node.entry)} exit={sorted(node.exit)}\n")
+
+
+def main():
+    analysis = LiveVariables()
+    (nodes, cfg) = analysis.build_cfg(book_example)
+    results = analysis.analyze(nodes, cfg)
+    analysis.print_nodes(results, cfg)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+from functools import partial
+from multiprocessing import Pool
+from typing import Dict, Iterable, Iterator, List, Tuple
+from syntax import *
+from examples import *
+from dataflow import BACKWARD
+from AvailableExpressions import AvailableExpressionsAnalysis
+
+# Batch driver: analyses many programs, spread over a pool of worker
+# processes. Every program gets a fresh analysis object, since the label
+# counter and the nodes of an analysis belong to the one program it built.
+#
+# Workers send back the edge list and the entry and exit sets by label rather
+# than the nodes themselves, which link to each other and would make pickling
+# recurse through the whole graph. The programs themselves pickle as a flat
+# table (see syntax._flatten), however deep they nest.
+
+
+def analyze_program(program: Statement, analysis_type=AvailableExpressionsAnalysis) -> Tuple[List[Tuple], Dict]:
+    # The control flow graph of the program and {label: (entry, exit)},
+    # straight from the CompactCFG and Solution without filling in Nodes
+    analysis = analysis_type()
+    graph = analysis.build_compact(program)
+    solution = analysis.solve_compact(graph)
+    to_set = solution.lattice.to_persistent
+    return graph.depth_first_edges(), {graph.labels[i]: (to_set(solution.entry[i]), to_set(solution.exit[i]))
+                                       for i in graph.reverse_postorder(analysis.direction == BACKWARD)}
+
+
+def _analyze_indexed(analysis_type, indexed: Tuple[int, Statement]):
+    (i, program) = indexed
+    return i, analyze_program(program, analysis_type)
+
+
+def analyze_batch(programs: Iterable[Statement], analysis_type=AvailableExpressionsAnalysis,
+                  processes: int = None, chunksize: int = 1, ordered: bool = True) -> Iterator[Tuple[int, Tuple]]:
+    # Yields (position in programs, (cfg, results)) as the results come in:
+    # in input order if ordered, otherwise in the order the workers finish.
+    # Programs are sent to the workers chunksize at a time; larger chunks
+    # cost less communication for many small programs. processes defaults to
+    # the number of CPUs, and processes=1 analyses in this process instead.
+    work = partial(_analyze_indexed, analysis_type)
+    if processes == 1:
+        yield from map(work, enumerate(programs))
+        return
+    with Pool(processes) as pool:
+        if ordered:
+            yield from pool.imap(work, enumerate(programs), chunksize)
+        else:
+            yield from pool.imap_unordered(work, enumerate(programs), chunksize)
+
+
+def main():
+    # Analysis pipeline for available expressions, over all the examples
+    programs = [book_example, increment_loop, conditional_assignment, nested_loops, while_with_conditional]
+    for (i, (cfg, results)) in analyze_batch(programs):
+        print(f"Program {i}, control flow graph: {cfg}\n")
+        for (label, (entry, exit)) in results.items():
+            print(f"Node {label}: entry={entry} exit={exit}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
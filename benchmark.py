@@ -0,0 +1,323 @@
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+from node import *
+from generator import SHAPES, generate
+from AvailableExpressions import AvailableExpressionsAnalysis
+from ReachingDefinitions import ReachingDefinitions
+from LiveVariables import LiveVariables
+from cfg import CompactCFG
+from chains import DefUseChains
+from ssa import SSA, sparse_reaching_definitions
+from bitvector import Universe, BitVectorLattice
+from dataflow import solve
+from batch import analyze_program
+from incremental import build_fragment
+from structured import solve_structured
+import vectorized
+
+# Benchmark harness: times the stages of the pipeline on generated programs
+# and writes the results as JSON, one record per (shape, size, analysis,
+# stage), for plotting and for comparing against a stored baseline:
+#
+#   python benchmark.py --sizes 1000 4000 16000 --output results.json
+#   python benchmark.py --baseline results.json
+#   python benchmark.py --sparse
+#   python benchmark.py --throughput 2000 --sizes 20
+#   python benchmark.py --states
+#   python benchmark.py --structured
+#
+# Peak memory is measured with tracemalloc in a second run of every stage,
+# since tracing slows the code down too much to time it at the same time. It
+# is the peak of all traced memory during the stage, so it includes what the
+# earlier stages still hold.
+#
+# --sparse instead compares the use-def chains of reaching definitions from
+# the dense solver (DefUseChains) with those from SSA form, building the SSA
+# included.
+#
+# --throughput N instead measures programs per second over N programs of
+# every size, analysed one at a time and all together by the vectorized
+# solver (which needs NumPy): both from the program to the result sets
+# ('pipeline'), and for the solver alone ('solve').
+#
+# --states instead measures the memory the entry, exit, gen and kill sets of
+# the nodes take after analyze, as shared persistent sets and as a fresh set
+# for every node.
+#
+# --structured instead times the fixpoint alone, by the iterative solver and
+# by the elimination solver over the syntax tree (see structured.py), from
+# the same gen and kill.
+
+ANALYSES = {'available_expressions': AvailableExpressionsAnalysis,
+            'reaching_definitions': ReachingDefinitions,
+            'live_variables': LiveVariables}
+
+STAGES = ('create_cfg_statement', 'mkDFS', 'analyze')
+
+
+def run_stages(program, analysis_type) -> Dict[str, float]:
+    # Seconds spent in each stage
+    seconds = {}
+    analysis = analysis_type()
+    start = time.perf_counter()
+    (root, exits) = analysis.create_cfg_statement(program)
+    the_exit = Node()
+    the_exit.label = "exit"
+    for e in exits:
+        e.link(the_exit)
+    seconds['create_cfg_statement'] = time.perf_counter() - start
+    start = time.perf_counter()
+    cfg = analysis.mkDFS(root, set())
+    seconds['mkDFS'] = time.perf_counter() - start
+    start = time.perf_counter()
+    analysis.analyze(analysis.nodes, cfg)
+    seconds['analyze'] = time.perf_counter() - start
+    return seconds
+
+
+def peak_memory(program, analysis_type) -> Dict[str, int]:
+    # Peak bytes allocated during each stage
+    peaks = {}
+    analysis = analysis_type()
+    tracemalloc.start()
+    try:
+        (root, exits) = analysis.create_cfg_statement(program)
+        the_exit = Node()
+        the_exit.label = "exit"
+        for e in exits:
+            e.link(the_exit)
+        peaks['create_cfg_statement'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        cfg = analysis.mkDFS(root, set())
+        peaks['mkDFS'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        analysis.analyze(analysis.nodes, cfg)
+        peaks['analyze'] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def run(shapes: List[str], sizes: List[int], analyses: List[str], seed: int = 0,
+        variables: int = 10, repeat: int = 3, memory: bool = True) -> Dict:
+    records = []
+    for shape in shapes:
+        for size in sizes:
+            program = generate(shape, size, seed, variables)
+            for name in analyses:
+                analysis_type = ANALYSES[name]
+                # The best of the repeats, as the least disturbed by the rest
+                # of the machine
+                runs = [run_stages(program, analysis_type) for _ in range(repeat)]
+                peaks = peak_memory(program, analysis_type) if memory else {}
+                for stage in STAGES:
+                    records.append({'shape': shape, 'size': size, 'analysis': name, 'stage': stage,
+                                    'seconds': min(r[stage] for r in runs),
+                                    'peak_bytes': peaks.get(stage)})
+    return {'python': platform.python_version(), 'machine': platform.machine(),
+            'seed': seed, 'variables': variables, 'records': records}
+
+
+def run_sparse(shapes: List[str], sizes: List[int], seed: int = 0, variables: int = 10,
+               repeat: int = 3) -> Dict:
+    records = []
+    for shape in shapes:
+        for size in sizes:
+            (nodes, cfg) = ReachingDefinitions().build_cfg(generate(shape, size, seed, variables))
+            values = len(SSA(CompactCFG(nodes, cfg)).kind)
+            dense = []
+            sparse = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                DefUseChains(nodes, cfg)
+                dense.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                sparse_reaching_definitions(SSA(CompactCFG(nodes, cfg)))
+                sparse.append(time.perf_counter() - start)
+            records.append({'shape': shape, 'size': size, 'nodes': len(nodes), 'values': values,
+                            'dense_seconds': min(dense), 'sparse_seconds': min(sparse)})
+    return {'python': platform.python_version(), 'machine': platform.machine(),
+            'seed': seed, 'variables': variables, 'records': records}
+
+
+def run_throughput(count: int, sizes: List[int], analyses: List[str], seed: int = 0,
+                   variables: int = 10, repeat: int = 3) -> Dict:
+    records = []
+    for size in sizes:
+        programs = [generate('mixed', size, seed + i, variables) for i in range(count)]
+        for name in analyses:
+            analysis_type = ANALYSES[name]
+            problems = []
+            for program in programs:
+                analysis = analysis_type()
+                graph = CompactCFG(*analysis.build_cfg(program))
+                lattice = BitVectorLattice(Universe(analysis.facts(graph)))
+                (gen, kill) = analysis.gen_kill(graph, lattice)
+                problems.append((graph, lattice, gen, kill, analysis.boundary(graph, lattice)))
+            (must, direction) = (analysis_type.must, analysis_type.direction)
+            timings = {
+                ('pipeline', 'scalar'): lambda: [analyze_program(program, analysis_type) for program in programs],
+                ('pipeline', 'vectorized'): lambda: vectorized.analyze_many(programs, analysis_type),
+                ('solve', 'scalar'): lambda: [solve(*problem, must=must, direction=direction) for problem in problems],
+                ('solve', 'vectorized'): lambda: vectorized.solve_many(problems, must, direction),
+            }
+            for ((stage, solver), work) in timings.items():
+                seconds = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    work()
+                    seconds.append(time.perf_counter() - start)
+                records.append({'size': size, 'programs': count, 'analysis': name, 'stage': stage,
+                                'solver': solver, 'programs_per_second': count / min(seconds)})
+    return {'python': platform.python_version(), 'machine': platform.machine(),
+            'seed': seed, 'variables': variables, 'records': records}
+
+
+def run_states(shapes: List[str], sizes: List[int], analyses: List[str], seed: int = 0,
+               variables: int = 10) -> Dict:
+    # Memory kept after building and solving: the Node graph with copied or
+    # shared sets on the nodes, or only the CompactCFG and its Solution
+    records = []
+    for shape in shapes:
+        for size in sizes:
+            program = generate(shape, size, seed, variables)
+            for name in analyses:
+                for states in ('set', 'persistent', 'compact'):
+                    analysis = ANALYSES[name]()
+                    gc.collect()
+                    tracemalloc.start()
+                    try:
+                        if states == 'compact':
+                            graph = analysis.build_compact(program)
+                            start = time.perf_counter()
+                            solution = analysis.solve_compact(graph)
+                            seconds = time.perf_counter() - start
+                            values = [solution.gen, solution.kill, solution.entry, solution.exit]
+                        else:
+                            (nodes, cfg) = analysis.build_cfg(program)
+                            start = time.perf_counter()
+                            analysis.solve(nodes, cfg, persistent=(states == 'persistent'))
+                            seconds = time.perf_counter() - start
+                            values = [[getattr(node, field) for node in nodes.values()]
+                                      for field in ('gen', 'kill', 'entry', 'exit')]
+                        gc.collect() # the Node graph has cycles
+                        retained = tracemalloc.get_traced_memory()[0]
+                    finally:
+                        tracemalloc.stop()
+                    distinct = {id(value) for field in values for value in field}
+                    records.append({'shape': shape, 'size': size, 'analysis': name, 'states': states,
+                                    'retained_bytes': retained, 'distinct_sets': len(distinct),
+                                    'seconds': seconds})
+    return {'python': platform.python_version(), 'machine': platform.machine(),
+            'seed': seed, 'variables': variables, 'records': records}
+
+
+def run_structured(shapes: List[str], sizes: List[int], analyses: List[str], seed: int = 0,
+                   variables: int = 10, repeat: int = 3) -> Dict:
+    records = []
+    for shape in shapes:
+        for size in sizes:
+            program = generate(shape, size, seed, variables)
+            for name in analyses:
+                analysis = ANALYSES[name]()
+                fragment = build_fragment(analysis, program)
+                the_exit = Node()
+                the_exit.label = "exit"
+                for e in fragment.exits():
+                    e.link(the_exit)
+                graph = CompactCFG(analysis.nodes, analysis.mkDFS(fragment.head(), set()))
+                lattice = BitVectorLattice(Universe(analysis.facts(graph)))
+                (gen, kill) = analysis.gen_kill(graph, lattice)
+                problem = (graph, lattice, gen, kill, analysis.boundary(graph, lattice))
+                (must, direction) = (analysis.must, analysis.direction)
+                solvers = {'iterative': lambda: solve(*problem, must=must, direction=direction),
+                           'structured': lambda: solve_structured(fragment, *problem, must=must, direction=direction)}
+                for (solver, work) in solvers.items():
+                    seconds = []
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        solution = work()
+                        seconds.append(time.perf_counter() - start)
+                    records.append({'shape': shape, 'size': size, 'analysis': name, 'solver': solver,
+                                    'nodes': len(graph), 'transfers': solution.transfers, 'seconds': min(seconds)})
+    return {'python': platform.python_version(), 'machine': platform.machine(),
+            'seed': seed, 'variables': variables, 'records': records}
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float = 1.25) -> List[str]:
+    # The stages that took more than tolerance times as long as in the
+    # baseline, as readable lines
+    key = lambda r: (r['shape'], r['size'], r['analysis'], r['stage'])
+    before = {key(r): r for r in baseline['records']}
+    regressions = []
+    for r in results['records']:
+        old = before.get(key(r))
+        if old is not None and r['seconds'] > tolerance * old['seconds']:
+            regressions.append(f"{r['shape']} {r['size']} {r['analysis']} {r['stage']}: "
+                               f"{old['seconds']:.4f}s -> {r['seconds']:.4f}s")
+    return regressions
+
+
+def write(results: Dict, output: str = None) -> None:
+    # The results of any mode as JSON, to the output file or stdout
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the analysis pipeline on generated programs")
+    parser.add_argument('--shapes', nargs='+', choices=SHAPES, default=list(SHAPES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[250, 1000, 4000])
+    parser.add_argument('--analyses', nargs='+', choices=sorted(ANALYSES), default=sorted(ANALYSES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--variables', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="skip the peak memory runs")
+    parser.add_argument('--output', help="write the results here instead of stdout")
+    parser.add_argument('--baseline', help="results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    parser.add_argument('--sparse', action='store_true', help="compare dense and SSA-based reaching definitions")
+    parser.add_argument('--throughput', type=int, metavar='N',
+                        help="programs per second over N programs, one at a time and vectorized")
+    parser.add_argument('--states', action='store_true',
+                        help="memory of the results: sets on the nodes, persistent and copied, or a compact graph")
+    parser.add_argument('--structured', action='store_true',
+                        help="compare the iterative and the elimination solver")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    modes = [args.sparse, args.throughput, args.states, args.structured]
+    if args.baseline and any(modes):
+        parser.error("--baseline only compares the stage timings")
+
+    if args.structured:
+        results = run_structured(args.shapes, args.sizes, args.analyses, args.seed, args.variables, args.repeat)
+    elif args.states:
+        results = run_states(args.shapes, args.sizes, args.analyses, args.seed, args.variables)
+    elif args.throughput:
+        results = run_throughput(args.throughput, args.sizes, args.analyses, args.seed, args.variables, args.repeat)
+    elif args.sparse:
+        results = run_sparse(args.shapes, args.sizes, args.seed, args.variables, args.repeat)
+    else:
+        results = run(args.shapes, args.sizes, args.analyses, args.seed, args.variables, args.repeat, args.memory)
+    write(results, args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"slower: {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
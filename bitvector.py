@@ -0,0 +1,91 @@
+from typing import Dict, Hashable, Iterable, List
+from persistent import FactSet
+
+
+# Bit-vector representation of the sets used by the analyses. Every distinct
+# expression (or definition) is given a dense index once, after which a set of
+# them is a Python int with bit i set for the element with index i, and union,
+# intersection and difference are single integer operations.
+class Universe:
+
+    def __init__(self, items: Iterable[Hashable] = ()) -> None:
+        self.items: List[Hashable] = [] # element with index i
+        self.index: Dict[Hashable, int] = {} # index of each element
+        for item in items:
+            self.add(item)
+
+    def add(self, item: Hashable) -> int:
+        i = self.index.get(item)
+        if i is None:
+            i = len(self.items)
+            self.index[item] = i
+            self.items.append(item)
+        return i
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __contains__(self, item) -> bool:
+        return item in self.index
+
+    @property
+    def full(self) -> int:
+        # The bit vector with every element of the universe
+        return (1 << len(self.items)) - 1
+
+    def to_bits(self, items: Iterable[Hashable]) -> int:
+        bits = 0
+        for item in items:
+            bits |= 1 << self.index[item]
+        return bits
+
+    def to_set(self, bits: int) -> set:
+        result = set()
+        while bits:
+            lowest = bits & -bits
+            result.add(self.items[lowest.bit_length() - 1])
+            bits ^= lowest
+        return result
+
+
+class BitVectorLattice:
+    # Lattice of sets of facts as bit vectors over a Universe, for the solver
+    # in dataflow.py
+
+    def __init__(self, universe: Universe) -> None:
+        self.universe = universe
+        self.empty = 0
+        self.interned: Dict[int, FactSet] = {} # see to_persistent
+
+    @property
+    def full(self) -> int:
+        # Follows the universe if facts are added to it later
+        return self.universe.full
+
+    def from_set(self, items: Iterable[Hashable]) -> int:
+        return self.universe.to_bits(items)
+
+    def to_set(self, value: int) -> set:
+        return self.universe.to_set(value)
+
+    def to_persistent(self, value: int) -> FactSet:
+        # The value as an immutable set, one object per distinct value
+        result = self.interned.get(value)
+        if result is None:
+            result = self.interned[value] = FactSet(self.universe, value)
+        return result
+
+    def union(self, a: int, b: int) -> int:
+        return a | b
+
+    def intersection(self, a: int, b: int) -> int:
+        return a & b
+
+    def difference(self, a: int, b: int) -> int:
+        return a & ~b
+
+    def transfer(self, gen: int, kill: int, value: int) -> int:
+        return gen | (value & ~kill)
+
+    def size(self, value: int) -> int:
+        return bin(value).count('1')
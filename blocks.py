@@ -0,0 +1,201 @@
+from functools import cached_property
+from typing import Dict, List
+from syntax import *
+from cfg import CompactCFG, ENTRY, EXIT
+from dataflow import FORWARD, WORKLIST, Budget, Solution, solve
+
+# Basic blocks: the solver visits one node per statement, but a straight-line
+# run of nodes (each the only successor of the one before, and the only
+# predecessor of the next) can be solved as a single node, with the gen and
+# kill of the whole run:
+#
+#   f2(f1(x)) = gen2 | ((gen1 | (x - kill1)) - kill2)
+#             = (gen2 | (gen1 - kill2)) | (x - (kill1 | kill2))
+#
+# Blocks of Skip nodes alone don't change anything and are left out of the
+# block graph entirely: their predecessors link to their successor instead
+# (duplicate edges are dropped). The values of the nodes inside blocks are
+# recomputed from the value at the start of their block when asked for.
+
+
+class BasicBlocks:
+
+    def __init__(self, graph: CompactCFG) -> None:
+        self.nodes = graph
+        n = len(graph)
+        succs = [graph.successors(i) for i in range(n)]
+        preds = [graph.predecessors(i) for i in range(n)]
+
+        # A block starts at every node that isn't the single successor of its
+        # single predecessor. The final node stays a block of its own, so the
+        # block graph has one for the boundary of a backward analysis.
+        def starts_block(i):
+            if i in (ENTRY, EXIT) or len(preds[i]) != 1:
+                return True
+            p = preds[i][0]
+            return p == i or len(succs[p]) != 1
+        members = [] # node ids of each provisional block, in order
+        block_of = [0] * n
+        for head in graph.reverse_postorder():
+            if not starts_block(head):
+                continue
+            run = [head]
+            block_of[head] = len(members)
+            while len(succs[run[-1]]) == 1 and not starts_block(succs[run[-1]][0]):
+                run.append(succs[run[-1]][0])
+                block_of[run[-1]] = len(members)
+            members.append(run)
+
+        # Skip-only blocks with one successor are bypassed
+        skipped = [b for (b, run) in enumerate(members)
+                   if run[0] not in (ENTRY, EXIT) and len(succs[run[-1]]) == 1
+                   and all(isinstance(graph.stmts[i], Skip) for i in run)]
+        bypassed = set(skipped)
+
+        def target(b):
+            while b in bypassed:
+                b = block_of[succs[members[b][-1]][0]]
+            return b
+        edges = []
+        for (b, run) in enumerate(members):
+            if b in bypassed:
+                continue
+            seen = set()
+            for s in succs[run[-1]]:
+                t = target(block_of[s])
+                if t not in seen:
+                    seen.add(t)
+                    edges.append((graph.labels[run[0]], graph.labels[members[t][0]]))
+        heads = {graph.labels[run[0]]: graph.node(run[0]) for run in members}
+        self.graph = CompactCFG(heads, edges) # the block graph
+
+        # Node ids of each block, by block graph id
+        self.members: List[List[int]] = [members[block_of[graph.ids[label]]] for label in self.graph.labels]
+        self.block = [None] * n # block graph id of each node, None if bypassed
+        for (b, run) in enumerate(self.members):
+            for i in run:
+                self.block[i] = b
+        self.skipped: Dict[int, List[int]] = {members[b][0]: members[b] for b in skipped} # by first node
+
+    def gen_kill(self, lattice, gen: List, kill: List, direction: str = FORWARD):
+        # gen and kill of every block, composed from those of its nodes in
+        # the order of the flow
+        block_gen = []
+        block_kill = []
+        for run in self.members:
+            (g, k) = (lattice.empty, lattice.empty)
+            for i in (run if direction == FORWARD else reversed(run)):
+                g = lattice.union(gen[i], lattice.difference(g, kill[i]))
+                k = lattice.union(k, kill[i])
+            block_gen.append(g)
+            block_kill.append(k)
+        return block_gen, block_kill
+
+
+class BlockSolution:
+    # Fixpoint by node id, like a Solution, from the fixpoint of the block
+    # graph. node_entry(i) and node_exit(i) only compute the block of node i;
+    # the entry and exit lists compute them all.
+
+    def __init__(self, blocks: BasicBlocks, lattice, gen: List, kill: List, block_solution: Solution,
+                 must: bool, direction: str) -> None:
+        self.graph = blocks.nodes
+        self.lattice = lattice
+        self.gen = gen
+        self.kill = kill
+        self.blocks = blocks
+        self.block_solution = block_solution
+        self.meet = lattice.intersection if must else lattice.union
+        self.direction = direction
+        self.values = {} # node id -> (entry, exit), for the blocks computed so far
+        self.transfers = block_solution.transfers
+        self.iterations = block_solution.iterations
+        self.status = block_solution.status
+        self.unfinished = [i for b in block_solution.unfinished for i in blocks.members[b]]
+
+    def node_entry(self, i: int):
+        return self.node_values(i)[0]
+
+    def node_exit(self, i: int):
+        return self.node_values(i)[1]
+
+    def node_values(self, i: int):
+        if i not in self.values:
+            b = self.blocks.block[i]
+            if b is None:
+                self.expand_skipped(i)
+            else:
+                self.expand(b)
+        return self.values[i]
+
+    def expand(self, b: int) -> None:
+        transfer = self.lattice.transfer
+        (gen, kill) = (self.gen, self.kill)
+        run = self.blocks.members[b]
+        if self.direction == FORWARD:
+            value = self.block_solution.entry[b]
+            for i in run:
+                after = transfer(gen[i], kill[i], value)
+                self.values[i] = (value, after)
+                value = after
+        else:
+            value = self.block_solution.exit[b]
+            for i in reversed(run):
+                before = transfer(gen[i], kill[i], value)
+                self.values[i] = (before, value)
+                value = before
+
+    def expand_skipped(self, i: int) -> None:
+        # The nodes of a bypassed block all have the value flowing into it:
+        # the meet of the exits of its predecessors (forward), or the entry
+        # of its successor (backward), which may be bypassed in turn
+        graph = self.blocks.nodes
+        skipped = self.blocks.skipped
+        stack = [skipped_first(graph, skipped, i)]
+        while stack:
+            first = stack[-1]
+            run = skipped[first]
+            if self.direction == FORWARD:
+                sources = graph.predecessors(first)
+            else:
+                sources = graph.successors(run[-1])
+            missing = [s for s in sources if s not in self.values and self.blocks.block[s] is None]
+            if missing:
+                stack.extend(skipped_first(graph, skipped, s) for s in missing)
+                continue
+            stack.pop()
+            if self.direction == FORWARD:
+                value = None
+                for s in sources:
+                    exit = self.node_exit(s)
+                    value = exit if value is None else self.meet(value, exit)
+            else:
+                value = self.node_entry(sources[0])
+            for j in run:
+                self.values[j] = (value, value)
+
+    @cached_property
+    def entry(self) -> List:
+        return [self.node_entry(i) for i in range(len(self.graph))]
+
+    @cached_property
+    def exit(self) -> List:
+        return [self.node_exit(i) for i in range(len(self.graph))]
+
+
+def skipped_first(graph: CompactCFG, skipped: Dict, i: int) -> int:
+    # The first node of the bypassed block of node i
+    while i not in skipped:
+        i = graph.predecessors(i)[0]
+    return i
+
+
+def solve_blocks(graph: CompactCFG, lattice, gen: List, kill: List, boundary,
+                 must: bool = False, direction: str = FORWARD, strategy: str = WORKLIST,
+                 instrument=None, budget: Budget = None) -> BlockSolution:
+    # solve() on the basic blocks of the graph, with the same results
+    blocks = BasicBlocks(graph)
+    (block_gen, block_kill) = blocks.gen_kill(lattice, gen, kill, direction)
+    block_solution = solve(blocks.graph, lattice, block_gen, block_kill, boundary, must, direction, strategy,
+                           instrument, budget)
+    return BlockSolution(blocks, lattice, gen, kill, block_solution, must, direction)
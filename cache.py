@@ -0,0 +1,103 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+from typing import Dict, List, Tuple
+from syntax import *
+from AvailableExpressions import AvailableExpressionsAnalysis
+import serialize
+
+# On-disk cache of analysis results. Entries are files in the format of
+# serialize.py, named by a digest of the program's structure, the analysis
+# class and its version, and the file format version, so changing any of
+# them simply misses.
+#
+# Several processes can share a cache directory: entries are written to a
+# temporary file and renamed into place, which readers see either not at all
+# or complete, and eviction runs under an exclusive lock on the directory.
+# The least recently used entries are evicted first; a hit touches the
+# modification time of its entry.
+
+
+class AnalysisCache:
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, program: Statement, analysis_type) -> str:
+        h = hashlib.sha256(structural_digest(program))
+        h.update(f"{analysis_type.__module__}.{analysis_type.__qualname__}:{analysis_type.version}:{serialize.VERSION}".encode())
+        return h.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.cfg')
+
+    def analyze(self, program: Statement, analysis_type=AvailableExpressionsAnalysis) -> Tuple[List[Tuple], Dict]:
+        # The control flow graph of the program and {label: (entry, exit)},
+        # from the cache if possible
+        path = self.path(self.key(program, analysis_type))
+        try:
+            f = serialize.load(path)
+        except (FileNotFoundError, ValueError):
+            # Not there, evicted since, or not readable: analyse again
+            pass
+        else:
+            with f:
+                cfg = f.edges()
+                results = {f.label(i): (f.entry(i), f.exit(i)) for i in range(len(f))}
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            self.hits += 1
+            return cfg, results
+
+        self.misses += 1
+        analysis = analysis_type()
+        (nodes, cfg) = analysis.build_cfg(program)
+        results = analysis.analyze(nodes, cfg)
+        (fd, temporary) = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            serialize.save(temporary, nodes, cfg)
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        self.evict()
+        return cfg, {label: (node.entry, node.exit) for (label, node) in results.items()}
+
+    def evict(self) -> None:
+        # Removes the least recently used entries until the cache fits in
+        # max_bytes
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = []
+            total = 0
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith('.cfg'):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                        total += stat.st_size
+            entries.sort()
+            for (_, size, path) in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    self.evictions += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
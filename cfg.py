@@ -0,0 +1,202 @@
+from array import array
+from typing import Dict, List, Tuple
+
+# Control flow graphs in compact form, built from the list of
+# (from_label, to_label) edges produced by mkDFS (see CompactCFG)
+
+
+def strongly_connected_components(order: List[int], offsets, targets) -> List[List[int]]:
+    # Tarjan's algorithm with an explicit stack, on the graph whose node i
+    # has the edges to targets[offsets[i]:offsets[i + 1]], for the nodes in
+    # order and those reachable from them. The components come in
+    # topological order (no edges back to earlier components), and the nodes
+    # of each in the order they were found.
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    components = []
+    for root in order:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, offsets[root])]
+        while work:
+            (i, next_edge) = work[-1]
+            if next_edge < offsets[i + 1]:
+                work[-1] = (i, next_edge + 1)
+                j = targets[next_edge]
+                if j not in index:
+                    index[j] = low[j] = len(index)
+                    stack.append(j)
+                    on_stack.add(j)
+                    work.append((j, offsets[j]))
+                elif j in on_stack:
+                    low[i] = min(low[i], index[j])
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[i])
+            if low[i] == index[i]:
+                component = []
+                while True:
+                    j = stack.pop()
+                    on_stack.discard(j)
+                    component.append(j)
+                    if j == i:
+                        break
+                component.reverse()
+                components.append(component)
+    components.reverse()
+    return components
+
+
+# Reserved ids of the initial node and the final 'exit' node in a CompactCFG
+ENTRY = 0
+EXIT = 1
+
+
+class CompactCFG:
+    # Control flow graph with dense integer node ids and the edges stored in
+    # compressed sparse row form: the successors of node i are
+    # succ_targets[succ_offsets[i]:succ_offsets[i + 1]], and likewise for the
+    # predecessors. Statements, expressions and labels are kept in side
+    # tables indexed by id. node(i) gives a Node-like view for existing code.
+    #
+    # It is built from the Node graph, which can then be dropped: the solvers
+    # run on it alone, with their results by id in a Solution (see
+    # DataFlowAnalysis.build_compact and solve_compact). DataFlowAnalysis.solve
+    # still writes the results to the Nodes for the code that reads them
+    # there, and then keeps both.
+
+    def __init__(self, nodes: Dict, cfg: List[Tuple]) -> None:
+        # nodes and cfg as produced by mkDFS, including the 'exit' node
+        root = cfg[0][0]
+        if 'exit' not in nodes:
+            raise ValueError("The control flow graph has no 'exit' node")
+        self.labels = [root, 'exit'] # label of each id
+        self.ids = {root: ENTRY, 'exit': EXIT} # id of each label
+        for edge in cfg:
+            for label in edge:
+                if label not in self.ids:
+                    self.ids[label] = len(self.labels)
+                    self.labels.append(label)
+        n = len(self.labels)
+        self.stmts = [nodes[label].stmt for label in self.labels]
+        self.expressions = [nodes[label].expression for label in self.labels]
+
+        edges = [(self.ids[fst], self.ids[snd]) for (fst, snd) in cfg]
+        (self.succ_offsets, self.succ_targets) = self._csr(n, edges)
+        (self.pred_offsets, self.pred_sources) = self._csr(n, [(snd, fst) for (fst, snd) in edges])
+
+    @staticmethod
+    def _csr(n: int, edges: List[Tuple[int, int]]):
+        # Counting sort of the edges by source, keeping their order otherwise
+        offsets = array('l', [0]) * (n + 1)
+        for (fst, _) in edges:
+            offsets[fst + 1] += 1
+        for i in range(n):
+            offsets[i + 1] += offsets[i]
+        targets = array('l', [0]) * len(edges)
+        fill = array('l', offsets[:n])
+        for (fst, snd) in edges:
+            targets[fill[fst]] = snd
+            fill[fst] += 1
+        return offsets, targets
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def successors(self, i: int):
+        return memoryview(self.succ_targets)[self.succ_offsets[i]:self.succ_offsets[i + 1]]
+
+    def predecessors(self, i: int):
+        return memoryview(self.pred_sources)[self.pred_offsets[i]:self.pred_offsets[i + 1]]
+
+    def edges(self) -> List[Tuple]:
+        # The edges as (from_label, to_label), grouped by source node
+        return [(self.labels[i], self.labels[j]) for i in range(len(self)) for j in self.successors(i)]
+
+    def depth_first_edges(self) -> List[Tuple]:
+        # The edges as (from_label, to_label) in the depth first order of
+        # mkDFS, so the same list build_cfg gave
+        output = []
+        seen = {ENTRY}
+        stack = [(ENTRY, iter(self.successors(ENTRY)))]
+        while stack:
+            (i, children) = stack[-1]
+            for j in children:
+                output.append((self.labels[i], self.labels[j]))
+                if j not in seen:
+                    seen.add(j)
+                    stack.append((j, iter(self.successors(j))))
+                    break
+            else:
+                stack.pop()
+        return output
+
+    def reverse_postorder(self, backward: bool = False) -> List[int]:
+        # Ids reachable from ENTRY, every node before its successors except
+        # along back edges. If backward, the same for the reversed graph,
+        # starting from EXIT and following the predecessors.
+        if backward:
+            (start, offsets, targets) = (EXIT, self.pred_offsets, self.pred_sources)
+        else:
+            (start, offsets, targets) = (ENTRY, self.succ_offsets, self.succ_targets)
+        postorder = []
+        seen = bytearray(len(self))
+        seen[start] = 1
+        stack = [(start, offsets[start])]
+        while stack:
+            (i, next_edge) = stack[-1]
+            if next_edge < offsets[i + 1]:
+                stack[-1] = (i, next_edge + 1)
+                j = targets[next_edge]
+                if not seen[j]:
+                    seen[j] = 1
+                    stack.append((j, offsets[j]))
+            else:
+                stack.pop()
+                postorder.append(i)
+        postorder.reverse()
+        return postorder
+
+    def node(self, i: int) -> 'NodeView':
+        return NodeView(self, i)
+
+    def nodes(self) -> Dict:
+        # Node-like views of all nodes, by label
+        return {label: NodeView(self, i) for (i, label) in enumerate(self.labels)}
+
+
+class NodeView:
+    # Looks like a node.Node, reading the side tables of a CompactCFG. It has
+    # no analysis results: those are in a Solution, by id.
+    __slots__ = ('graph', 'id')
+
+    def __init__(self, graph: CompactCFG, i: int) -> None:
+        self.graph = graph
+        self.id = i
+
+    label = property(lambda self: self.graph.labels[self.id])
+    stmt = property(lambda self: self.graph.stmts[self.id])
+    expression = property(lambda self: self.graph.expressions[self.id])
+    going_out = property(lambda self: [NodeView(self.graph, j) for j in self.graph.successors(self.id)])
+    coming_in = property(lambda self: [NodeView(self.graph, j) for j in self.graph.predecessors(self.id)])
+
+    def is_exit(self):
+        return self.graph.succ_offsets[self.id] == self.graph.succ_offsets[self.id + 1]
+
+    def __repr__(self):
+        return f"Node(label={self.label})"
+
+    def __hash__(self):
+        return hash(self.label)
+
+    def __eq__(self, other):
+        if isinstance(other, NodeView):
+            return self.label == other.label
+        return False
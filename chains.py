@@ -0,0 +1,108 @@
+from array import array
+from typing import Dict, List, Tuple, Union
+from syntax import *
+from bitvector import Universe, BitVectorLattice
+from cfg import CompactCFG
+from dataflow import SCC, solve
+from ReachingDefinitions import ReachingDefinitions
+
+# Use-def and def-use chains from reaching definitions. A use is a variable
+# occurring in the right-hand side of an assignment or in a condition (once
+# per node, however often it occurs there); its use-def chain is the labels
+# of the assignments whose definition of the variable reaches the node, with
+# UNINITIALIZED for the variable possibly not being assigned yet. The def-use
+# chain of an assignment is the uses its definition reaches.
+#
+# All chains are stored in flat arrays in CSR form (see CompactCFG), so the
+# memory is proportional to the number of uses and chain entries, and the
+# fixpoint is read from the bit vectors of the solver directly instead of
+# sets per node.
+
+UNINITIALIZED = -1 # label in the arrays for the '?' of ReachingDefinitions
+
+
+class DefUseChains:
+
+    def __init__(self, nodes: Dict, cfg: List[Tuple], initial_state=None) -> None:
+        analysis = ReachingDefinitions(initial_state)
+        graph = CompactCFG(nodes, cfg)
+        lattice = BitVectorLattice(Universe(analysis.facts(graph)))
+        (gen, kill) = analysis.gen_kill(graph, lattice)
+        solution = solve(graph, lattice, gen, kill, analysis.boundary(graph, lattice), strategy=SCC)
+
+        self.variables: List[Variable] = [] # variable with each id
+        self.variable_ids: Dict[Variable, int] = {}
+        definitions = {} # variable id -> bits of its definitions
+        for (k, (name, label)) in enumerate(lattice.universe.items):
+            v = self.variable_id(Variable(name))
+            definitions[v] = definitions.get(v, 0) | (1 << k)
+        fact_labels = [UNINITIALIZED if label == '?' else label for (_, label) in lattice.universe.items]
+
+        # Use-def: use u is variable use_variable[u] at node use_label[u], and
+        # reached by the definitions def_labels[def_offsets[u]:def_offsets[u + 1]]
+        self.use_label = array('l')
+        self.use_variable = array('l')
+        self.def_offsets = array('l', [0])
+        self.def_labels = array('l')
+        self.uses: Dict[Tuple[int, int], int] = {} # (label, variable id) -> use
+        reached = {} # fact index -> uses
+        for (i, label) in enumerate(graph.labels):
+            if isinstance(graph.stmts[i], Assignment):
+                expr = graph.stmts[i].expression
+            elif graph.stmts[i] is None and graph.expressions[i] is not None:
+                expr = graph.expressions[i] # a condition
+            else:
+                continue
+            for var in sorted(free_variables(expr), key=lambda var: var.name):
+                v = self.variable_id(var)
+                u = len(self.use_label)
+                self.uses[(label, v)] = u
+                self.use_label.append(label)
+                self.use_variable.append(v)
+                bits = solution.entry[i] & definitions.get(v, 0)
+                while bits:
+                    lowest = bits & -bits
+                    k = lowest.bit_length() - 1
+                    self.def_labels.append(fact_labels[k])
+                    reached.setdefault(k, []).append(u)
+                    bits ^= lowest
+                self.def_offsets.append(len(self.def_labels))
+
+        # Def-use: the uses reached by the assignment with label l are
+        # use_ids[use_offsets[d]:use_offsets[d + 1]] for d = definitions[l]
+        self.definitions: Dict[int, int] = {} # label -> d
+        self.use_offsets = array('l', [0])
+        self.use_ids = array('l')
+        for (k, (_, label)) in enumerate(lattice.universe.items):
+            if label == '?':
+                continue
+            self.definitions[label] = len(self.use_offsets) - 1
+            self.use_ids.extend(reached.get(k, ()))
+            self.use_offsets.append(len(self.use_ids))
+
+    def variable_id(self, var: Variable) -> int:
+        v = self.variable_ids.get(var)
+        if v is None:
+            v = self.variable_ids[var] = len(self.variables)
+            self.variables.append(var)
+        return v
+
+    def reaching(self, label, var: Union[Variable, str]) -> List:
+        # Labels of the definitions reaching the use of var at the node with
+        # label, with '?' if var may be uninitialized there
+        if isinstance(var, str):
+            var = Variable(var)
+        u = self.uses.get((label, self.variable_ids.get(var)))
+        if u is None:
+            raise KeyError(f"{var} is not used at {label}")
+        return ['?' if d == UNINITIALIZED else d for d in self.def_labels[self.def_offsets[u]:self.def_offsets[u + 1]]]
+
+    def reached(self, label) -> List[Tuple]:
+        # The uses (label, variable) the assignment with label reaches
+        d = self.definitions[label]
+        return [(self.use_label[u], self.variables[self.use_variable[u]])
+                for u in self.use_ids[self.use_offsets[d]:self.use_offsets[d + 1]]]
+
+    def __len__(self) -> int:
+        # Number of use-def chain entries
+        return len(self.def_labels)
@@ -0,0 +1,574 @@
+import heapq
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Iterable, List, Set
+from syntax import *
+from node import *
+from bitvector import Universe, BitVectorLattice
+from cfg import CompactCFG, ENTRY, EXIT, strongly_connected_components
+from instrument import Instrumentation, phase
+
+# Monotone framework shared by the analyses: an analysis describes its
+# lattice of facts, direction, meet and local gen/kill, and solve() computes
+# the fixpoint on a CompactCFG
+
+FORWARD = 'forward'
+BACKWARD = 'backward'
+
+# Iteration strategies
+WORKLIST = 'worklist' # revisit only the nodes whose inputs changed
+ROUND_ROBIN = 'round_robin' # sweep all nodes until a sweep changes nothing
+SCC = 'scc' # one strongly connected component after the other, in flow order
+
+# Status of a Solution: the fixpoint, or which limit of its Budget stopped it
+COMPLETE = 'complete'
+ITERATIONS = 'iterations'
+TRANSFERS = 'transfers'
+DEADLINE = 'deadline'
+
+
+class SetLattice:
+    # Lattice of sets of facts, as frozensets
+
+    def __init__(self, universe: Universe) -> None:
+        self.universe = universe
+        self.empty = frozenset()
+        self.full = frozenset(universe.items)
+        self.interned = {} # see to_persistent
+
+    def from_set(self, items: Iterable) -> frozenset:
+        return frozenset(items)
+
+    def to_set(self, value: frozenset) -> set:
+        return set(value)
+
+    def to_persistent(self, value: frozenset) -> frozenset:
+        # The value itself, but one object per distinct value
+        return self.interned.setdefault(value, value)
+
+    def union(self, a: frozenset, b: frozenset) -> frozenset:
+        return a | b
+
+    def intersection(self, a: frozenset, b: frozenset) -> frozenset:
+        return a & b
+
+    def difference(self, a: frozenset, b: frozenset) -> frozenset:
+        return a - b
+
+    def transfer(self, gen: frozenset, kill: frozenset, value: frozenset) -> frozenset:
+        return gen | (value - kill)
+
+    def size(self, value: frozenset) -> int:
+        return len(value)
+
+
+class Solution:
+    # Fixpoint of an analysis, with the values by node id of a CompactCFG
+    def __init__(self, graph: CompactCFG, lattice, gen: List, kill: List, entry: List, exit: List) -> None:
+        self.graph = graph
+        self.lattice = lattice
+        self.gen = gen
+        self.kill = kill
+        self.entry = entry # value at the entry of each node
+        self.exit = exit # value at the exit of each node
+        self.transfers = 0 # number of transfer function applications
+        self.iterations = 0 # number of sweeps (ROUND_ROBIN) or worklist pops (WORKLIST)
+        self.status = COMPLETE
+        self.unfinished: List[int] = [] # ids of the nodes given a safe value, if not COMPLETE
+
+
+class Budget:
+    # Limits for one run of solve(), each None for no limit: the iterations
+    # (as counted in Solution.iterations), the transfer function
+    # applications, and the wall-clock seconds. A solve() that runs out stops
+    # with the status of the limit it hit instead of the fixpoint, see
+    # conservative().
+
+    def __init__(self, iterations: int = None, transfers: int = None, seconds: float = None) -> None:
+        self.iterations = iterations
+        self.transfers = transfers
+        self.seconds = seconds
+
+
+class OutOfBudget(Exception):
+    # Stops solve() from inside its loops
+    def __init__(self, status: str) -> None:
+        super().__init__(status)
+        self.status = status
+
+
+def solve(graph: CompactCFG, lattice, gen: List, kill: List, boundary,
+          must: bool = False, direction: str = FORWARD, strategy: str = WORKLIST,
+          instrument: Instrumentation = None, budget: Budget = None) -> Solution:
+    # Computes the fixpoint of the equations
+    #   in(n) = boundary (at the initial node) meet the outs of the flow predecessors
+    #   out(n) = gen(n) | (in(n) - kill(n))
+    # where the flow predecessors are the CFG predecessors for a forward
+    # analysis and the CFG successors for a backward one (with the final node
+    # as the initial node). meet is intersection if must, otherwise union.
+    # gen and kill are lattice values by node id, computed once beforehand.
+    # With an instrument, the transfers per node are counted and (if tracing)
+    # every transfer is an event. With a budget, the solver gives up when it
+    # runs out, see conservative().
+    n = len(graph)
+    if direction == FORWARD:
+        start = ENTRY
+        (in_offsets, in_nodes) = (graph.pred_offsets, graph.pred_sources)
+        (out_offsets, out_nodes) = (graph.succ_offsets, graph.succ_targets)
+    else:
+        start = EXIT
+        (in_offsets, in_nodes) = (graph.succ_offsets, graph.succ_targets)
+        (out_offsets, out_nodes) = (graph.pred_offsets, graph.pred_sources)
+    meet = lattice.intersection if must else lattice.union
+    transfer = lattice.transfer
+    init = lattice.full if must else lattice.empty
+    before = [init] * n
+    after = [init] * n
+    order = graph.reverse_postorder(backward=(direction == BACKWARD))
+    transfers = 0
+    iterations = 0
+    visits = [0] * n if instrument is not None else None
+    trace = instrument.trace if instrument is not None else None
+    status = COMPLETE
+    unfinished = []
+    if budget is not None:
+        deadline = None if budget.seconds is None else time.perf_counter() + budget.seconds
+
+        def charge(iterations, transfers):
+            # Called before every transfer, with the iteration it belongs to
+            # and the number of transfers before it
+            if budget.iterations is not None and iterations > budget.iterations:
+                raise OutOfBudget(ITERATIONS)
+            if budget.transfers is not None and transfers >= budget.transfers:
+                raise OutOfBudget(TRANSFERS)
+            if deadline is not None and time.perf_counter() >= deadline:
+                raise OutOfBudget(DEADLINE)
+
+    try:
+        if strategy == ROUND_ROBIN:
+            changed = True
+            while changed:
+                changed = False
+                iterations += 1
+                for node in order:
+                    if budget is not None:
+                        charge(iterations, transfers)
+                    value = boundary if node == start else init
+                    for p in in_nodes[in_offsets[node]:in_offsets[node + 1]]:
+                        value = meet(value, after[p])
+                    before[node] = value
+                    new_after = transfer(gen[node], kill[node], value)
+                    transfers += 1
+                    if visits is not None:
+                        visits[node] += 1
+                        if trace is not None:
+                            trace({'event': 'transfer', 'node': graph.labels[node], 'changed': new_after != after[node]})
+                    if new_after != after[node]:
+                        after[node] = new_after
+                        changed = True
+        elif strategy == SCC:
+            # Each component is solved before any node after it is visited, so
+            # nodes outside loops are visited once. Inside a component the
+            # worklist is a heap of positions in reverse postorder, restricted to
+            # the component: for a WHILE program the loop condition comes first,
+            # and the body of an inner loop comes before the rest of the body of
+            # the outer one, so inner loops stabilize before outer ones move on.
+            position = [0] * n
+            for (i, node) in enumerate(order):
+                position[node] = i
+            component_of = [-1] * n
+            queued = bytearray(n)
+            for (c, component) in enumerate(strongly_connected_components(order, out_offsets, out_nodes)):
+                for node in component:
+                    component_of[node] = c
+                if len(component) == 1:
+                    node = component[0]
+                    if node not in out_nodes[out_offsets[node]:out_offsets[node + 1]]:
+                        # Not in a loop: its inputs are final already
+                        if budget is not None:
+                            charge(transfers + 1, transfers)
+                        value = boundary if node == start else init
+                        for p in in_nodes[in_offsets[node]:in_offsets[node + 1]]:
+                            value = meet(value, after[p])
+                        before[node] = value
+                        after[node] = transfer(gen[node], kill[node], value)
+                        transfers += 1
+                        if visits is not None:
+                            visits[node] += 1
+                            if trace is not None:
+                                trace({'event': 'transfer', 'node': graph.labels[node], 'changed': True})
+                        continue
+                worklist = sorted(position[node] for node in component)
+                for node in component:
+                    queued[node] = 1
+                while worklist:
+                    if budget is not None:
+                        charge(transfers + 1, transfers)
+                    node = order[heapq.heappop(worklist)]
+                    queued[node] = 0
+                    value = boundary if node == start else init
+                    for p in in_nodes[in_offsets[node]:in_offsets[node + 1]]:
+                        value = meet(value, after[p])
+                    before[node] = value
+                    new_after = transfer(gen[node], kill[node], value)
+                    transfers += 1
+                    if visits is not None:
+                        visits[node] += 1
+                        if trace is not None:
+                            trace({'event': 'transfer', 'node': graph.labels[node], 'changed': new_after != after[node]})
+                    if new_after != after[node]:
+                        after[node] = new_after
+                        for s in out_nodes[out_offsets[node]:out_offsets[node + 1]]:
+                            if component_of[s] == c and not queued[s]:
+                                queued[s] = 1
+                                heapq.heappush(worklist, position[s])
+            iterations = transfers
+        else:
+            # The worklist is a heap of positions in reverse postorder, so a node
+            # is normally visited after all of its forward predecessors
+            position = [0] * n
+            for (i, node) in enumerate(order):
+                position[node] = i
+            worklist = list(range(len(order)))
+            queued = bytearray(n)
+            for node in order:
+                queued[node] = 1
+            while worklist:
+                if budget is not None:
+                    charge(transfers + 1, transfers)
+                node = order[heapq.heappop(worklist)]
+                queued[node] = 0
+                value = boundary if node == start else init
+                for p in in_nodes[in_offsets[node]:in_offsets[node + 1]]:
+                    value = meet(value, after[p])
+                before[node] = value
+                new_after = transfer(gen[node], kill[node], value)
+                transfers += 1
+                if visits is not None:
+                    visits[node] += 1
+                    if trace is not None:
+                        trace({'event': 'transfer', 'node': graph.labels[node], 'changed': new_after != after[node]})
+                if new_after != after[node]:
+                    after[node] = new_after
+                    for s in out_nodes[out_offsets[node]:out_offsets[node + 1]]:
+                        if not queued[s]:
+                            queued[s] = 1
+                            heapq.heappush(worklist, position[s])
+            iterations = transfers
+    except OutOfBudget as out:
+        status = out.status
+        if strategy != ROUND_ROBIN:
+            iterations = transfers
+        elif status == ITERATIONS:
+            iterations -= 1 # the sweep over the limit never started
+        unfinished = conservative(graph, lattice, gen, kill, boundary, must, direction, order, before, after)
+
+    if direction == FORWARD:
+        solution = Solution(graph, lattice, gen, kill, before, after)
+    else:
+        solution = Solution(graph, lattice, gen, kill, after, before)
+    solution.transfers = transfers
+    solution.iterations = iterations
+    solution.status = status
+    solution.unfinished = unfinished
+    if instrument is not None:
+        instrument.count('iterations', iterations)
+        instrument.count('transfers', transfers)
+        if status != COMPLETE:
+            instrument.count('unfinished', len(unfinished))
+            instrument.event('out_of_budget', status=status, unfinished=len(unfinished))
+        for (i, count) in enumerate(visits):
+            label = graph.labels[i]
+            instrument.transfers[label] = instrument.transfers.get(label, 0) + count
+        entry_sizes = [lattice.size(v) for v in solution.entry]
+        exit_sizes = [lattice.size(v) for v in solution.exit]
+        instrument.sizes.update(entry_total=sum(entry_sizes), entry_max=max(entry_sizes, default=0),
+                                exit_total=sum(exit_sizes), exit_max=max(exit_sizes, default=0))
+    return solution
+
+
+def conservative(graph: CompactCFG, lattice, gen: List, kill: List, boundary, must: bool, direction: str,
+                 order: List[int], before: List, after: List) -> List[int]:
+    # Makes the values of a solve() that stopped early sound. A node whose
+    # value doesn't change when recomputed from its flow predecessors, and
+    # that isn't reachable from a node whose value does, has a value that
+    # can't change anymore: the nodes with such values are closed under flow
+    # predecessors and satisfy their equations, so they have their fixpoint
+    # values already. All the other nodes get the safe value at their input:
+    # every fact for a may analysis, none for a must analysis. Returns the
+    # ids of those nodes.
+    if direction == FORWARD:
+        (start, in_offsets, in_nodes) = (ENTRY, graph.pred_offsets, graph.pred_sources)
+        (out_offsets, out_nodes) = (graph.succ_offsets, graph.succ_targets)
+    else:
+        (start, in_offsets, in_nodes) = (EXIT, graph.succ_offsets, graph.succ_targets)
+        (out_offsets, out_nodes) = (graph.pred_offsets, graph.pred_sources)
+    meet = lattice.intersection if must else lattice.union
+    init = lattice.full if must else lattice.empty
+    unstable = []
+    for node in order:
+        value = boundary if node == start else init
+        for p in in_nodes[in_offsets[node]:in_offsets[node + 1]]:
+            value = meet(value, after[p])
+        before[node] = value
+        if lattice.transfer(gen[node], kill[node], value) != after[node]:
+            unstable.append(node)
+    unfinished = bytearray(len(graph))
+    for node in unstable:
+        unfinished[node] = 1
+    while unstable:
+        node = unstable.pop()
+        for s in out_nodes[out_offsets[node]:out_offsets[node + 1]]:
+            if not unfinished[s]:
+                unfinished[s] = 1
+                unstable.append(s)
+    safe = lattice.empty if must else lattice.full
+    nodes = [node for node in order if unfinished[node]]
+    for node in nodes:
+        before[node] = safe
+        after[node] = lattice.transfer(gen[node], kill[node], safe)
+    return nodes
+
+
+class DataFlowAnalysis(ABC):
+    # Base class of the analyses. It builds the control flow graph of a
+    # program, and runs the analysis described by the subclass on the shared
+    # solver. Subclasses supply the facts of the analysis, their local gen and
+    # kill, and the value at the initial node.
+    direction = FORWARD
+    must = False
+    version = 1 # Bump when the results of the analysis change, see cache.py
+
+    def __init__(self) -> None:
+        self.label = 1
+        self.nodes = {}
+        self.transfer_count = 0 # Number of transfer function applications in the last analysis
+        self.solution: Solution = None # Fixpoint of the last analysis, by node id
+        self.instrument: Instrumentation = None # Collects statistics if set, see instrument.py
+        self.budget: Budget = None # Limits the solver if set; see solution.status afterwards
+
+    # Dealing with statements
+    def create_cfg_statement(self, stmt) -> (Node, list[Node]):
+        # Builds the CFG with an explicit stack of partially built statements
+        # (see cfg_fragment) instead of recursion, so neither long programs
+        # nor deep nesting run into the recursion limit
+        stack = [self.cfg_fragment(stmt)]
+        result = None
+        while stack:
+            try:
+                inner = stack[-1].send(result)
+            except StopIteration as done:
+                stack.pop()
+                result = done.value
+                continue
+            if isinstance(inner, (Skip, Assignment)):
+                # Shortcut for the most common case
+                result = self.cfg_simple_statement(inner)
+            else:
+                stack.append(self.cfg_fragment(inner))
+                result = None
+        return result
+
+    def cfg_simple_statement(self, stmt) -> (Node, list[Node]):
+        node = Node()
+        node.label = self.label
+        node.stmt = stmt
+        logging.debug("Stmt Node created: %s", node.label)
+        return node, [node]
+
+    def cfg_fragment(self, stmt):
+        # Generator building the CFG fragment of one statement: it yields the
+        # inner statements it needs, is sent back their (root, exits), and
+        # finally returns its own (root, exits)
+        if isinstance(stmt, (Skip, Assignment)):
+            return self.cfg_simple_statement(stmt)
+        elif isinstance(stmt, WhileLoop):
+            # diamond with two exits
+            node = Node()
+            node.label = self.label
+            # The inner statements start after the condition's label, whatever
+            # kind of expression the condition is
+            self.label = self.label + 1
+            node.expression = stmt.condition
+            (root, exits) = yield stmt.body
+            node.link(root)
+            for i in exits:
+                i.link(node)
+            return node, [node]
+        elif isinstance(stmt, IfThenElse):
+            node = Node()
+            node.label = self.label
+            # The inner statements start after the condition's label, whatever
+            # kind of expression the condition is
+            self.label = self.label + 1
+            node.expression = stmt.condition
+            (branch_t, exits_t) = yield stmt.true_branch
+            (branch_f, exits_f) = yield stmt.false_branch
+            node.link(branch_f)
+            node.link(branch_t)
+            return node, exits_f + exits_t
+        elif isinstance(stmt, CompoundStatement):
+            first = None
+            prevs = None
+            for s in stmt.statements:
+                (node, exits) = yield s
+                self.label = self.label + 1
+                if first is None:
+                    first = node
+                if prevs is not None:
+                    for p in prevs:
+                        p.link(node)
+                prevs = exits
+            assert first is not None, "Empty CompoundStmt :-("
+            return first, exits
+        else:
+            assert False, stmt
+
+    def mkDFS(self, node: Node, seen: Set[Node]): # -> List[(int,int)]:
+        # Lists the edges in depth first order, using an explicit stack of
+        # (node, remaining successors) instead of recursion
+        output = []
+        if node in seen:
+            return output
+        seen.add(node)
+        if node.label not in self.nodes:
+            self.nodes[node.label] = node
+
+        stack = [(node, iter(node.going_out))]
+        while stack:
+            (current, children) = stack[-1]
+            for i in children:
+                if i.label not in self.nodes:
+                    self.nodes[i.label] = i
+                output.append((current.label, i.label))
+                if i not in seen:
+                    seen.add(i)
+                    stack.append((i, iter(i.going_out)))
+                    break
+            else:
+                stack.pop()
+        return output
+
+    def build_cfg(self, stmt):
+        # Builds the nodes and the edge list of the program, with the final
+        # 'exit' node patched in after all the statements that end it
+        with phase(self.instrument, 'create_cfg'):
+            (root, exits) = self.create_cfg_statement(stmt)
+            the_exit = Node()
+            the_exit.label = "exit"
+            for e in exits:
+                e.link(the_exit)
+        with phase(self.instrument, 'mkDFS'):
+            cfg = self.mkDFS(root, set())
+        if self.instrument is not None:
+            self.instrument.count('nodes', len(self.nodes))
+            self.instrument.count('edges', len(cfg))
+        return self.nodes, cfg
+
+    @abstractmethod
+    def facts(self, graph: CompactCFG) -> Iterable:
+        """
+        All the facts (expressions, definitions, ...) the analysis can find
+        in the program.
+        """
+
+    @abstractmethod
+    def gen_kill(self, graph: CompactCFG, lattice) -> (List, List):
+        """
+        The gen and kill values of every node, by node id, as values of the
+        lattice.
+        """
+
+    # Node by node description of the analysis, used where the whole graph
+    # is not rebuilt (see incremental.py). The kill set of an assignment is
+    # the set of facts affected by the assigned variable.
+
+    @abstractmethod
+    def node_facts(self, label, stmt, expression) -> Iterable:
+        """
+        The facts a single node brings into the program.
+        """
+
+    @abstractmethod
+    def fact_variables(self, fact) -> Iterable:
+        """
+        The variables whose assignment kills the fact.
+        """
+
+    def is_boundary_fact(self, fact) -> bool:
+        """
+        Whether the fact holds at the initial node.
+        """
+        return False
+
+    @abstractmethod
+    def node_gen_kill(self, label, stmt, expression, lattice, killed_by):
+        """
+        The gen and kill values of a single node, where killed_by(variable)
+        gives the facts killed by assigning the variable.
+        """
+
+    def boundary(self, graph: CompactCFG, lattice):
+        """
+        The value at the initial node (the entry of the program for a
+        forward analysis, its exit for a backward one).
+        """
+        return lattice.empty
+
+    def build_compact(self, stmt) -> CompactCFG:
+        # Like build_cfg, but keeps only the CompactCFG of the program, not
+        # the Node graph it is built from
+        (nodes, cfg) = self.build_cfg(stmt)
+        with phase(self.instrument, 'compact_cfg'):
+            graph = CompactCFG(nodes, cfg)
+        self.nodes = {}
+        return graph
+
+    def solve_compact(self, graph: CompactCFG, lattice_type=BitVectorLattice, strategy=WORKLIST,
+                      coalesce: bool = False) -> Solution:
+        # Runs the analysis on the graph alone. The results are the values by
+        # node id in the returned Solution, as lattice values; nothing is
+        # written to Nodes. If coalesce, the solver works on basic blocks
+        # (see blocks.py), with the same results.
+        instrument = self.instrument
+        with phase(instrument, 'facts'):
+            lattice = lattice_type(Universe(self.facts(graph)))
+        with phase(instrument, 'gen_kill'):
+            (gen, kill) = self.gen_kill(graph, lattice)
+        with phase(instrument, 'fixpoint'):
+            if coalesce:
+                from blocks import solve_blocks # blocks.py builds on this module
+                self.solution = solve_blocks(graph, lattice, gen, kill, self.boundary(graph, lattice),
+                                             self.must, self.direction, strategy, instrument, self.budget)
+            else:
+                self.solution = solve(graph, lattice, gen, kill, self.boundary(graph, lattice),
+                                      self.must, self.direction, strategy, instrument, self.budget)
+        self.transfer_count = self.solution.transfers
+        if instrument is not None:
+            instrument.count('facts', len(lattice.universe))
+        return self.solution
+
+    def solve(self, nodes: dict, cfg, lattice_type=BitVectorLattice, strategy=WORKLIST,
+              coalesce: bool = False, persistent: bool = True) -> dict:
+        # solve_compact for the nodes and cfg from mkDFS, filling in the gen,
+        # kill, entry and exit sets of the nodes. Returns the nodes by label,
+        # in reverse postorder. The sets are immutable and shared between
+        # nodes with equal values (see persistent.py), or if not persistent, a
+        # fresh set for every node.
+        with phase(self.instrument, 'compact_cfg'):
+            graph = CompactCFG(nodes, cfg)
+        solution = self.solve_compact(graph, lattice_type, strategy, coalesce)
+        (lattice, gen, kill) = (solution.lattice, solution.gen, solution.kill)
+
+        results = {}
+        to_set = lattice.to_persistent if persistent else lattice.to_set
+        with phase(self.instrument, 'write_back'):
+            for i in graph.reverse_postorder(backward=(self.direction == BACKWARD)):
+                node = nodes[graph.labels[i]]
+                node.gen = to_set(gen[i])
+                node.kill = to_set(kill[i])
+                node.entry = to_set(solution.entry[i])
+                node.exit = to_set(solution.exit[i])
+                results[node.label] = node
+        return results
@@ -0,0 +1,109 @@
+import random
+from typing import List
+from syntax import *
+
+# Seeded generator of WHILE programs of chosen shape, for benchmarks and
+# tests. The same arguments always give the same program. Programs are
+# built bottom up without recursion, so any nesting depth works.
+#
+#   straight  size assignments in a row
+#   nested    size WhileLoops, each the body of the one before
+#   fan       size IfThenElses, each the false branch of the one before
+#   mixed     size statements of all kinds, nested up to depth levels
+#
+# variables is the number of distinct variables, and with it the number of
+# distinct expressions over them.
+
+SHAPES = ('straight', 'nested', 'fan', 'mixed')
+
+OPERATORS = ['+', '-', '*']
+
+
+class ProgramGenerator:
+
+    def __init__(self, seed: int = 0, variables: int = 10) -> None:
+        self.rng = random.Random(seed)
+        self.variables = [Variable(f'v{i}') for i in range(variables)]
+
+    def expression(self) -> Expression:
+        rng = self.rng
+        k = rng.random()
+        if k < 0.15:
+            return Constant(rng.randint(0, 9))
+        elif k < 0.3:
+            return rng.choice(self.variables)
+        left = BinaryOperation(rng.choice(OPERATORS), rng.choice(self.variables), rng.choice(self.variables))
+        if k < 0.8:
+            return left
+        return BinaryOperation(rng.choice(OPERATORS), left, rng.choice(self.variables + [Constant(1)]))
+
+    def condition(self) -> Expression:
+        return BinaryOperation(self.rng.choice(['<', '>', '!=']), self.rng.choice(self.variables), self.expression())
+
+    def assignment(self) -> Assignment:
+        return Assignment(self.rng.choice(self.variables), self.expression())
+
+    def straight(self, size: int) -> CompoundStatement:
+        return CompoundStatement([self.assignment() for _ in range(size)])
+
+    def nested(self, size: int) -> CompoundStatement:
+        # Every loop also has an assignment before and after the inner one
+        body = CompoundStatement([self.assignment()])
+        for _ in range(size):
+            loop = WhileLoop(self.condition(), body)
+            body = CompoundStatement([self.assignment(), loop, self.assignment()])
+        return body
+
+    def fan(self, size: int) -> CompoundStatement:
+        # IF c1 THEN s1 ELSE IF c2 THEN s2 ELSE ... END END
+        branch = CompoundStatement([self.assignment()])
+        for _ in range(size):
+            branch = CompoundStatement([IfThenElse(self.condition(), CompoundStatement([self.assignment()]), branch)])
+        return CompoundStatement([self.assignment()] + list(branch.statements) + [self.assignment()])
+
+    def mixed(self, size: int, depth: int = 4) -> CompoundStatement:
+        # Statements are drawn one at a time into the innermost open block,
+        # which is closed again at random
+        rng = self.rng
+        # Open blocks: [kind, condition, statements, true branch of an IF]
+        stack = [[None, None, [], None]]
+        for _ in range(size):
+            block = stack[-1]
+            k = rng.random()
+            if len(stack) <= depth and k < 0.1:
+                stack.append(['WHILE', self.condition(), [], None])
+            elif len(stack) <= depth and k < 0.2:
+                stack.append(['IF', self.condition(), [], None])
+            elif k < 0.25:
+                block[2].append(Skip())
+            else:
+                block[2].append(self.assignment())
+            while len(stack) > 1 and stack[-1][2] and rng.random() < 0.2:
+                self.close(stack)
+        while len(stack) > 1:
+            self.close(stack)
+        if not stack[0][2]:
+            stack[0][2].append(Skip())
+        return CompoundStatement(stack[0][2])
+
+    def close(self, stack: List) -> None:
+        (kind, condition, statements, true_branch) = stack[-1]
+        if not statements:
+            statements.append(Skip())
+        if kind == 'IF' and true_branch is None:
+            # Now fill the false branch
+            stack[-1][2] = []
+            stack[-1][3] = statements
+            return
+        stack.pop()
+        if kind == 'WHILE':
+            stmt = WhileLoop(condition, CompoundStatement(statements))
+        else:
+            stmt = IfThenElse(condition, CompoundStatement(true_branch), CompoundStatement(statements))
+        stack[-1][2].append(stmt)
+
+
+def generate(shape: str, size: int, seed: int = 0, variables: int = 10) -> CompoundStatement:
+    if shape not in SHAPES:
+        raise ValueError(f"Unknown shape {shape!r}, expected one of {SHAPES}")
+    return getattr(ProgramGenerator(seed, variables), shape)(size)
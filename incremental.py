@@ -0,0 +1,458 @@
+from collections import deque
+from typing import Dict, List, Tuple
+from syntax import *
+from node import *
+from bitvector import Universe, BitVectorLattice
+from dataflow import FORWARD
+from AvailableExpressions import AvailableExpressionsAnalysis
+
+# Incremental reanalysis: the program is edited statement by statement, only
+# the CFG fragment of the edited statement is rebuilt, and the fixpoint is
+# repaired starting from the previous one.
+#
+# Statements are addressed by paths: a path is a tuple of steps from the
+# program down to a statement, where an int step is an index into a
+# CompoundStatement and 'body', 'true' and 'false' step into the body of a
+# WhileLoop and the branches of an IfThenElse. For example (2, 'body', 0) is
+# the first statement in the body of the third statement of the program.
+#
+# The solver works on bit vectors. Repairing a may analysis first removes
+# every fact that might have depended on the edited nodes (over-deletion) and
+# then derives facts again from the remaining ones until the fixpoint is
+# reached. A must analysis is repaired the other way around: facts that might
+# now hold are added first, and then removed again where they don't.
+#
+# A backward analysis is repaired the same way over the reversed edges: the
+# values flow from the 'exit' node along the predecessors, from the exit of
+# every node to its entry.
+
+
+class Fragment:
+    # The part of the CFG built for one statement. parts are the fragments of
+    # the statements inside it, in the order of the steps: the statements of
+    # a CompoundStatement, the body of a WhileLoop, the true and false
+    # branches of an IfThenElse.
+    __slots__ = ('stmt', 'node', 'parts')
+
+    def __init__(self, stmt: Statement, node: Node, parts: List['Fragment']) -> None:
+        self.stmt = stmt
+        self.node = node # own node, None for a CompoundStatement
+        self.parts = parts
+
+    def head(self) -> Node:
+        fragment = self
+        while fragment.node is None:
+            fragment = fragment.parts[0]
+        return fragment.node
+
+    def exits(self) -> List[Node]:
+        if isinstance(self.stmt, CompoundStatement):
+            return self.parts[-1].exits()
+        elif isinstance(self.stmt, IfThenElse):
+            return self.parts[1].exits() + self.parts[0].exits()
+        return [self.node]
+
+    def follow(self) -> Node:
+        # The node control goes to after the statement: it is always the last
+        # successor of the exits of the fragment
+        return self.exits()[0].going_out[-1]
+
+    def nodes(self) -> List[Node]:
+        found = []
+        stack = [self]
+        while stack:
+            fragment = stack.pop()
+            if fragment.node is not None:
+                found.append(fragment.node)
+            stack.extend(fragment.parts)
+        return found
+
+
+def build_fragment(analysis, stmt: Statement) -> Fragment:
+    # Same construction as DataFlowAnalysis.create_cfg_statement, with the
+    # same labels, but keeping the fragment of every statement
+    stack = [(analysis.cfg_fragment(stmt), stmt, [])]
+    result = None
+    while True:
+        (generator, current, parts) = stack[-1]
+        try:
+            inner = generator.send(result)
+        except StopIteration as done:
+            stack.pop()
+            (root, _) = done.value
+            node = None if isinstance(current, CompoundStatement) else root
+            fragment = Fragment(current, node, parts)
+            if not stack:
+                return fragment
+            stack[-1][2].append(fragment)
+            result = done.value
+            continue
+        stack.append((analysis.cfg_fragment(inner), inner, []))
+        result = None
+
+
+class IncrementalAnalysis:
+
+    def __init__(self, program: CompoundStatement, analysis_type=AvailableExpressionsAnalysis) -> None:
+        self.analysis = analysis_type()
+        self.program = program
+        self.universe = Universe()
+        self.lattice = BitVectorLattice(self.universe)
+        self.fact_count = [] # number of nodes bringing in each fact, by index
+        self.kills = {} # variable -> bits of the facts it kills
+        self.assigners = {} # variable -> labels of the nodes assigning it
+        self.preds = {} # label -> predecessor nodes, one per edge
+        self.nodes = {} # label -> node
+        self.gen = {} # label -> gen bits
+        self.kill = {} # label -> kill bits
+        self.entry = {} # label -> entry bits
+        self.exit = {} # label -> exit bits
+        self.boundary_facts = 0 # bits of the facts holding at the initial node
+        self.boundary = 0 # boundary_facts, as of the last update
+        self.recomputed = 0 # nodes visited by the last update
+        self.transfers = 0 # transfer function applications in the last update
+
+        self.the_exit = Node()
+        self.the_exit.label = 'exit'
+        self.fragment = self.build(program)
+        for e in self.fragment.exits():
+            e.link(self.the_exit)
+        self.root = None
+        self.initial = None # the node the boundary value enters at
+        added = self.fragment.nodes() + [self.the_exit]
+        self.update(added, [], set(added))
+
+    # Building fragments
+
+    def build(self, stmt: Statement) -> Fragment:
+        fragment = build_fragment(self.analysis, stmt)
+        # The next fragment must not reuse any of these labels
+        self.analysis.label = self.analysis.label + 1
+        return fragment
+
+    # Edits
+
+    def replace(self, path: Tuple, stmt: Statement) -> int:
+        # Replaces the statement at path. Returns the number of nodes recomputed.
+        (parent, index) = self.locate(path)
+        old = parent.parts[index]
+        new = self.build(stmt)
+        removed = old.nodes()
+        follow = old.follow()
+        sources = self.entering(old)
+        self.redirect(sources, old.head(), new.head())
+        for e in new.exits():
+            e.link(follow)
+        parent.parts[index] = new
+        self.rebuild(path[:-1], index, [stmt], 1)
+        return self.update(new.nodes(), removed, self.changed(sources, follow))
+
+    def insert(self, path: Tuple, stmt: Statement) -> int:
+        # Inserts the statement so that it ends up at path. Returns the number
+        # of nodes recomputed.
+        (parent, index) = self.locate(path)
+        new = self.build(stmt)
+        if index < len(parent.parts):
+            successor = parent.parts[index]
+            follow = successor.head()
+            sources = self.entering(successor)
+        else:
+            follow = parent.parts[-1].follow()
+            sources = parent.parts[-1].exits()
+        self.redirect(sources, follow, new.head())
+        for e in new.exits():
+            e.link(follow)
+        parent.parts.insert(index, new)
+        self.rebuild(path[:-1], index, [stmt], 0)
+        return self.update(new.nodes(), [], self.changed(sources, follow))
+
+    def delete(self, path: Tuple) -> int:
+        # Removes the statement at path. Returns the number of nodes recomputed.
+        (parent, index) = self.locate(path)
+        if len(parent.parts) == 1:
+            raise ValueError("Can't delete the only statement of a CompoundStatement")
+        old = parent.parts[index]
+        removed = old.nodes()
+        follow = old.follow()
+        sources = self.entering(old)
+        self.redirect(sources, old.head(), follow)
+        del parent.parts[index]
+        self.rebuild(path[:-1], index, [], 1)
+        return self.update([], removed, self.changed(sources, follow))
+
+    def locate(self, path: Tuple) -> (Fragment, int):
+        # The fragment of the CompoundStatement holding the statement at path,
+        # and the index of the statement in it
+        fragment = self.fragment
+        for step in path[:-1]:
+            fragment = fragment.parts[self.step_index(fragment, step)]
+        return fragment, path[-1]
+
+    @staticmethod
+    def step_index(fragment: Fragment, step) -> int:
+        if isinstance(step, int):
+            return step
+        return {'body': 0, 'true': 0, 'false': 1}[step]
+
+    def rebuild(self, path: Tuple, index: int, statements: List[Statement], replaced: int) -> None:
+        # Rebuilds the syntax tree along the path to the edited
+        # CompoundStatement, and the statements of the fragments along it
+        fragments = [self.fragment]
+        for step in path:
+            fragments.append(fragments[-1].parts[self.step_index(fragments[-1], step)])
+        stmt = fragments[-1].stmt
+        stmt = CompoundStatement(list(stmt.statements[:index]) + statements + list(stmt.statements[index + replaced:]))
+        fragments[-1].stmt = stmt
+        for (fragment, step) in zip(reversed(fragments[:-1]), reversed(path)):
+            old = fragment.stmt
+            if isinstance(old, CompoundStatement):
+                stmt = CompoundStatement(old.statements[:step] + (stmt,) + old.statements[step + 1:])
+            elif isinstance(old, WhileLoop):
+                stmt = WhileLoop(old.condition, stmt)
+            elif step == 'true':
+                stmt = IfThenElse(old.condition, stmt, old.false_branch)
+            else:
+                stmt = IfThenElse(old.condition, old.true_branch, stmt)
+            fragment.stmt = stmt
+        self.program = stmt
+
+    # Patching the graph
+
+    def entering(self, fragment: Fragment) -> List[Node]:
+        # The nodes with an edge into the fragment from outside of it. Only a
+        # loop has edges into its head from inside, from the end of its body.
+        while fragment.node is None:
+            fragment = fragment.parts[0]
+        inside = fragment.parts[0].exits() if isinstance(fragment.stmt, WhileLoop) else []
+        preds = list(self.preds[fragment.node.label])
+        for p in inside:
+            preds.remove(p)
+        return preds
+
+    def changed(self, sources: List[Node], follow: Node) -> set:
+        # The remaining nodes whose flow predecessors an edit changed: the
+        # node after the edited statement, or backward, the nodes before it
+        if self.analysis.direction == FORWARD:
+            return {follow}
+        return set(sources)
+
+    def redirect(self, sources: List[Node], old: Node, new: Node) -> None:
+        # Moves the edges from sources to old over to new, in place so that
+        # the order of the successors is unchanged
+        for p in sources:
+            p.going_out[p.going_out.index(old)] = new
+            old.coming_in.remove(p)
+            new.coming_in.append(p)
+            self.preds[old.label].remove(p)
+            self.preds.setdefault(new.label, []).append(p)
+
+    # Solving
+
+    def update(self, added: List[Node], removed: List[Node], changed: set) -> int:
+        # Repairs the fixpoint after added nodes were linked into the graph
+        # and removed ones unlinked from it. changed are the remaining nodes
+        # whose flow predecessors changed.
+        analysis = self.analysis
+        linked = set(added) | changed
+        dirty = set(linked)
+        # The bits of the facts whose values may change where the graph
+        # changed: in a bit-vector analysis every fact is solved independently
+        # of the others, and a fact that none of the edited nodes generates or
+        # kills flows through the new fragment exactly as it did through the
+        # old one
+        affected = 0
+        for node in removed:
+            affected |= self.gen[node.label] | self.kill[node.label]
+            self.forget(node, dirty)
+        for node in added:
+            self.nodes[node.label] = node
+            for s in node.going_out:
+                self.preds.setdefault(s.label, []).append(node)
+            self.preds.setdefault(node.label, [])
+            for fact in analysis.node_facts(node.label, node.stmt, node.expression):
+                self.count_fact(fact, 1, dirty)
+            if isinstance(node.stmt, Assignment):
+                self.assigners.setdefault(node.stmt.variable, set()).add(node.label)
+            self.gen[node.label] = 0
+            self.kill[node.label] = 0
+        for node in added:
+            # A must analysis has to start above its fixpoint
+            self.entry[node.label] = self.universe.full if analysis.must else 0
+            self.exit[node.label] = self.entry[node.label]
+        # The initial node of a forward analysis changes with edits at the
+        # start of the program, and its value with the facts in the program
+        self.root = self.fragment.head()
+        initial = self.root if analysis.direction == FORWARD else self.the_exit
+        if initial is not self.initial:
+            if self.initial is not None:
+                linked.add(self.initial)
+            linked.add(initial)
+            self.initial = initial
+        if self.boundary != self.boundary_facts:
+            affected |= self.boundary ^ self.boundary_facts
+            self.boundary = self.boundary_facts
+            linked.add(self.initial)
+        linked = {n for n in linked if n.label in self.nodes}
+        dirty = {n for n in dirty | linked if n.label in self.nodes}
+
+        # Elsewhere only the facts a node's own gen and kill changed for
+        killed_by = lambda var: self.kills.get(var, 0)
+        changes = {}
+        for node in dirty:
+            (gen, kill) = analysis.node_gen_kill(node.label, node.stmt, node.expression, self.lattice, killed_by)
+            changes[node] = (self.gen[node.label] ^ gen) | (self.kill[node.label] ^ kill)
+            self.gen[node.label] = gen
+            self.kill[node.label] = kill
+        for node in added:
+            affected |= self.gen[node.label] | self.kill[node.label]
+        for node in linked:
+            changes[node] |= affected
+        return self.solve(changes)
+
+    def forget(self, node: Node, dirty: set) -> None:
+        analysis = self.analysis
+        for fact in analysis.node_facts(node.label, node.stmt, node.expression):
+            self.count_fact(fact, -1, dirty)
+        if isinstance(node.stmt, Assignment):
+            self.assigners[node.stmt.variable].discard(node.label)
+        for s in node.going_out:
+            if s.label in self.preds:
+                self.preds[s.label] = [p for p in self.preds[s.label] if p is not node]
+            s.coming_in[:] = [p for p in s.coming_in if p is not node]
+        for table in (self.nodes, self.preds, self.gen, self.kill, self.entry, self.exit):
+            table.pop(node.label, None)
+
+    def count_fact(self, fact, delta: int, dirty: set) -> None:
+        # Keeps the number of nodes bringing in each fact. When a fact enters
+        # or leaves the program, the kill sets of the assignments to its
+        # variables change.
+        i = self.universe.add(fact)
+        if i == len(self.fact_count):
+            self.fact_count.append(0)
+        self.fact_count[i] += delta
+        if self.fact_count[i] == (1 if delta > 0 else 0):
+            if self.analysis.is_boundary_fact(fact):
+                self.boundary_facts ^= 1 << i
+            for var in self.analysis.fact_variables(fact):
+                self.kills[var] = self.kills.get(var, 0) ^ (1 << i)
+                dirty.update(self.nodes[label] for label in self.assigners.get(var, ()))
+
+    def flow(self):
+        # (value before the transfer, value after it, flow successors, flow
+        # predecessors) in the direction of the analysis
+        if self.analysis.direction == FORWARD:
+            return self.entry, self.exit, (lambda node: node.going_out), (lambda node: self.preds[node.label])
+        return self.exit, self.entry, (lambda node: self.preds[node.label]), (lambda node: node.going_out)
+
+    def solve(self, changes: Dict) -> int:
+        # changes maps the nodes to start from to the bits of the facts to
+        # recompute for them
+        if self.analysis.must:
+            visited = self.over_add(changes)
+        else:
+            visited = self.over_delete(changes)
+        return self.rederive(visited)
+
+    def over_delete(self, changes: Dict) -> set:
+        # The changed nodes drop their affected facts they don't generate
+        # themselves, and so does everything downstream they got to.
+        # Everything left is part of the new fixpoint.
+        (entry, exit, successors, _) = self.flow()
+        visited = set()
+        removals = deque()
+        for (node, affected) in changes.items():
+            label = node.label
+            lost = exit[label] & affected & ~self.gen[label]
+            entry[label] &= ~affected
+            exit[label] &= ~lost
+            removals.append((node, lost))
+            visited.add(label)
+        while removals:
+            (node, lost) = removals.popleft()
+            for s in successors(node):
+                gone = lost & entry[s.label]
+                if gone:
+                    entry[s.label] &= ~gone
+                    gone &= exit[s.label] & ~self.gen[s.label]
+                    if gone:
+                        exit[s.label] &= ~gone
+                        removals.append((s, gone))
+                    visited.add(s.label)
+        return visited
+
+    def over_add(self, changes: Dict) -> set:
+        # The changed nodes get all their affected facts at their entry, and pass
+        # on all those they don't kill, as far downstream as they get.
+        # Everything is now at or above the new fixpoint.
+        (entry, exit, successors, _) = self.flow()
+        visited = set()
+        additions = deque()
+        for (node, affected) in changes.items():
+            label = node.label
+            entry[label] |= affected
+            exit[label] |= (self.gen[label] | ~self.kill[label]) & affected
+            additions.append((node, exit[label] & affected))
+            visited.add(label)
+        while additions:
+            (node, added) = additions.popleft()
+            for s in successors(node):
+                new = added & ~entry[s.label]
+                if new:
+                    entry[s.label] |= new
+                    new &= ~self.kill[s.label] & ~exit[s.label]
+                    if new:
+                        exit[s.label] |= new
+                        additions.append((s, new))
+                    visited.add(s.label)
+        return visited
+
+    def rederive(self, visited: set) -> int:
+        # Worklist iteration from the visited nodes up to the fixpoint. The
+        # values only grow (may) or shrink (must) from here.
+        (entry, exit, successors, predecessors) = self.flow()
+        must = self.analysis.must
+        worklist = deque(self.nodes[label] for label in visited)
+        queued = set(visited)
+        self.transfers = 0
+        while worklist:
+            node = worklist.popleft()
+            label = node.label
+            queued.discard(label)
+            value = entry[label]
+            if must:
+                if node is self.initial:
+                    value &= self.boundary
+                for p in predecessors(node):
+                    value &= exit[p.label]
+                new_exit = exit[label] & (self.gen[label] | (value & ~self.kill[label]))
+            else:
+                if node is self.initial:
+                    value |= self.boundary
+                for p in predecessors(node):
+                    value |= exit[p.label]
+                new_exit = exit[label] | self.gen[label] | (value & ~self.kill[label])
+            entry[label] = value
+            self.transfers += 1
+            if new_exit != exit[label]:
+                exit[label] = new_exit
+                for s in successors(node):
+                    if s.label not in queued:
+                        queued.add(s.label)
+                        worklist.append(s)
+                        visited.add(s.label)
+        self.recomputed = len(visited)
+        return self.recomputed
+
+    # Results
+
+    def value(self, bits: int) -> set:
+        live = [i for (i, count) in enumerate(self.fact_count) if count]
+        return {self.universe.items[i] for i in live if bits >> i & 1}
+
+    def results(self) -> Dict:
+        # (entry, exit) sets by label
+        return {label: (self.value(self.entry[label]), self.value(self.exit[label])) for label in self.nodes}
+
+    def cfg(self) -> List[Tuple]:
+        # The edges in the depth first order of mkDFS
+        return self.analysis.mkDFS(self.root, set())
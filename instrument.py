@@ -0,0 +1,62 @@
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List
+
+# Instrumentation of the analyses. An analysis with instrument = None (the
+# default) does no bookkeeping at all beyond a None test per phase and per
+# transfer; give it an Instrumentation to collect:
+#
+#   counters   named counts (iterations, transfers, nodes, edges, facts)
+#   phases     wall time per phase of building and solving, in seconds
+#   transfers  transfer function applications per node label
+#   sizes      total and largest entry/exit set sizes of the fixpoint
+#   events     with trace=True, one dict per event, or each passed to the
+#              callback given as trace instead
+#
+# to_dict() and to_json() export all of it.
+
+
+class Instrumentation:
+
+    def __init__(self, trace=False) -> None:
+        self.counters: Dict[str, int] = {}
+        self.phases: Dict[str, float] = {}
+        self.transfers: Dict = {}
+        self.sizes: Dict[str, int] = {}
+        self.events: List[Dict] = []
+        if trace is True:
+            self.trace: Callable = self.events.append
+        else:
+            self.trace = trace or None
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def event(self, kind: str, **fields) -> None:
+        if self.trace is not None:
+            fields['event'] = kind
+            self.trace(fields)
+
+    def to_dict(self) -> Dict:
+        return {'counters': dict(self.counters), 'phases': dict(self.phases),
+                'transfers': {str(label): n for (label, n) in self.transfers.items()},
+                'sizes': dict(self.sizes), 'events': list(self.events)}
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), default=str, **kwargs)
+
+
+def phase(instrument, name: str):
+    # instrument.phase(name), or nothing without an instrument
+    if instrument is None:
+        return nullcontext()
+    return instrument.phase(name)
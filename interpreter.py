@@ -0,0 +1,232 @@
+from typing import Dict, List, Tuple
+from syntax import *
+from AvailableExpressions import AvailableExpressionsAnalysis
+from incremental import Fragment, build_fragment
+from examples import while_with_conditional
+
+# Executes programs. A program is compiled once into Python source for a
+# function, with every variable of the program in a local variable of the
+# function (its registers), and every statement as the Python statement doing
+# the same:
+#
+#   x := 10;                             v0 = 10
+#   WHILE x > 0 DO               =>      while v0 > 0:
+#     x := x - 1                             v0 = v0 - 1
+#
+# so running it costs no more than the same loop written in Python, instead
+# of a dispatch per node of the syntax tree. The operations inside an
+# expression are stored in temporaries one at a time, so that long
+# expressions don't nest in the source:
+#
+#   x := a + b + c;              =>      t1 = v0 + v1
+#                                        v3 = t1 + v2
+#
+# and a WhileLoop whose condition needs them becomes 'while True:' with the
+# test at the top of its body. Python allows only so many nested blocks in
+# one function, so a WhileLoop or IfThenElse nested more than NESTING deep is
+# compiled into a function of its own, which gets and returns the registers
+# in a list.
+#
+# With profile=True, every execution of an Assignment or Skip and every
+# evaluation of a condition is counted, by the label the analyses give the
+# node (see DataFlowAnalysis.cfg_fragment). Statements that follow each other
+# in a CompoundStatement always run equally often, so only the first of them
+# has a counter, which the others share. Counting still slows the program
+# down, so it is off by default.
+#
+# Variables not in the initial state start at 0. Arithmetic is on Python ints,
+# / and % round towards minus infinity like Python's // and %, and a
+# condition holds if its value isn't 0.
+
+NESTING = 12
+
+PYTHON_OPERATORS = {'/': '//'}
+
+
+class Compiled:
+    # A compiled program: run(state) executes it and returns the final state.
+    # counts holds the execution counts by label of all runs so far, if the
+    # program was compiled with profile=True.
+
+    def __init__(self, program: Statement, variables: List[str], source: str, counters: Dict[int, int]) -> None:
+        self.program = program
+        self.variables = variables
+        self.source = source
+        self.counters = counters # label -> the label whose counter it shares
+        self.counts: Dict[int, int] = {}
+        namespace = {}
+        exec(compile(source, '<program>', 'exec'), namespace)
+        self.function = namespace['run']
+
+    def run(self, state: Dict[str, int] = None) -> Dict[str, int]:
+        state = state or {}
+        registers = [state.get(name, 0) for name in self.variables]
+        counts = [0] * (max(self.counters.values(), default=0) + 1)
+        self.function(registers, counts)
+        for (label, counter) in self.counters.items():
+            if counts[counter]:
+                self.counts[label] = self.counts.get(label, 0) + counts[counter]
+        result = dict(state)
+        result.update(zip(self.variables, registers))
+        return result
+
+
+class Generator:
+    # Writes the Python source of a program, see compile_program
+
+    def __init__(self, variables: List[str], profile: bool) -> None:
+        self.registers = {name: f"v{i}" for (i, name) in enumerate(variables)}
+        self.profile = profile
+        self.functions: List[List[str]] = []
+        self.counters: Dict[int, int] = {}
+        self.temporaries = 0
+
+    def expression(self, expr: Expression) -> Tuple[List[str], str]:
+        # The lines computing the inner operations of the expression into
+        # temporaries, and the Python expression of the last one. Bottom up
+        # with a stack, so the depth of the expression doesn't matter.
+        lines = []
+        done = {} # subexpression -> its code, a register, constant or temporary
+        stack = [expr]
+        while stack:
+            e = stack[-1]
+            if e in done:
+                stack.pop()
+            elif isinstance(e, Variable):
+                done[e] = self.registers[e.name]
+            elif isinstance(e, Constant):
+                done[e] = repr(e.value)
+            else:
+                missing = [c for c in (e.left, e.right) if c not in done]
+                if missing:
+                    stack.extend(missing)
+                    continue
+                code = f"{done[e.left]} {PYTHON_OPERATORS.get(e.op, e.op)} {done[e.right]}"
+                if e is not expr:
+                    self.temporaries += 1
+                    lines.append(f"t{self.temporaries} = {code}")
+                    code = f"t{self.temporaries}"
+                done[e] = code
+                stack.pop()
+        return lines, done[expr]
+
+    def value(self, expr: Expression) -> Tuple[List[str], str]:
+        # An assigned value: a comparison is stored as 0 or 1
+        (lines, code) = self.expression(expr)
+        if isinstance(expr, BinaryOperation) and expr.op in RELATIONAL_OPERATORS:
+            code = f"int({code})"
+        return lines, code
+
+    def count(self, fragment: Fragment) -> List[str]:
+        if not self.profile:
+            return []
+        label = fragment.node.label
+        self.counters[label] = label
+        return [f"counts[{label}] += 1"]
+
+    def function(self, lines: List[str]) -> List[str]:
+        # The lines as a function of their own, and the lines calling it
+        name = f"block{len(self.functions) + 1}"
+        registers = ''.join(f"{r}, " for r in self.registers.values())
+        self.functions.append([f"def {name}(registers, counts):"] +
+                              indent([f"({registers}) = registers"] + lines +
+                                     [f"registers[:] = ({registers})"]))
+        return [f"registers[:] = ({registers})",
+                f"{name}(registers, counts)",
+                f"({registers}) = registers"]
+
+    def program(self, fragment: Fragment) -> str:
+        # Bottom up with a stack, like optimize.rebuild: done holds the lines
+        # of every finished fragment and how deep their blocks nest
+        done: Dict[int, Tuple[List[str], int]] = {}
+        stack = [(fragment, False)]
+        while stack:
+            (current, expanded) = stack.pop()
+            if current.parts and not expanded:
+                stack.append((current, True))
+                stack.extend((part, False) for part in current.parts)
+                continue
+            stmt = current.stmt
+            parts = [done.pop(id(part)) for part in current.parts]
+            if isinstance(stmt, CompoundStatement):
+                lines = []
+                leader = None # first of the simple statements just before
+                for (fragment_part, (part, _)) in zip(current.parts, parts):
+                    if fragment_part.node is None or fragment_part.node.stmt is None:
+                        leader = None
+                    elif leader is None or not self.profile:
+                        leader = fragment_part.node.label
+                    else:
+                        # Drop the counter of the statement
+                        self.counters[fragment_part.node.label] = leader
+                        part = part[1:] or ["pass"]
+                    lines.extend(part)
+                done[id(current)] = (lines, max(depth for (_, depth) in parts))
+                continue
+            elif isinstance(stmt, Assignment):
+                (lines, code) = self.value(stmt.expression)
+                done[id(current)] = (self.count(current) + lines + [f"{self.registers[stmt.variable.name]} = {code}"], 0)
+                continue
+            elif isinstance(stmt, Skip):
+                done[id(current)] = (self.count(current) or ["pass"], 0)
+                continue
+            (before, condition) = self.expression(stmt.condition)
+            if isinstance(stmt, WhileLoop):
+                (body, depth) = parts[0]
+                if before:
+                    lines = ["while True:"] + indent(self.count(current) + before +
+                                                     [f"if not ({condition}):", "    break"] + body)
+                else:
+                    lines = self.count(current) + [f"while {condition}:"] + indent(body + self.count(current))
+            else:
+                ((true, depth_t), (false, depth_f)) = parts
+                depth = max(depth_t, depth_f)
+                lines = (self.count(current) + before + [f"if {condition}:"] + indent(true) +
+                         ["else:"] + indent(false))
+            if depth + 1 >= NESTING:
+                (lines, depth) = (self.function(lines), -1)
+            done[id(current)] = (lines, depth + 1)
+        (lines, _) = done[id(fragment)]
+        registers = ''.join(f"{r}, " for r in self.registers.values())
+        main = (["def run(registers, counts):"] +
+                indent([f"({registers}) = registers"] + lines + [f"registers[:] = ({registers})"]))
+        return '\n'.join(line for function in self.functions + [main] for line in function) + '\n'
+
+
+def indent(lines: List[str]) -> List[str]:
+    return ["    " + line for line in lines]
+
+
+def variables(fragment: Fragment) -> List[str]:
+    names = set()
+    for node in fragment.nodes():
+        if node.stmt is not None and node.stmt.variable is not None:
+            names.add(node.stmt.variable.name)
+            names |= {v.name for v in free_variables(node.stmt.expression)}
+        elif node.stmt is None:
+            names |= {v.name for v in free_variables(node.expression)}
+    return sorted(names)
+
+
+def compile_program(program: Statement, profile: bool = False) -> Compiled:
+    fragment = build_fragment(AvailableExpressionsAnalysis(), program)
+    names = variables(fragment)
+    generator = Generator(names, profile)
+    source = generator.program(fragment)
+    return Compiled(program, names, source, generator.counters)
+
+
+def execute(program: Statement, state: Dict[str, int] = None) -> Dict[str, int]:
+    # Compiles and runs the program once
+    return compile_program(program).run(state)
+
+
+def main():
+    compiled = compile_program(while_with_conditional, profile=True)
+    print(compiled.source)
+    print(f"final state: {compiled.run()}")
+    for (label, count) in sorted(compiled.counts.items()):
+        print(f"Node {label}: executed {count} times")
+
+if __name__ == "__main__":
+    main()
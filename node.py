@@ -12,6 +12,11 @@ class Node:
         #self.entry_state = set()  # Analysis state at entry to this node (used for chaotic iteration)
         #self.exit_state = set()  # Analysis state at exit from this node (used for chaotic iteration)
 
+    def link(self, other) -> None:
+        # Adds the edge from this node to other, on both ends
+        self.going_out.append(other)
+        other.coming_in.append(self)
+
     def __iter__(self):
         current = self.head
         while current is not None:
@@ -0,0 +1,206 @@
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+from syntax import *
+from node import *
+from AvailableExpressions import AvailableExpressionsAnalysis
+from LiveVariables import LiveVariables
+from incremental import Fragment, build_fragment
+
+# Program transformations driven by the analyses. Each pass returns a new
+# syntax tree and the number of operations it eliminated.
+#
+# eliminate_common_subexpressions: an arithmetic expression that is available
+# where it is computed (by available expressions) has already been computed
+# on every path there, with the same operands. Every computation of such an
+# expression that isn't redundant itself stores its value in a fresh
+# temporary first, and the redundant ones read the temporary instead:
+#
+#   x := a + b; y := a * b;          t1 := a + b; x := t1; y := a * b;
+#   WHILE y > a + b DO          =>   WHILE y > t1 DO
+#     a := a + 1; x := a + b           a := a + 1; t1 := a + b; x := t1
+#
+# A WhileLoop condition is computed before the loop and again at the end of
+# its body, so its temporaries are stored in both places.
+#
+# eliminate_dead_assignments: an assignment to a variable that isn't live
+# after it (by live variables) is removed, until there are none left, since
+# removing one can make others dead. The variables live after the program
+# are all the variables of the program unless given; given the variables of
+# the original program, it also removes temporaries of the first pass that
+# end up unused.
+
+
+def analyze_fragment(analysis, program: Statement) -> Fragment:
+    # The fragments of the program (see incremental.py), with the analysis
+    # results on their nodes
+    fragment = build_fragment(analysis, program)
+    the_exit = Node()
+    the_exit.label = "exit"
+    for e in fragment.exits():
+        e.link(the_exit)
+    analysis.analyze(analysis.nodes, analysis.mkDFS(fragment.head(), set()))
+    return fragment
+
+
+def block(statements: List[Statement]) -> Statement:
+    # The statements as the body of a WhileLoop or a branch
+    if len(statements) == 1:
+        return statements[0]
+    if statements and isinstance(statements[0], CompoundStatement):
+        return CompoundStatement(list(statements[0].statements) + statements[1:])
+    return CompoundStatement(statements or [Skip()])
+
+
+def rebuild(fragment: Fragment, statement: Callable, condition: Callable) -> Statement:
+    # The program with every Assignment and Skip replaced by the statements
+    # statement(fragment) returns, and the condition of every WhileLoop and
+    # IfThenElse by the second of condition(fragment), after the statements
+    # in the first. Bottom up with a stack, like the CFG construction.
+    done: Dict[int, List[Statement]] = {} # id of a fragment -> its statements
+    stack = [(fragment, False)]
+    while stack:
+        (current, expanded) = stack.pop()
+        if current.parts and not expanded:
+            stack.append((current, True))
+            stack.extend((part, False) for part in current.parts)
+            continue
+        stmt = current.stmt
+        parts = [done.pop(id(part)) for part in current.parts]
+        if isinstance(stmt, CompoundStatement):
+            done[id(current)] = [CompoundStatement([s for part in parts for s in part] or [Skip()])]
+        elif isinstance(stmt, WhileLoop):
+            (before, cond) = condition(current)
+            done[id(current)] = before + [WhileLoop(cond, block(parts[0] + before))]
+        elif isinstance(stmt, IfThenElse):
+            (before, cond) = condition(current)
+            done[id(current)] = before + [IfThenElse(cond, block(parts[0]), block(parts[1]))]
+        else:
+            done[id(current)] = statement(current)
+    return block(done[id(fragment)])
+
+
+def variable_names(fragment: Fragment) -> Set[str]:
+    names = set()
+    for node in fragment.nodes():
+        if isinstance(node.stmt, Assignment):
+            names.add(node.stmt.variable.name)
+            names |= {v.name for v in free_variables(node.stmt.expression)}
+        elif node.stmt is None and node.expression is not None:
+            names |= {v.name for v in free_variables(node.expression)}
+    return names
+
+
+def operations(expr: Expression) -> int:
+    # Number of BinaryOperations in the expression
+    count = 0
+    stack = [expr]
+    while stack:
+        e = stack.pop()
+        if isinstance(e, BinaryOperation):
+            count += 1
+            stack.append(e.left)
+            stack.append(e.right)
+    return count
+
+
+class CommonSubexpressions:
+    # One pass of common subexpression elimination over analysed fragments.
+    # Computations of the expressions in stored are saved in temporaries
+    # (all of them if stored is None); used collects the temporaries read.
+
+    def __init__(self, names: Set[str], stored: Set[Expression] = None) -> None:
+        self.names = names # variable names in use
+        self.stored = stored
+        self.temporaries: Dict[Expression, Variable] = {}
+        self.used: Set[Expression] = set()
+        self.eliminated = 0
+
+    def temporary(self, expr: Expression) -> Variable:
+        var = self.temporaries.get(expr)
+        if var is None:
+            k = len(self.temporaries) + 1
+            while f"t{k}" in self.names:
+                k += 1
+            self.names.add(f"t{k}")
+            var = self.temporaries[expr] = Variable(f"t{k}")
+        return var
+
+    def lower(self, expr: Expression, available: Set[Expression], before: List[Statement]) -> Expression:
+        # The expression reading temporaries for what is available, with the
+        # temporaries of the rest stored by the statements added to before.
+        # Left to right with a stack, so the depth of the expression doesn't
+        # matter: results holds the lowered operands so far.
+        results = []
+        stack = [(expr, False)]
+        while stack:
+            (e, expanded) = stack.pop()
+            if not isinstance(e, BinaryOperation):
+                results.append(e)
+            elif not expanded:
+                if e in available:
+                    self.used.add(e)
+                    self.eliminated += operations(e)
+                    results.append(self.temporary(e))
+                    continue
+                stack.append((e, True))
+                stack.append((e.right, False))
+                stack.append((e.left, False))
+            else:
+                right = results.pop()
+                new = BinaryOperation(e.op, results.pop(), right)
+                if e.op not in RELATIONAL_OPERATORS and (self.stored is None or e in self.stored):
+                    before.append(Assignment(self.temporary(e), new))
+                    available.add(e) # for the rest of this statement
+                    new = self.temporary(e)
+                results.append(new)
+        return results[0]
+
+    def statement(self, fragment: Fragment) -> List[Statement]:
+        stmt = fragment.stmt
+        if not isinstance(stmt, Assignment):
+            return [stmt]
+        before = []
+        expr = self.lower(stmt.expression, set(fragment.node.entry), before)
+        return before + [Assignment(stmt.variable, expr)]
+
+    def condition(self, fragment: Fragment) -> Tuple[List[Statement], Expression]:
+        before = []
+        cond = self.lower(fragment.stmt.condition, set(fragment.node.entry), before)
+        return before, cond
+
+
+def eliminate_common_subexpressions(program: Statement) -> Tuple[Statement, int]:
+    # The program with redundant computations replaced by temporaries, and
+    # the number of operations removed that way
+    fragment = analyze_fragment(AvailableExpressionsAnalysis(), program)
+    names = variable_names(fragment)
+    # The first pass finds the temporaries that are read, the second only
+    # stores those
+    first = CommonSubexpressions(set(names))
+    rebuild(fragment, first.statement, first.condition)
+    if not first.used:
+        return program, 0
+    second = CommonSubexpressions(set(names), first.used)
+    return rebuild(fragment, second.statement, second.condition), second.eliminated
+
+
+def eliminate_dead_assignments(program: Statement, live_at_exit: Iterable[str] = None) -> Tuple[Statement, int]:
+    # The program without the assignments whose value is never used, and
+    # the number of assignments removed
+    if live_at_exit is None:
+        live_at_exit = variable_names(build_fragment(LiveVariables(), program))
+    removed = 0
+    while True:
+        fragment = analyze_fragment(LiveVariables(live_at_exit), program)
+        dead = 0
+
+        def statement(fragment):
+            nonlocal dead
+            stmt = fragment.stmt
+            if isinstance(stmt, Assignment) and stmt.variable.name not in fragment.node.exit:
+                dead += 1
+                return []
+            return [stmt]
+        new = rebuild(fragment, statement, lambda fragment: ([], fragment.stmt.condition))
+        if dead == 0:
+            return program, removed
+        (program, removed) = (new, removed + dead)
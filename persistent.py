@@ -0,0 +1,124 @@
+from collections import abc
+from typing import Hashable, Iterable, Iterator
+
+# Persistent sets for the entry and exit states of the nodes. A FactSet is an
+# immutable set of facts of a Universe, stored as its bit vector (see
+# bitvector.py): the facts themselves are shared with the universe, so a set
+# costs one int, and union, intersection, difference, subset tests and
+# equality between sets of the same universe are single integer operations.
+#
+# Lattices hand out FactSets through to_persistent(), which interns them, so
+# all the nodes with equal states share one object and comparing those is an
+# identity test. Since nothing can change a FactSet, the states of different
+# nodes can share storage without the risk of one node's update corrupting
+# another's state, and without copying.
+#
+# FactSet is an abc.Set, so it compares equal to a set or frozenset with the
+# same facts (and has the same hash as the frozenset), and mixing it with
+# those in |, & and - works as well.
+
+
+class FactSet(abc.Set):
+    __slots__ = ('universe', 'bits', 'hash')
+
+    def __init__(self, universe, bits: int = 0) -> None:
+        self.universe = universe
+        self.bits = bits
+        self.hash = None
+
+    @classmethod
+    def from_items(cls, universe, items: Iterable[Hashable]) -> 'FactSet':
+        return cls(universe, universe.to_bits(items))
+
+    def _from_iterable(self, items: Iterable[Hashable]):
+        # Result of an operation with some other kind of set: a FactSet if
+        # all the facts are in the universe, otherwise a frozenset
+        items = frozenset(items)
+        if all(item in self.universe for item in items):
+            return FactSet(self.universe, self.universe.to_bits(items))
+        return items
+
+    def same_universe(self, other) -> bool:
+        return isinstance(other, FactSet) and other.universe is self.universe
+
+    def __contains__(self, item) -> bool:
+        i = self.universe.index.get(item)
+        return i is not None and (self.bits >> i) & 1 == 1
+
+    def __iter__(self) -> Iterator[Hashable]:
+        items = self.universe.items
+        bits = self.bits
+        while bits:
+            lowest = bits & -bits
+            yield items[lowest.bit_length() - 1]
+            bits ^= lowest
+
+    def __len__(self) -> int:
+        return bin(self.bits).count('1')
+
+    def __bool__(self) -> bool:
+        return self.bits != 0
+
+    def __eq__(self, other) -> bool:
+        if self is other:
+            return True
+        if self.same_universe(other):
+            return self.bits == other.bits
+        return abc.Set.__eq__(self, other)
+
+    def __le__(self, other) -> bool:
+        if self.same_universe(other):
+            return self.bits & ~other.bits == 0
+        return abc.Set.__le__(self, other)
+
+    def __ge__(self, other) -> bool:
+        if self.same_universe(other):
+            return other.bits & ~self.bits == 0
+        return abc.Set.__ge__(self, other)
+
+    def __lt__(self, other) -> bool:
+        return self <= other and self != other
+
+    def __gt__(self, other) -> bool:
+        return self >= other and self != other
+
+    def __or__(self, other):
+        if self.same_universe(other):
+            return FactSet(self.universe, self.bits | other.bits)
+        return abc.Set.__or__(self, other)
+
+    def __and__(self, other):
+        if self.same_universe(other):
+            return FactSet(self.universe, self.bits & other.bits)
+        return abc.Set.__and__(self, other)
+
+    def __sub__(self, other):
+        if self.same_universe(other):
+            return FactSet(self.universe, self.bits & ~other.bits)
+        return abc.Set.__sub__(self, other)
+
+    def __xor__(self, other):
+        if self.same_universe(other):
+            return FactSet(self.universe, self.bits ^ other.bits)
+        return abc.Set.__xor__(self, other)
+
+    __ror__ = __or__
+    __rand__ = __and__
+    __rxor__ = __xor__
+
+    def isdisjoint(self, other) -> bool:
+        if self.same_universe(other):
+            return self.bits & other.bits == 0
+        return abc.Set.isdisjoint(self, other)
+
+    def __hash__(self) -> int:
+        # The same as the hash of the frozenset of the facts
+        if self.hash is None:
+            self.hash = self._hash()
+        return self.hash
+
+    def __repr__(self) -> str:
+        return repr(set(self))
+
+    def __reduce__(self):
+        return (FactSet, (self.universe, self.bits))
@@ -0,0 +1,378 @@
+import mmap
+import struct
+import sys
+from array import array
+from typing import Dict, List, Tuple
+from syntax import *
+from bitvector import Universe
+from cfg import CompactCFG
+
+# Binary file format for a built CFG and the results of an analysis on it,
+# laid out so that a reader can mmap the file and look up single nodes
+# without decoding the rest. All numbers are little endian.
+#
+#   header    magic, version, counts and the offsets of the sections below
+#   terms     the statements, expressions and facts, each written once
+#             (they are hash-consed), children before their parents: an
+#             offset table (u32 per term + 1) and the records
+#   nodes     per node id: label (i64), statement and expression (u32 term
+#             ids, NONE if absent)
+#   succs     successors in CSR form (see CompactCFG): u32 offsets, u32 ids
+#   preds     predecessors, likewise
+#   labels    (label, id) pairs sorted by label, to find a node by label
+#   facts     u32 term id of every fact, by bit index
+#   results   per node id: entry, then exit, as bit vectors over the facts
+#             of `words` u64 each
+#
+# Labels are ints, with 'exit' and the '?' of reaching definitions encoded as
+# negative numbers.
+
+MAGIC = b'WCFG'
+VERSION = 2
+
+HEADER = struct.Struct('<4sHHIIIII8Q')
+NODE = struct.Struct('<qII')
+LABEL = struct.Struct('<qI')
+NONE = 0xFFFFFFFF
+
+EXIT_LABEL = -1
+UNKNOWN_LABEL = -2
+
+# Kinds of term records
+VARIABLE = 0 # name
+INT = 1 # u32 length and that many bytes, signed
+STR = 2 # string value
+BOOL = 3 # u8
+BINARY = 4 # op, left term, right term
+ASSIGNMENT = 5 # variable term, expression term
+SKIP = 6
+DEFINITION = 7 # (name, label) of reaching definitions: name, i64 label
+NAME = 8 # variable name as a fact, as in live variables: string
+
+
+def _encode_label(label) -> int:
+    if label == 'exit':
+        return EXIT_LABEL
+    elif label == '?':
+        return UNKNOWN_LABEL
+    return label
+
+
+def _decode_label(value: int):
+    if value == EXIT_LABEL:
+        return 'exit'
+    elif value == UNKNOWN_LABEL:
+        return '?'
+    return value
+
+
+def _string(s: str) -> bytes:
+    data = s.encode()
+    return struct.pack('<I', len(data)) + data
+
+
+def _int(value: int) -> bytes:
+    # Any int, as the fewest bytes that hold it in two's complement
+    data = value.to_bytes(value.bit_length() // 8 + 1, 'little', signed=True)
+    return struct.pack('<I', len(data)) + data
+
+
+def _u32(values) -> bytes:
+    data = array('I', values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+class TermTable:
+    # Gives every term an id, after the ids of its children
+
+    def __init__(self) -> None:
+        self.ids = {}
+        self.records = []
+
+    def add(self, term) -> int:
+        if term is None:
+            return NONE
+        stack = [term]
+        while stack:
+            t = stack[-1]
+            if t in self.ids:
+                stack.pop()
+                continue
+            missing = [c for c in self.children(t) if c not in self.ids]
+            if missing:
+                stack.extend(missing)
+                continue
+            self.ids[t] = len(self.records)
+            self.records.append(self.record(t))
+            stack.pop()
+        return self.ids[term]
+
+    @staticmethod
+    def children(t) -> Tuple:
+        if isinstance(t, BinaryOperation):
+            return (t.left, t.right)
+        elif isinstance(t, Assignment):
+            return (t.variable, t.expression)
+        return ()
+
+    def record(self, t) -> bytes:
+        ids = self.ids
+        if isinstance(t, Variable):
+            return bytes([VARIABLE]) + _string(t.name)
+        elif isinstance(t, Constant) and type(t.value) is bool:
+            return bytes([BOOL, t.value])
+        elif isinstance(t, Constant) and type(t.value) is int:
+            return bytes([INT]) + _int(t.value)
+        elif isinstance(t, Constant) and type(t.value) is str:
+            return bytes([STR]) + _string(t.value)
+        elif isinstance(t, BinaryOperation):
+            return bytes([BINARY]) + _string(t.op) + struct.pack('<II', ids[t.left], ids[t.right])
+        elif isinstance(t, Assignment):
+            return bytes([ASSIGNMENT]) + struct.pack('<II', ids[t.variable], ids[t.expression])
+        elif isinstance(t, Skip):
+            return bytes([SKIP])
+        elif isinstance(t, str):
+            return bytes([NAME]) + _string(t)
+        elif isinstance(t, tuple) and len(t) == 2:
+            return bytes([DEFINITION]) + _string(t[0]) + struct.pack('<q', _encode_label(t[1]))
+        raise ValueError(f"Can't serialize {t!r}")
+
+
+def save(path: str, nodes: Dict, cfg: List[Tuple]) -> None:
+    # Writes the CFG of nodes and cfg (as produced by build_cfg) with the
+    # entry and exit sets currently on the nodes
+    graph = CompactCFG(nodes, cfg)
+    n = len(graph)
+    terms = TermTable()
+    universe = Universe()
+    for label in graph.labels:
+        for fact in nodes[label].entry:
+            universe.add(fact)
+        for fact in nodes[label].exit:
+            universe.add(fact)
+    words = (len(universe) + 63) // 64
+    facts = [terms.add(fact) for fact in universe.items]
+
+    node_table = b''.join(NODE.pack(_encode_label(label), terms.add(stmt), terms.add(expr))
+                          for (label, stmt, expr) in zip(graph.labels, graph.stmts, graph.expressions))
+    labels = sorted((_encode_label(label), i) for (i, label) in enumerate(graph.labels))
+    results = b''.join(universe.to_bits(nodes[label].entry).to_bytes(words * 8, 'little')
+                       + universe.to_bits(nodes[label].exit).to_bytes(words * 8, 'little')
+                       for label in graph.labels)
+    term_offsets = [0]
+    for record in terms.records:
+        term_offsets.append(term_offsets[-1] + len(record))
+
+    sections = [
+        _u32(term_offsets),
+        b''.join(terms.records),
+        node_table,
+        _u32(graph.succ_offsets) + _u32(graph.succ_targets),
+        _u32(graph.pred_offsets) + _u32(graph.pred_sources),
+        b''.join(LABEL.pack(label, i) for (label, i) in labels),
+        _u32(facts),
+        results,
+    ]
+    offsets = []
+    position = HEADER.size
+    for section in sections:
+        position += -position % 8 # keeps the sections aligned
+        offsets.append(position)
+        position += len(section)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, n, len(graph.succ_targets), len(terms.records), len(facts), words, *offsets))
+        for (offset, section) in zip(offsets, sections):
+            f.write(bytes(offset - f.tell()))
+            f.write(section)
+
+
+class CFGFile:
+    # Read access to a file written by save(). Nodes are addressed by id
+    # (0 is the initial node, 1 'exit', as in CompactCFG); terms are only
+    # decoded when asked for, and kept once decoded.
+
+    def __init__(self, path: str) -> None:
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < HEADER.size:
+            self.data.close()
+            raise ValueError(f"{path} is truncated")
+        (magic, version, _, self.n, self.n_edges, self.n_terms, self.n_facts, self.words, *offsets) = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            self.data.close()
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a CFG file")
+            raise ValueError(f"{path} has version {version}, expected {VERSION}")
+        (self.term_index, self.term_data, self.node_table, self.succs, self.preds,
+         self.labels, self.facts, self.results) = offsets
+        # The results come last, so a file cut short loses (part of) them
+        if self.results + 16 * self.words * self.n > len(self.data):
+            self.data.close()
+            raise ValueError(f"{path} is truncated")
+        self.terms = {} # term id -> decoded term
+
+    def close(self) -> None:
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.n
+
+    def _u32(self, offset: int, i: int) -> int:
+        return struct.unpack_from('<I', self.data, offset + 4 * i)[0]
+
+    def _u32s(self, offset: int, start: int, stop: int) -> Tuple[int, ...]:
+        return struct.unpack_from(f'<{stop - start}I', self.data, offset + 4 * start)
+
+    # Nodes and edges
+
+    def label(self, i: int):
+        return _decode_label(NODE.unpack_from(self.data, self.node_table + NODE.size * i)[0])
+
+    def id(self, label) -> int:
+        # Binary search in the sorted labels
+        key = _encode_label(label)
+        (lo, hi) = (0, self.n)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (found, i) = LABEL.unpack_from(self.data, self.labels + LABEL.size * mid)
+            if found == key:
+                return i
+            elif found < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        raise KeyError(label)
+
+    def successors(self, i: int) -> Tuple[int, ...]:
+        targets = self.succs + 4 * (self.n + 1)
+        return self._u32s(targets, self._u32(self.succs, i), self._u32(self.succs, i + 1))
+
+    def predecessors(self, i: int) -> Tuple[int, ...]:
+        sources = self.preds + 4 * (self.n + 1)
+        return self._u32s(sources, self._u32(self.preds, i), self._u32(self.preds, i + 1))
+
+    def edges(self) -> List[Tuple]:
+        # The edges as (from_label, to_label), in the depth first order of
+        # mkDFS, so the same list build_cfg gave
+        output = []
+        seen = {0}
+        stack = [(0, iter(self.successors(0)))]
+        while stack:
+            (i, children) = stack[-1]
+            for j in children:
+                output.append((self.label(i), self.label(j)))
+                if j not in seen:
+                    seen.add(j)
+                    stack.append((j, iter(self.successors(j))))
+                    break
+            else:
+                stack.pop()
+        return output
+
+    def stmt(self, i: int):
+        return self.term(NODE.unpack_from(self.data, self.node_table + NODE.size * i)[1])
+
+    def expression(self, i: int):
+        return self.term(NODE.unpack_from(self.data, self.node_table + NODE.size * i)[2])
+
+    # Results
+
+    def entry_bits(self, i: int) -> int:
+        start = self.results + 16 * self.words * i
+        return int.from_bytes(self.data[start:start + 8 * self.words], 'little')
+
+    def exit_bits(self, i: int) -> int:
+        start = self.results + 16 * self.words * i + 8 * self.words
+        return int.from_bytes(self.data[start:start + 8 * self.words], 'little')
+
+    def fact(self, k: int):
+        return self.term(self._u32(self.facts, k))
+
+    def to_set(self, bits: int) -> set:
+        result = set()
+        while bits:
+            lowest = bits & -bits
+            result.add(self.fact(lowest.bit_length() - 1))
+            bits ^= lowest
+        return result
+
+    def entry(self, i: int) -> set:
+        return self.to_set(self.entry_bits(i))
+
+    def exit(self, i: int) -> set:
+        return self.to_set(self.exit_bits(i))
+
+    # Terms
+
+    def term(self, t: int):
+        if t == NONE:
+            return None
+        terms = self.terms
+        stack = [t]
+        while stack:
+            k = stack[-1]
+            if k in terms:
+                stack.pop()
+                continue
+            (kind, fields) = self._record(k)
+            if kind in (BINARY, ASSIGNMENT):
+                missing = [c for c in fields[-2:] if c not in terms]
+                if missing:
+                    stack.extend(missing)
+                    continue
+            terms[k] = self._build(kind, fields)
+            stack.pop()
+        return terms[t]
+
+    def _record(self, t: int):
+        data = self.data
+        start = self.term_data + self._u32(self.term_index, t)
+        kind = data[start]
+        start += 1
+        if kind in (VARIABLE, STR, BINARY, DEFINITION, NAME):
+            (length,) = struct.unpack_from('<I', data, start)
+            text = data[start + 4:start + 4 + length].decode()
+            start += 4 + length
+            if kind == BINARY:
+                return kind, (text,) + struct.unpack_from('<II', data, start)
+            elif kind == DEFINITION:
+                return kind, (text, _decode_label(struct.unpack_from('<q', data, start)[0]))
+            return kind, (text,)
+        elif kind == INT:
+            (length,) = struct.unpack_from('<I', data, start)
+            return kind, (int.from_bytes(data[start + 4:start + 4 + length], 'little', signed=True),)
+        elif kind == BOOL:
+            return kind, (bool(data[start]),)
+        elif kind == ASSIGNMENT:
+            return kind, struct.unpack_from('<II', data, start)
+        elif kind == SKIP:
+            return kind, ()
+        raise ValueError(f"Unknown term kind {kind}")
+
+    def _build(self, kind: int, fields: Tuple):
+        terms = self.terms
+        if kind == VARIABLE:
+            return Variable(fields[0])
+        elif kind in (INT, STR, BOOL):
+            return Constant(fields[0])
+        elif kind == BINARY:
+            return BinaryOperation(fields[0], terms[fields[1]], terms[fields[2]])
+        elif kind == ASSIGNMENT:
+            return Assignment(terms[fields[0]], terms[fields[1]])
+        elif kind == SKIP:
+            return Skip()
+        elif kind == NAME:
+            return fields[0]
+        return fields
+
+
+def load(path: str) -> CFGFile:
+    return CFGFile(path)
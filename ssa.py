@@ -0,0 +1,217 @@
+from array import array
+from typing import Dict, List, Set
+from syntax import *
+from cfg import CompactCFG, ENTRY
+
+# Static single assignment form of a CompactCFG: every assignment defines a
+# new value of its variable, a φ at the start of a join node (a WhileLoop
+# condition, the node after an IfThenElse) picks the value of the variable
+# from the predecessor control came from, and every use in a node refers to
+# the single value that reaches it. Analyses of values can then follow the
+# def-use edges between values instead of propagating sets through every
+# node (see sparse_reaching_definitions).
+#
+# Dominators are computed with the iterative algorithm of Cooper, Harvey and
+# Kennedy ("A Simple, Fast Dominance Algorithm"), dominance frontiers with
+# the runner walk from the same paper, φs are placed on the iterated
+# dominance frontiers of the assignments, and renaming walks the dominator
+# tree with an explicit stack.
+#
+# Before the program starts every variable has an initial value, defined at
+# START, a virtual predecessor of the initial node.
+
+START = -1
+
+# Kinds of values
+INITIAL = 'initial'
+ASSIGNMENT = 'assignment'
+PHI = 'phi'
+
+
+def dominators(graph: CompactCFG) -> array:
+    # Immediate dominator of every node id, with idom[ENTRY] = ENTRY and -1
+    # for nodes not reachable from ENTRY
+    order = graph.reverse_postorder()
+    position = [len(order)] * len(graph)
+    for (i, node) in enumerate(order):
+        position[node] = i
+    idom = array('l', [-1]) * len(graph)
+    idom[ENTRY] = ENTRY
+    changed = True
+    while changed:
+        changed = False
+        for node in order[1:]:
+            new = -1
+            for p in graph.predecessors(node):
+                if idom[p] == -1:
+                    continue
+                if new == -1:
+                    new = p
+                    continue
+                # Intersect: walk both up the tree until they meet
+                (a, b) = (p, new)
+                while a != b:
+                    while position[a] > position[b]:
+                        a = idom[a]
+                    while position[b] > position[a]:
+                        b = idom[b]
+                new = a
+            if idom[node] != new:
+                idom[node] = new
+                changed = True
+    return idom
+
+
+def dominance_frontiers(graph: CompactCFG, idom: array) -> List[Set[int]]:
+    # The nodes where the dominance of each node ends: the join nodes with a
+    # predecessor it dominates and which it doesn't strictly dominate. The
+    # initial node counts as a join if it has predecessors at all, as START
+    # is one more.
+    frontiers = [set() for _ in range(len(graph))]
+    for node in range(len(graph)):
+        preds = graph.predecessors(node)
+        if idom[node] == -1 or not (len(preds) >= 2 or (node == ENTRY and len(preds) >= 1)):
+            continue
+        for p in preds:
+            runner = p
+            while runner != idom[node] or (node == ENTRY and runner == ENTRY):
+                if idom[runner] == -1 or node in frontiers[runner]:
+                    break
+                frontiers[runner].add(node)
+                if runner == ENTRY:
+                    break
+                runner = idom[runner]
+    return frontiers
+
+
+class SSA:
+
+    def __init__(self, graph: CompactCFG) -> None:
+        self.graph = graph
+        n = len(graph)
+        self.idom = dominators(graph)
+        self.frontiers = dominance_frontiers(graph, self.idom)
+        self.children: List[List[int]] = [[] for _ in range(n)] # dominator tree
+        for node in range(n):
+            if node != ENTRY and self.idom[node] != -1:
+                self.children[self.idom[node]].append(node)
+
+        # Values, by value id
+        self.variable: List[Variable] = []
+        self.kind: List[str] = []
+        self.node: List[int] = [] # node id of the definition, START for initial values
+        self.initial: Dict[Variable, int] = {} # initial value of each variable
+        self.uses: List[Dict[Variable, int]] = [{} for _ in range(n)] # value of each variable used, by node id
+        self.defs: Dict[int, int] = {} # value defined by each assignment, by node id
+        self.phis: List[Dict[Variable, int]] = [{} for _ in range(n)] # φ value of each variable, by node id
+        self.arguments: Dict[int, List] = {} # φ value -> [(predecessor node id or START, value)]
+        self.users: List[List[int]] = [] # φ values using each value
+
+        # Where each variable is assigned and used
+        assigned = {}
+        for node in range(n):
+            stmt = graph.stmts[node]
+            for var in self.used_variables(node):
+                self.initial_value(var)
+            if isinstance(stmt, Assignment):
+                self.initial_value(stmt.variable)
+                assigned.setdefault(stmt.variable, []).append(node)
+
+        # φs on the iterated dominance frontiers
+        for (var, sites) in assigned.items():
+            worklist = list(sites)
+            placed = set()
+            while worklist:
+                node = worklist.pop()
+                for join in self.frontiers[node]:
+                    if join not in placed:
+                        placed.add(join)
+                        self.phis[join][var] = self.new_value(var, PHI, join)
+                        self.arguments[self.phis[join][var]] = []
+                        worklist.append(join)
+        for (var, value) in self.phis[ENTRY].items():
+            self.add_argument(value, START, self.initial[var])
+        self.rename()
+
+    def used_variables(self, node: int) -> Set[Variable]:
+        stmt = self.graph.stmts[node]
+        if isinstance(stmt, Assignment):
+            return free_variables(stmt.expression)
+        elif stmt is None and self.graph.expressions[node] is not None:
+            return free_variables(self.graph.expressions[node])
+        return set()
+
+    def new_value(self, var: Variable, kind: str, node: int) -> int:
+        self.variable.append(var)
+        self.kind.append(kind)
+        self.node.append(node)
+        self.users.append([])
+        return len(self.variable) - 1
+
+    def initial_value(self, var: Variable) -> int:
+        if var not in self.initial:
+            self.initial[var] = self.new_value(var, INITIAL, START)
+        return self.initial[var]
+
+    def add_argument(self, phi: int, pred: int, value: int) -> None:
+        self.arguments[phi].append((pred, value))
+        self.users[value].append(phi)
+
+    def rename(self) -> None:
+        # Preorder walk of the dominator tree; current[var] is the stack of
+        # values of var defined on the way down
+        graph = self.graph
+        current = {var: [value] for (var, value) in self.initial.items()}
+        stack = [(ENTRY, None)]
+        while stack:
+            (node, pushed) = stack.pop()
+            if pushed is not None:
+                # Leaving the subtree of node
+                for var in pushed:
+                    current[var].pop()
+                continue
+            pushed = []
+            for (var, value) in self.phis[node].items():
+                current[var].append(value)
+                pushed.append(var)
+            for var in self.used_variables(node):
+                self.uses[node][var] = current[var][-1]
+            stmt = graph.stmts[node]
+            if isinstance(stmt, Assignment):
+                value = self.new_value(stmt.variable, ASSIGNMENT, node)
+                self.defs[node] = value
+                current[stmt.variable].append(value)
+                pushed.append(stmt.variable)
+            for s in graph.successors(node):
+                for (var, phi) in self.phis[s].items():
+                    self.add_argument(phi, node, current[var][-1])
+            stack.append((node, pushed))
+            for child in reversed(self.children[node]):
+                stack.append((child, None))
+
+    def value_at(self, label, var: Variable) -> int:
+        # The value of var used at the node with label
+        return self.uses[self.graph.ids[label]][var]
+
+
+def sparse_reaching_definitions(ssa: SSA) -> List[Set]:
+    # For every value, the labels of the assignments it may come from, with
+    # '?' for the initial value: the same as the reaching definitions of its
+    # variable at its uses. Only φs are iterated, along their def-use edges.
+    graph = ssa.graph
+    origins = []
+    for (value, kind) in enumerate(ssa.kind):
+        if kind == INITIAL:
+            origins.append({'?'})
+        elif kind == ASSIGNMENT:
+            origins.append({graph.labels[ssa.node[value]]})
+        else:
+            origins.append(set())
+    worklist = [value for (value, kind) in enumerate(ssa.kind) if kind != PHI]
+    while worklist:
+        value = worklist.pop()
+        for phi in ssa.users[value]:
+            if not origins[value] <= origins[phi]:
+                origins[phi] |= origins[value]
+                worklist.append(phi)
+    return origins
@@ -0,0 +1,175 @@
+from typing import Dict, List, Tuple
+from syntax import *
+from node import *
+from cfg import CompactCFG, EXIT
+from bitvector import Universe, BitVectorLattice
+from dataflow import FORWARD, Solution
+from AvailableExpressions import AvailableExpressionsAnalysis
+from incremental import Fragment, build_fragment
+
+# Elimination solver: the CFG of a program is built from its syntax tree, so
+# instead of iterating over the graph, the transfer functions of whole
+# statements can be composed bottom-up over the tree, and the values of the
+# nodes then follow top-down in a single pass, without iterating at all.
+#
+# Every transfer function of a gen/kill analysis, and every function composed
+# from them below, has the form
+#
+#   f(x) = gen | (x & keep)
+#
+# kept as the pair (gen, keep). A node has keep = full - kill, and
+#
+#   g(f(x))          = (gen_g | (gen_f & keep_g), keep_f & keep_g)
+#   f(x) | g(x)      = (gen_f | gen_g, keep_f | keep_g)
+#   f(x) & g(x)      = (gen_f & gen_g, (keep_f & gen_g) | (gen_f & keep_g) | (keep_f & keep_g))
+#
+# for the meet of a may and a must analysis. These functions are idempotent
+# (f(f(x)) = f(x)) and distribute over the meet, so the value at the
+# condition of a WhileLoop, the fixpoint of
+#
+#   head = x meet body(condition(head))
+#
+# is closed form: head = x meet f(x) for f = body . condition, with x the
+# value coming into the loop. In the direction of the analysis, a statement
+# then maps the value before it to the value after it by
+#
+#   WhileLoop:  condition . (identity meet (body . condition))
+#   IfThenElse: (true meet false) . condition  (forward)
+#               condition . (true meet false)  (backward)
+#
+# and a CompoundStatement by its statements in order (reversed, backward).
+# This is the least fixpoint for a may analysis and the greatest for a must
+# analysis, as solve() computes.
+
+
+def solve_structured(fragment: Fragment, graph: CompactCFG, lattice, gen: List, kill: List, boundary,
+                     must: bool = False, direction: str = FORWARD) -> Solution:
+    # solve() for the program of the fragment (from build_fragment), whose
+    # nodes graph was built from. Returns the same Solution; transfers counts
+    # the transfer functions applied to values in the top-down pass.
+    union = lattice.union
+    intersection = lattice.intersection
+    full = lattice.full
+    identity = (lattice.empty, full)
+
+    def compose(g, f):
+        # g after f
+        return union(g[0], intersection(f[0], g[1])), intersection(f[1], g[1])
+
+    def meet(f, g):
+        if not must:
+            return union(f[0], g[0]), union(f[1], g[1])
+        return (intersection(f[0], g[0]),
+                union(union(intersection(f[1], g[0]), intersection(f[0], g[1])), intersection(f[1], g[1])))
+
+    def apply(f, x):
+        return union(f[0], intersection(x, f[1]))
+
+    ids = graph.ids
+    node = {} # id of a fragment -> (gen, keep) of its own node
+    summary = {} # id of a fragment -> (gen, keep) of the whole statement
+    inner = {} # id of a fragment -> identity meet (body . condition) for a WhileLoop,
+               # true meet false for an IfThenElse
+    stack = [(fragment, False)]
+    while stack:
+        (current, expanded) = stack.pop()
+        if current.parts and not expanded:
+            stack.append((current, True))
+            stack.extend((part, False) for part in current.parts)
+            continue
+        if current.node is not None:
+            i = ids[current.node.label]
+            node[id(current)] = own = (gen[i], lattice.difference(full, kill[i]))
+        parts = [summary[id(part)] for part in current.parts]
+        stmt = current.stmt
+        if isinstance(stmt, CompoundStatement):
+            f = identity
+            for part in (parts if direction == FORWARD else reversed(parts)):
+                f = compose(part, f)
+        elif isinstance(stmt, WhileLoop):
+            inner[id(current)] = meet(identity, compose(parts[0], own))
+            f = compose(own, inner[id(current)])
+        elif isinstance(stmt, IfThenElse):
+            inner[id(current)] = branches = meet(parts[0], parts[1])
+            f = compose(branches, own) if direction == FORWARD else compose(own, branches)
+        else:
+            f = own
+        summary[id(current)] = f
+
+    n = len(graph)
+    first = [None] * n # value of each node before its transfer, in the direction of the analysis
+    second = [None] * n # and after it
+    transfers = 0
+    # The final node starts a backward analysis, and ends a forward one
+    exit_keep = (gen[EXIT], lattice.difference(full, kill[EXIT]))
+    if direction == FORWARD:
+        value = boundary
+    else:
+        (first[EXIT], second[EXIT]) = (boundary, apply(exit_keep, boundary))
+        value = second[EXIT]
+        transfers += 1
+    stack = [(fragment, value)]
+    while stack:
+        (current, x) = stack.pop() # x is the value coming into the statement
+        stmt = current.stmt
+        if isinstance(stmt, CompoundStatement):
+            parts = current.parts if direction == FORWARD else current.parts[::-1]
+            for part in parts:
+                stack.append((part, x))
+                x = apply(summary[id(part)], x)
+            # Pushed in order, but only the values matter, not the order of
+            # visiting the statements
+            continue
+        i = ids[current.node.label]
+        own = node[id(current)]
+        if isinstance(stmt, WhileLoop):
+            first[i] = apply(inner[id(current)], x)
+            second[i] = apply(own, first[i])
+            stack.append((current.parts[0], second[i]))
+        elif isinstance(stmt, IfThenElse):
+            if direction == FORWARD:
+                first[i] = x
+                second[i] = apply(own, x)
+                stack.append((current.parts[0], second[i]))
+                stack.append((current.parts[1], second[i]))
+            else:
+                first[i] = apply(inner[id(current)], x)
+                second[i] = apply(own, first[i])
+                stack.append((current.parts[0], x))
+                stack.append((current.parts[1], x))
+        else:
+            first[i] = x
+            second[i] = apply(own, x)
+        transfers += 1
+    if direction == FORWARD:
+        first[EXIT] = apply(summary[id(fragment)], boundary)
+        second[EXIT] = apply(exit_keep, first[EXIT])
+        transfers += 1
+
+    if direction == FORWARD:
+        solution = Solution(graph, lattice, gen, kill, first, second)
+    else:
+        solution = Solution(graph, lattice, gen, kill, second, first)
+    solution.transfers = transfers
+    solution.iterations = 1
+    return solution
+
+
+def analyze_structured(program: Statement, analysis_type=AvailableExpressionsAnalysis) -> Tuple[List[Tuple], Dict]:
+    # Like batch.analyze_program, with solve_structured: the control flow
+    # graph of the program and {label: (entry, exit)}
+    analysis = analysis_type()
+    fragment = build_fragment(analysis, program)
+    the_exit = Node()
+    the_exit.label = "exit"
+    for e in fragment.exits():
+        e.link(the_exit)
+    cfg = analysis.mkDFS(fragment.head(), set())
+    graph = CompactCFG(analysis.nodes, cfg)
+    lattice = BitVectorLattice(Universe(analysis.facts(graph)))
+    (gen, kill) = analysis.gen_kill(graph, lattice)
+    solution = solve_structured(fragment, graph, lattice, gen, kill, analysis.boundary(graph, lattice),
+                                analysis.must, analysis.direction)
+    to_set = lattice.to_persistent
+    return cfg, {label: (to_set(solution.entry[i]), to_set(solution.exit[i]))
+                 for (i, label) in enumerate(graph.labels)}
@@ -1,135 +1,279 @@
 # Expression types
+import hashlib
+import weakref
 from typing import List
 
 
-class Expression:
-    pass
+# Syntax trees are hash-consed: constructing a node that is structurally equal
+# to a live node returns that same object. The hash is computed once, at
+# construction, and equality is an identity check except for the rare
+# objects that share a hash without being the same node.
+_interned = weakref.WeakValueDictionary()
 
 
-class Variable(Expression):
-    def __init__(self, name: str):
-        self.name = name
+def _intern(cls, key, fields):
+    node = _interned.get(key)
+    if node is None:
+        node = object.__new__(cls)
+        for (name, value) in fields:
+            object.__setattr__(node, name, value)
+        object.__setattr__(node, '_hash', hash(key))
+        _interned[key] = node
+    return node
+
+
+class SyntaxNode:
+    # Common behaviour of all syntax tree nodes. Nodes are immutable, since
+    # structurally equal parts of different programs are shared.
+    __slots__ = ('_hash', '__weakref__')
+    _fields = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
 
-    def __repr__(self):
-        return f"Variable({self.name})"
-    
     def __hash__(self):
-        return hash((self.name, 'Variable'))
+        return self._hash
 
     def __eq__(self, other):
-        return isinstance(other, Variable) and self.name == other.name
+        if self is other:
+            return True
+        if type(self) is not type(other) or self._hash != other._hash:
+            return False
+        return all(getattr(self, f) == getattr(other, f) for f in self._fields)
+
+    def __reduce__(self):
+        # Unpickled nodes go through the constructor, and so are interned too.
+        # A tree goes as the flat table of _flatten, since pickling it node
+        # by node would recurse as deep as the tree is.
+        if isinstance(self, (Variable, Constant)):
+            return (type(self), tuple(getattr(self, f) for f in self._fields))
+        return (_unflatten, (_flatten(self),))
+
+
+class Expression(SyntaxNode):
+    __slots__ = ()
+
+
+class Variable(Expression):
+    __slots__ = ('name',)
+    _fields = ('name',)
+
+    def __new__(cls, name: str):
+        return _intern(cls, (name, 'Variable'), (('name', name),))
+
+    def __repr__(self):
+        return f"Variable({self.name})"
 
 
 class Constant(Expression):
-    def __init__(self, value):
-        self.value = value
+    __slots__ = ('value',)
+    _fields = ('value',)
+
+    def __new__(cls, value):
+        # The type is part of the key so that Constant(1) and Constant(True)
+        # stay different objects
+        node = _interned.get((value, type(value), 'Constant'))
+        if node is None:
+            node = _intern(cls, (value, type(value), 'Constant'), (('value', value),))
+            object.__setattr__(node, '_hash', hash((value, 'Constant')))
+        return node
 
     def __repr__(self):
         return f"Constant({self.value})"
-    
-    def __hash__(self):
-        return hash((self.value, 'Constant'))
-
-    def __eq__(self, other):
-        return isinstance(other, Constant) and self.value == other.value
 
 
 class BinaryOperation(Expression):
-    def __init__(self, op: str, left: Expression, right: Expression):
-        self.op = op
-        self.left = left
-        self.right = right
+    __slots__ = ('op', 'left', 'right')
+    _fields = ('op', 'left', 'right')
+
+    def __new__(cls, op: str, left: Expression, right: Expression):
+        return _intern(cls, (op, left, right, 'BinaryOperation'),
+                       (('op', op), ('left', left), ('right', right)))
 
     def __repr__(self):
         return f"BinaryOperation({self.op}, {self.left}, {self.right})"
-    
-    def __hash__(self):
-        return hash((self.op, self.left, self.right, 'BinaryOperation'))
-
-    def __eq__(self, other):
-        return (isinstance(other, BinaryOperation) and self.op == other.op and 
-                self.left == other.left and self.right == other.right)
 
 
 # Statement types
-class Statement:
-    pass
+class Statement(SyntaxNode):
+    __slots__ = ()
 
 
 class CompoundStatement(Statement):
-    def __init__(self, statements: List[Statement]):
-        self.statements = statements
+    __slots__ = ('statements',)
+    _fields = ('statements',)
+
+    def __new__(cls, statements: List[Statement]):
+        statements = tuple(statements)
+        return _intern(cls, (statements, 'CompoundStatement'), (('statements', statements),))
 
-    '''
-    def __iter__(self):
-        current = self.head
-        while current is not None:
-            yield current
-            current = current.next
-    '''
     def __iter__(self):
         return iter(self.statements)
 
-
     def __repr__(self):
-        return f"CompoundStatement({self.statements})"
-    
-    def __hash__(self):
-        return hash(tuple(self.statements))
-
-    def __eq__(self, other):
-        return isinstance(other, CompoundStatement) and self.statements == other.statements
+        return f"CompoundStatement({list(self.statements)})"
 
 
 class Assignment(Statement):
-    def __init__(self, variable: Variable, expression: Expression):
-        self.variable = variable
-        self.expression = expression
+    __slots__ = ('variable', 'expression')
+    _fields = ('variable', 'expression')
+
+    def __new__(cls, variable: Variable, expression: Expression):
+        return _intern(cls, (variable, expression, 'Assignment'),
+                       (('variable', variable), ('expression', expression)))
 
     def __repr__(self):
         return f"Assignment({self.variable}, {self.expression})"
-    
-    def __hash__(self):
-        return hash((self.variable, self.expression))
-
-    def __eq__(self, other):
-        return isinstance(other, Assignment) and self.variable == other.variable and self.expression == other.expression
 
 
 class WhileLoop(Statement):
-    def __init__(self, condition: Expression, body: CompoundStatement):
-        self.condition = condition
-        self.body = body
+    __slots__ = ('condition', 'body')
+    _fields = ('condition', 'body')
+
+    def __new__(cls, condition: Expression, body: CompoundStatement):
+        return _intern(cls, (condition, body, 'WhileLoop'),
+                       (('condition', condition), ('body', body)))
 
     def __repr__(self):
         return f"WhileLoop({self.condition}, {self.body})"
-    
-    def __hash__(self):
-        return hash((self.condition, self.body))
-
-    def __eq__(self, other):
-        return isinstance(other, WhileLoop) and self.condition == other.condition and self.body == other.body
 
 
 class IfThenElse(Statement):
-    def __init__(self, condition: Expression, true_branch: CompoundStatement, false_branch: CompoundStatement):
-        self.condition = condition
-        self.true_branch = true_branch
-        self.false_branch = false_branch
+    __slots__ = ('condition', 'true_branch', 'false_branch')
+    _fields = ('condition', 'true_branch', 'false_branch')
+
+    def __new__(cls, condition: Expression, true_branch: CompoundStatement, false_branch: CompoundStatement):
+        return _intern(cls, (condition, true_branch, false_branch, 'IfThenElse'),
+                       (('condition', condition), ('true_branch', true_branch), ('false_branch', false_branch)))
 
     def __repr__(self):
         return f"IfThenElse({self.condition}, {self.true_branch}, {self.false_branch})"
 
-    def __hash__(self):
-        return hash((self.condition, self.true_branch, self.false_branch))
-
-    def __eq__(self, other):
-        return (isinstance(other, IfThenElse) and self.condition == other.condition and
-                self.true_branch == other.true_branch and self.false_branch == other.false_branch)
 
 class Skip(Statement):
-    def __init__(self):
-        self.variable = None
-        self.expression = None
+    __slots__ = ()
+    variable = None
+    expression = None
+
+    def __new__(cls):
+        return _intern(cls, ('Skip',), ())
+
     def __repr__(self):
-        return "Skip"
\ No newline at end of file
+        return "Skip"
+
+
+def _flatten(tree: SyntaxNode) -> list:
+    # The nodes of the tree other than variables and constants, children
+    # before their parents, as (class, fields) with each of those nodes among
+    # the fields replaced by its position in the list
+    index = {}
+    table = []
+
+    def encode(v):
+        if isinstance(v, tuple):
+            return tuple(encode(c) for c in v)
+        return index[v] if isinstance(v, SyntaxNode) and not isinstance(v, (Variable, Constant)) else v
+
+    stack = [tree]
+    while stack:
+        n = stack[-1]
+        if n in index:
+            stack.pop()
+            continue
+        values = [getattr(n, f) for f in n._fields]
+        children = [c for v in values for c in (v if isinstance(v, tuple) else (v,))]
+        missing = [c for c in children if isinstance(c, SyntaxNode) and not isinstance(c, (Variable, Constant))
+                   and c not in index]
+        if missing:
+            stack.extend(missing)
+            continue
+        index[n] = len(table)
+        table.append((type(n), tuple(encode(v) for v in values)))
+        stack.pop()
+    return table
+
+
+def _unflatten(table: list) -> SyntaxNode:
+    # The tree of a table from _flatten. Only positions are ints; operators
+    # are strings, and variables and constants are in the table themselves.
+    built = []
+
+    def decode(v):
+        if isinstance(v, tuple):
+            return tuple(decode(c) for c in v)
+        return built[v] if type(v) is int else v
+
+    for (cls, fields) in table:
+        built.append(cls(*(decode(v) for v in fields)))
+    return built[-1]
+
+
+# Relational operators build conditions rather than arithmetic expressions, so
+# they are never available expressions themselves (only their operands can be)
+RELATIONAL_OPERATORS = {'<', '>', '<=', '>=', '==', '!='}
+
+
+def free_variables(expr: Expression) -> set:
+    # All variables occurring anywhere in the expression
+    variables = set()
+    stack = [expr]
+    while stack:
+        e = stack.pop()
+        if isinstance(e, Variable):
+            variables.add(e)
+        elif isinstance(e, BinaryOperation):
+            stack.append(e.left)
+            stack.append(e.right)
+    return variables
+
+
+def subexpressions(expr: Expression) -> set:
+    # All non-trivial arithmetic expressions occurring in the expression
+    found = set()
+    stack = [expr]
+    while stack:
+        e = stack.pop()
+        if isinstance(e, BinaryOperation):
+            if e.op not in RELATIONAL_OPERATORS:
+                found.add(e)
+            stack.append(e.left)
+            stack.append(e.right)
+    return found
+
+
+_digests = weakref.WeakKeyDictionary()
+
+
+def structural_digest(node: SyntaxNode) -> bytes:
+    # SHA-256 of the structure of the tree, the same in every process (unlike
+    # hash(), which is salted for strings). Kept for every node digested, so
+    # a program that shares subtrees with earlier ones only hashes the rest.
+    stack = [node]
+    while stack:
+        n = stack[-1]
+        if n in _digests:
+            stack.pop()
+            continue
+        children = []
+        for f in n._fields:
+            value = getattr(n, f)
+            children.extend(value if isinstance(value, tuple) else [value])
+        missing = [c for c in children if isinstance(c, SyntaxNode) and c not in _digests]
+        if missing:
+            stack.extend(missing)
+            continue
+        h = hashlib.sha256(type(n).__name__.encode())
+        for f in n._fields:
+            value = getattr(n, f)
+            for v in (value if isinstance(value, tuple) else [value]):
+                if isinstance(v, SyntaxNode):
+                    h.update(b'N' + _digests[v])
+                else:
+                    h.update(b'V' + repr((type(v).__name__, v)).encode())
+            h.update(b';')
+        _digests[n] = h.digest()
+        stack.pop()
+    return _digests[node]
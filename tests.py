@@ -1,9 +1,51 @@
+import contextlib
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import random
 import unittest
 
 from AvailableExpressions import *
+from ReachingDefinitions import ReachingDefinitions
+from LiveVariables import LiveVariables
+from cfg import CompactCFG, ENTRY, EXIT, strongly_connected_components
+from bitvector import Universe
+from dataflow import SetLattice, BitVectorLattice, WORKLIST, ROUND_ROBIN, SCC, solve
+from dataflow import Budget, COMPLETE, ITERATIONS, TRANSFERS, DEADLINE
+from incremental import IncrementalAnalysis
+from batch import analyze_batch, analyze_program
+from whileparser import parse, tokenize
+import serialize
+from cache import AnalysisCache
+from generator import generate
+import benchmark
+from instrument import Instrumentation
+from blocks import BasicBlocks
+from chains import DefUseChains
+import vectorized
+from persistent import FactSet
+from optimize import eliminate_common_subexpressions, eliminate_dead_assignments
+from interpreter import compile_program
+from structured import solve_structured, analyze_structured
+from incremental import build_fragment
+from ssa import SSA, PHI, START, sparse_reaching_definitions
+import json
 from examples import *
 
 
+def build_cfg(program):
+    analysis = AvailableExpressionsAnalysis()
+    (root, exits) = analysis.create_cfg_statement(program)
+    the_exit = Node()
+    the_exit.label = "exit"
+    for e in exits:
+        e.link(the_exit)
+    cfg = analysis.mkDFS(root, set())
+    return analysis, analysis.nodes, cfg
+
+
 class TestAvailableExpressionsAnalysis(unittest.TestCase):
 
     def setUp(self):
@@ -16,7 +58,7 @@ class TestAvailableExpressionsAnalysis(unittest.TestCase):
         the_exit.label = "exit"
         the_exit.going_out = []
         for e in exits:
-            e.going_out.append(the_exit)
+            e.link(the_exit)
 
         # Creating the CFG also creates the nodes
         self.cfg = (self.analysis.mkDFS(root, set()))
@@ -63,6 +105,1062 @@ class TestAvailableExpressionsAnalysis(unittest.TestCase):
     def test_analysis(self):
         pass
 
+    def test_worklist_book_example(self):
+        a_plus_b = BinaryOperation('+', Variable('a'), Variable('b'))
+        a_times_b = BinaryOperation('*', Variable('a'), Variable('b'))
+        results = self.analysis.analyze_worklist(self.nodes, self.cfg)
+        # Table 2.1 in Nielson, Nielson & Hankin
+        expected = {1: (set(), {a_plus_b}),
+                    2: ({a_plus_b}, {a_plus_b, a_times_b}),
+                    3: ({a_plus_b}, {a_plus_b}),
+                    4: ({a_plus_b}, set()),
+                    5: (set(), {a_plus_b})}
+        for (label, (entry, exit)) in expected.items():
+            self.assertEqual(results[label].entry, entry)
+            self.assertEqual(results[label].exit, exit)
+
+    def test_worklist_does_less_work(self):
+        self.analysis.solve(self.nodes, self.cfg, strategy=ROUND_ROBIN)
+        chaotic = self.analysis.transfer_count
+        self.analysis.analyze_worklist(self.nodes, self.cfg)
+        self.assertLess(self.analysis.transfer_count, chaotic)
+
+        # Only the nodes inside a loop are visited more than once
+        (analysis, nodes, cfg) = build_cfg(nested_loops)
+        analysis.analyze_worklist(nodes, cfg)
+        self.assertLessEqual(analysis.transfer_count, 2 * len(nodes))
+
+        straight_line = CompoundStatement(
+            [Assignment(Variable(f'x{i}'), BinaryOperation('+', Variable('a'), Variable(f'x{i - 1}')))
+             for i in range(300)])
+        (analysis, nodes, cfg) = build_cfg(straight_line)
+        analysis.analyze_worklist(nodes, cfg)
+        self.assertEqual(analysis.transfer_count, len(nodes))
+
+
+    def test_bitvector_matches_worklist(self):
+        for program in [book_example, increment_loop, conditional_assignment, nested_loops, while_with_conditional]:
+            (analysis, nodes, cfg) = build_cfg(program)
+            expected = {label: (node.entry, node.exit) for (label, node) in analysis.analyze_worklist(nodes, cfg).items()}
+            (analysis, nodes, cfg) = build_cfg(program)
+            results = analysis.analyze_bitvector(nodes, cfg)
+            self.assertEqual({label: (node.entry, node.exit) for (label, node) in results.items()}, expected)
+
+    def test_kill_sets(self):
+        results = self.analysis.analyze(self.nodes, self.cfg)
+        a_plus_b = BinaryOperation('+', Variable('a'), Variable('b'))
+        a_times_b = BinaryOperation('*', Variable('a'), Variable('b'))
+        a_plus_1 = BinaryOperation('+', Variable('a'), Constant(1))
+        self.assertEqual(results[4].kill, {a_plus_b, a_times_b, a_plus_1})
+        self.assertEqual(results[4].gen, set())
+        self.assertEqual(results[5].kill, set())
+
+    def test_nested_operands_are_killed(self):
+        a_plus_b = BinaryOperation('+', Variable('a'), Variable('b'))
+        nested = BinaryOperation('*', a_plus_b, Variable('c'))
+        (analysis, nodes, cfg) = build_cfg(CompoundStatement([
+            Assignment(Variable('x'), nested),
+            Assignment(Variable('a'), Constant(0))]))
+        results = analysis.analyze(nodes, cfg)
+        self.assertEqual(results[1].exit, {a_plus_b, nested})
+        self.assertEqual(results[2].kill, {a_plus_b, nested})
+        self.assertEqual(results[2].exit, set())
+        lattice = SetLattice(Universe([a_plus_b, nested]))
+        index = ExpressionIndex(lattice)
+        self.assertEqual(index.killed_by(Variable('c')), {nested})
+        self.assertEqual(index.killed_by(Variable('z')), set())
+
+
+class TestCFGConstruction(unittest.TestCase):
+
+    def test_examples(self):
+        expected = {increment_loop: [(1, 2), (2, 3), (3, 2), (2, 'exit')],
+                    conditional_assignment: [(1, 3), (3, 'exit'), (1, 2), (2, 'exit')],
+                    nested_loops: [(1, 2), (2, 3), (3, 4), (4, 5), (5, 4), (4, 7), (7, 2), (2, 'exit')],
+                    while_with_conditional: [(1, 2), (2, 3), (3, 4), (4, 5), (5, 7), (7, 3), (5, 6), (6, 3), (3, 'exit')]}
+        for (program, cfg) in expected.items():
+            self.assertEqual(build_cfg(program)[2], cfg)
+
+    def test_branch_exits(self):
+        # Both branches continue from their last statement, not their first
+        program = CompoundStatement([
+            IfThenElse(Variable('c'),
+                       CompoundStatement([Skip(), Skip()]),
+                       CompoundStatement([Skip()])),
+            Skip()])
+        self.assertEqual(build_cfg(program)[2], [(1, 4), (4, 6), (6, 'exit'), (1, 2), (2, 3), (3, 6)])
+
+    def test_long_program(self):
+        program = CompoundStatement([Assignment(Variable('x'), Constant(i)) for i in range(20000)])
+        (_, nodes, cfg) = build_cfg(program)
+        self.assertEqual(len(cfg), 20000)
+        self.assertEqual(cfg[-1], (20000, 'exit'))
+
+    def test_deep_nesting(self):
+        body = CompoundStatement([Skip()])
+        for i in range(3000):
+            if i % 2:
+                body = CompoundStatement([WhileLoop(BinaryOperation('<', Variable('x'), Constant(i)), body)])
+            else:
+                body = CompoundStatement([IfThenElse(Variable('c'), body, CompoundStatement([Skip()]))])
+        (_, nodes, cfg) = build_cfg(body)
+        self.assertEqual(len(nodes), 4502)
+        self.assertEqual(len(cfg), 7501)
+
+
+class TestCompactCFG(unittest.TestCase):
+
+    def test_book_example(self):
+        (_, nodes, cfg) = build_cfg(book_example)
+        graph = CompactCFG(nodes, cfg)
+        self.assertEqual(len(graph), len(nodes))
+        self.assertEqual(graph.labels[ENTRY], 1)
+        self.assertEqual(graph.labels[EXIT], 'exit')
+        self.assertEqual(sorted(graph.edges(), key=cfg.index), cfg)
+        self.assertEqual(list(graph.predecessors(graph.ids[3])), [graph.ids[2], graph.ids[5]])
+        self.assertEqual(list(graph.successors(EXIT)), [])
+
+    def test_without_nodes(self):
+        # The solvers run on the graph alone, and the Node graph is not kept
+        for analysis_type in (AvailableExpressionsAnalysis, ReachingDefinitions, LiveVariables):
+            analysis = analysis_type()
+            (nodes, cfg) = analysis.build_cfg(while_with_conditional)
+            results = analysis.analyze(nodes, cfg)
+            compact = analysis_type()
+            graph = compact.build_compact(while_with_conditional)
+            self.assertEqual(compact.nodes, {})
+            self.assertEqual(graph.depth_first_edges(), cfg)
+            solution = compact.solve_compact(graph)
+            for (i, label) in enumerate(graph.labels):
+                self.assertEqual(solution.lattice.to_set(solution.entry[i]), results[label].entry)
+                self.assertEqual(solution.lattice.to_set(solution.exit[i]), results[label].exit)
+
+    def test_node_view(self):
+        (_, nodes, cfg) = build_cfg(book_example)
+        graph = CompactCFG(nodes, cfg)
+        view = graph.nodes()[3]
+        self.assertEqual(view.expression, nodes[3].expression)
+        self.assertEqual(view.going_out, [graph.node(graph.ids[4]), graph.node(EXIT)])
+        self.assertEqual(view.coming_in, [graph.node(graph.ids[2]), graph.node(graph.ids[5])])
+        self.assertTrue(graph.node(EXIT).is_exit())
+
+
+class TestReachingDefinitions(unittest.TestCase):
+
+    def test_book_example(self):
+        (_, nodes, cfg) = build_cfg(book_example)
+        results = ReachingDefinitions().analyze(nodes, cfg)
+        self.assertEqual(results[1].entry, {('x', '?'), ('y', '?'), ('a', '?'), ('b', '?')})
+        self.assertEqual(results[3].entry, {('x', 1), ('x', 5), ('y', 2), ('a', '?'), ('a', 4), ('b', '?')})
+        self.assertEqual(results[4].exit, {('x', 1), ('x', 5), ('y', 2), ('a', 4), ('b', '?')})
+        self.assertEqual(results['exit'].entry, results[3].exit)
+
+    def test_loop_at_start(self):
+        # The definitions from the loop body reach back to the initial node
+        (_, nodes, cfg) = build_cfg(CompoundStatement([
+            WhileLoop(Variable('x'), CompoundStatement([Assignment(Variable('x'), Constant(0))]))]))
+        results = ReachingDefinitions().analyze(nodes, cfg)
+        self.assertEqual(results[1].entry, {('x', '?'), ('x', 2)})
+
+    def test_initial_state(self):
+        # Definitions from before the program, of variables it may not use
+        (_, nodes, cfg) = build_cfg(parse("x := 1; IF y > 0 THEN z := x ELSE Skip END"))
+        results = ReachingDefinitions(initial_state={('z', 0), ('w', 0), ('y', '?')}).analyze(nodes, cfg)
+        self.assertEqual(results[1].entry, {('z', 0), ('w', 0), ('y', '?')})
+        self.assertEqual(results['exit'].entry, {('x', 1), ('z', 0), ('z', 3), ('w', 0), ('y', '?')})
+
+
+class TestDataFlowEngine(unittest.TestCase):
+
+    def test_strategies_and_lattices_agree(self):
+        for analysis_type in [AvailableExpressionsAnalysis, ReachingDefinitions]:
+            for program in [book_example, increment_loop, conditional_assignment, nested_loops, while_with_conditional]:
+                results = set()
+                for lattice_type in [SetLattice, BitVectorLattice]:
+                    for strategy in [WORKLIST, ROUND_ROBIN, SCC]:
+                        analysis = analysis_type()
+                        (nodes, cfg) = analysis.build_cfg(program)
+                        solved = analysis.solve(nodes, cfg, lattice_type, strategy)
+                        results.add(tuple((label, frozenset(node.entry), frozenset(node.exit))
+                                          for (label, node) in sorted(solved.items(), key=str)))
+                self.assertEqual(len(results), 1)
+
+    def test_components(self):
+        (analysis, nodes, cfg) = build_cfg(nested_loops)
+        graph = CompactCFG(nodes, cfg)
+        components = strongly_connected_components(graph.reverse_postorder(), graph.succ_offsets, graph.succ_targets)
+        self.assertEqual([sorted(graph.labels[i] for i in c) for c in components], [[1], [2, 3, 4, 5, 7], ['exit']])
+
+    def test_scc_visits_code_outside_loops_once(self):
+        program = parse("a := 1; b := a + 1; WHILE a < b DO a := a + 1; WHILE b > a DO b := b - 1 END END; c := a + b; d := c * 2")
+        for analysis_type in [AvailableExpressionsAnalysis, ReachingDefinitions]:
+            counts = []
+            for strategy in [WORKLIST, SCC]:
+                analysis = analysis_type()
+                analysis.instrument = Instrumentation()
+                (nodes, cfg) = analysis.build_cfg(program)
+                analysis.solve(nodes, cfg, strategy=strategy)
+                counts.append(analysis.instrument.transfers)
+            self.assertEqual([counts[1][label] for label in (1, 2, 9, 10, 'exit')], [1, 1, 1, 1, 1])
+            self.assertLessEqual(sum(counts[1].values()), sum(counts[0].values()))
+
+
+class TestHashConsing(unittest.TestCase):
+
+    def test_structurally_equal_nodes_are_shared(self):
+        self.assertIs(Variable('a'), Variable('a'))
+        self.assertIs(BinaryOperation('+', Variable('a'), Variable('b')),
+                      book_example.statements[0].expression)
+        self.assertIs(CompoundStatement([Skip()]), CompoundStatement([Skip()]))
+        self.assertIsNot(Constant(1), Constant(True))
+        self.assertNotEqual(Variable('a'), Constant('a'))
+
+    def test_pickle_round_trip_is_interned(self):
+        self.assertIs(pickle.loads(pickle.dumps(while_with_conditional)), while_with_conditional)
+
+    def test_nodes_are_immutable(self):
+        with self.assertRaises(AttributeError):
+            Variable('a').name = 'b'
+        with self.assertRaises(AttributeError):
+            Variable('a').other = 'b'
+
+
+class TestIncrementalAnalysis(unittest.TestCase):
+    variables = [Variable(name) for name in 'abxy']
+
+    def random_expression(self, rng):
+        if rng.random() < 0.3:
+            return rng.choice(self.variables)
+        return BinaryOperation(rng.choice('+*-'), rng.choice(self.variables), rng.choice(self.variables + [Constant(1)]))
+
+    def random_statement(self, rng, depth=0):
+        k = rng.random()
+        if depth < 2 and k < 0.15:
+            body = [self.random_statement(rng, depth + 1) for _ in range(rng.randint(1, 3))]
+            return WhileLoop(BinaryOperation('<', rng.choice(self.variables), self.random_expression(rng)), CompoundStatement(body))
+        if depth < 2 and k < 0.3:
+            true_branch = [self.random_statement(rng, depth + 1) for _ in range(rng.randint(1, 3))]
+            false_branch = [self.random_statement(rng, depth + 1) for _ in range(rng.randint(1, 2))]
+            return IfThenElse(self.random_expression(rng), CompoundStatement(true_branch), CompoundStatement(false_branch))
+        if k < 0.35:
+            return Skip()
+        return Assignment(rng.choice(self.variables), self.random_expression(rng))
+
+    def paths(self, stmt, prefix=()):
+        # (path, length of the enclosing compound) of every statement
+        result = []
+        for (i, s) in enumerate(stmt.statements):
+            result.append((prefix + (i,), len(stmt.statements)))
+            if isinstance(s, WhileLoop):
+                result += self.paths(s.body, prefix + (i, 'body'))
+            if isinstance(s, IfThenElse):
+                result += self.paths(s.true_branch, prefix + (i, 'true'))
+                result += self.paths(s.false_branch, prefix + (i, 'false'))
+        return result
+
+    def assertMatchesScratch(self, inc, analysis_type):
+        # Labels differ after edits, so nodes are matched up by the order in
+        # which the edge lists first mention them
+        analysis = analysis_type()
+        (nodes, cfg) = analysis.build_cfg(inc.program)
+        analysis.solve(nodes, cfg)
+        inc_cfg = inc.cfg()
+        order = lambda edges: list(dict.fromkeys(label for edge in edges for label in edge))
+        labels = dict(zip(order(inc_cfg), order(cfg)))
+        self.assertEqual([(labels[a], labels[b]) for (a, b) in inc_cfg], cfg)
+        relabel = lambda facts: facts
+        if analysis_type is ReachingDefinitions:
+            relabel = lambda facts: {(name, l if l == '?' else labels[l]) for (name, l) in facts}
+        for (label, (entry, exit)) in inc.results().items():
+            self.assertEqual(relabel(entry), nodes[labels[label]].entry)
+            self.assertEqual(relabel(exit), nodes[labels[label]].exit)
+
+    def test_random_edits_match_scratch(self):
+        for analysis_type in (AvailableExpressionsAnalysis, ReachingDefinitions, LiveVariables):
+            for seed in range(60):
+                rng = random.Random(seed)
+                inc = IncrementalAnalysis(CompoundStatement([self.random_statement(rng) for _ in range(rng.randint(1, 6))]), analysis_type)
+                self.assertMatchesScratch(inc, analysis_type)
+                for _ in range(6):
+                    (path, length) = rng.choice(self.paths(inc.program))
+                    k = rng.random()
+                    if k < 0.4:
+                        inc.replace(path, self.random_statement(rng))
+                    elif k < 0.7:
+                        inc.insert(path[:-1] + (rng.randint(0, length),), self.random_statement(rng))
+                    elif length > 1:
+                        inc.delete(path)
+                    self.assertMatchesScratch(inc, analysis_type)
+
+    def test_edits_are_local(self):
+        n = 2000
+        program = CompoundStatement([Assignment(Variable(f'x{i % 50}'), BinaryOperation('+', Variable(f'x{(i + 1) % 50}'), Variable(f'x{(i + 7) % 50}'))) for i in range(n)])
+        for analysis_type in (AvailableExpressionsAnalysis, ReachingDefinitions, LiveVariables):
+            inc = IncrementalAnalysis(program, analysis_type)
+            self.assertLess(inc.replace((n // 2,), Assignment(Variable('x3'), BinaryOperation('*', Variable('x4'), Variable('x5')))), n // 10)
+            self.assertLess(inc.insert((n // 3,), Skip()), 10)
+            self.assertLess(inc.delete((n // 4,)), n // 10)
+
+    def test_backward(self):
+        # Repaired along the predecessors, with the boundary at 'exit'
+        analysis_type = lambda: LiveVariables(live_at_exit=['y', 'z'])
+        inc = IncrementalAnalysis(book_example, analysis_type)
+        self.assertEqual(inc.results()['exit'], ({'y', 'z'}, {'y', 'z'}))
+        inc.replace((1,), Assignment(Variable('y'), Variable('x')))
+        inc.insert((0,), Assignment(Variable('b'), Constant(2)))
+        self.assertMatchesScratch(inc, analysis_type)
+        self.assertEqual(inc.results()['exit'], ({'y', 'z'}, {'y', 'z'}))
+        self.assertEqual(inc.results()[inc.root.label][0], {'a', 'z'})
+
+    def test_missing_node_hooks(self):
+        # An analysis without the node by node description can't be created
+        class Incomplete(DataFlowAnalysis):
+            def facts(self, graph):
+                return []
+
+            def gen_kill(self, graph, lattice):
+                return [], []
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_delete_last_statement(self):
+        inc = IncrementalAnalysis(CompoundStatement([Skip()]))
+        with self.assertRaises(ValueError):
+            inc.delete((0,))
+
+
+class TestBatch(unittest.TestCase):
+    programs = [book_example, increment_loop, conditional_assignment, nested_loops, while_with_conditional]
+
+    def test_pool_matches_serial(self):
+        expected = [(i, analyze_program(program)) for (i, program) in enumerate(self.programs)]
+        self.assertEqual(list(analyze_batch(self.programs, processes=1)), expected)
+        self.assertEqual(list(analyze_batch(self.programs, processes=2, chunksize=2)), expected)
+        self.assertEqual(sorted(analyze_batch(self.programs, processes=2, ordered=False), key=lambda r: r[0]), expected)
+
+    def test_fresh_analysis_per_program(self):
+        # Used to pick up labels and nodes from the previous program
+        results = [cfg for (_, (cfg, _)) in analyze_batch([book_example, book_example], processes=1)]
+        self.assertEqual(results[0], [(1, 2), (2, 3), (3, 4), (4, 5), (5, 3), (3, 'exit')])
+        self.assertEqual(results[1], results[0])
+
+    def test_reaching_definitions(self):
+        [(_, (_, results))] = analyze_batch([book_example], ReachingDefinitions, processes=2)
+        self.assertIn(('x', 1), results['exit'][0])
+
+    def test_deep_nesting(self):
+        # Programs are pickled to the workers, which used to recurse as deep as they nest
+        program = generate('nested', 2000)
+        self.assertIs(pickle.loads(pickle.dumps(program)), program)
+        self.assertEqual(list(analyze_batch([program], processes=2)), [(0, analyze_program(program))])
+
+
+class TestWhileParser(unittest.TestCase):
+
+    def test_examples(self):
+        self.assertIs(parse("x := a + b;\ny := a * b;\nWHILE y > a + b DO\n  a := a + 1;\n  x := a + b\nEND"), book_example)
+        self.assertIs(parse("IF x < 5 THEN y := 1 ELSE y := 0 END"), conditional_assignment)
+        source = "x := 10; y := 0;\nWHILE x > 0 DO\n  x := x - 1; # count down\n  IF x % 2 THEN y := y + 1 ELSE Skip END\nEND;"
+        self.assertIs(parse(source), while_with_conditional)
+
+    def test_precedence(self):
+        expected = BinaryOperation('<', BinaryOperation('-', BinaryOperation('*', Variable('a'), Variable('b')), Constant(-1)),
+                                   BinaryOperation('*', BinaryOperation('+', Variable('c'), Variable('d')), Variable('e')))
+        self.assertIs(parse("x := a * b - -1 < (c + d) * e").statements[0].expression, expected)
+
+    def test_if_without_else(self):
+        self.assertIs(parse("IF x THEN y := 1 END").statements[0].false_branch, CompoundStatement([Skip()]))
+
+    def test_small_chunks(self):
+        source = "".join(f"x{i} := x{i + 1} + {i};\nWHILE x{i} < 10 DO Skip END;\n" for i in range(200))
+        self.assertIs(parse(io.StringIO(source), chunk_size=5), parse(source))
+
+    def test_single_line_chunks(self):
+        # Without newlines the chunks are still cut between tokens
+        source = " ".join(f"x{i} := x{i + 1} <= {i} * (y - 1); WHILE x{i} != 10 DO Skip END;" for i in range(200))
+        chunks = list(tokenize(io.StringIO(source), chunk_size=16))
+        self.assertGreater(len(chunks), 100)
+        self.assertLess(max(len(''.join(chunk)) for chunk in chunks), 32)
+        self.assertIs(parse(io.StringIO(source), chunk_size=7), parse(source))
+        commented = "x := 1; # " + "long comment " * 100 + "\ny := 2 # last"
+        self.assertIs(parse(io.StringIO(commented), chunk_size=7), parse("x := 1; y := 2"))
+
+    def test_deep_nesting(self):
+        depth = 5000
+        program = parse("WHILE x < 1 DO " * depth + "x := x + 1" + " END" * depth)
+        for _ in range(depth):
+            program = program.statements[0].body
+        self.assertIs(program.statements[0], Assignment(Variable('x'), BinaryOperation('+', Variable('x'), Constant(1))))
+
+    def test_errors(self):
+        for (source, message) in [("x := 1;\n\ny := $", "line 3"), ("x = 1", "':='"), ("WHILE x DO y := 1", "'END'"),
+                                  ("x := (1", "parentheses"), ("x := 1 y := 2", "';'"), ("END", "statement")]:
+            with self.assertRaisesRegex(SyntaxError, message):
+                parse(source)
+
+
+class TestSerialization(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix='.cfg')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        for analysis_type in (AvailableExpressionsAnalysis, ReachingDefinitions):
+            for program in (book_example, while_with_conditional):
+                analysis = analysis_type()
+                (nodes, cfg) = analysis.build_cfg(program)
+                analysis.analyze(nodes, cfg)
+                serialize.save(self.path, nodes, cfg)
+                with serialize.load(self.path) as f:
+                    self.assertEqual(len(f), len(nodes))
+                    self.assertEqual(f.edges(), cfg)
+                    for (label, node) in nodes.items():
+                        i = f.id(label)
+                        self.assertEqual(f.label(i), label)
+                        self.assertIs(f.stmt(i), node.stmt)
+                        self.assertIs(f.expression(i), node.expression)
+                        self.assertEqual([f.label(j) for j in f.successors(i)], [s.label for s in node.going_out])
+                        self.assertEqual(f.entry(i), node.entry)
+                        self.assertEqual(f.exit(i), node.exit)
+
+    def test_lookup_decodes_only_what_it_needs(self):
+        (analysis, nodes, cfg) = build_cfg(book_example)
+        analysis.analyze(nodes, cfg)
+        serialize.save(self.path, nodes, cfg)
+        with serialize.load(self.path) as f:
+            self.assertEqual(f.entry(f.id(3)), {BinaryOperation('+', Variable('a'), Variable('b'))})
+            self.assertEqual(len(f.terms), 3)
+
+    def test_bad_version(self):
+        (analysis, nodes, cfg) = build_cfg(increment_loop)
+        serialize.save(self.path, nodes, cfg)
+        with open(self.path, 'r+b') as f:
+            f.seek(4)
+            f.write(bytes([99]))
+        with self.assertRaisesRegex(ValueError, 'version'):
+            serialize.load(self.path)
+
+    def test_large_constants(self):
+        # Ints of any size, not just 64 bit
+        program = parse("x := a + 100000000000000000000000000000; y := a - 9223372036854775808; z := a * -1")
+        (analysis, nodes, cfg) = build_cfg(program)
+        analysis.analyze(nodes, cfg)
+        serialize.save(self.path, nodes, cfg)
+        with serialize.load(self.path) as f:
+            for (label, node) in nodes.items():
+                self.assertIs(f.stmt(f.id(label)), node.stmt)
+                self.assertEqual(f.exit(f.id(label)), node.exit)
+
+    def test_truncated(self):
+        (analysis, nodes, cfg) = build_cfg(book_example)
+        analysis.analyze(nodes, cfg)
+        serialize.save(self.path, nodes, cfg)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for size in (0, 10, serialize.HEADER.size, len(data) - 1):
+            with open(self.path, 'wb') as f:
+                f.write(data[:size])
+            with self.assertRaises(ValueError):
+                serialize.load(self.path)
+
+
+class TestAnalysisCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hit_returns_stored_results(self):
+        cache = AnalysisCache(self.directory)
+        for analysis_type in (AvailableExpressionsAnalysis, ReachingDefinitions):
+            (cfg, results) = cache.analyze(book_example, analysis_type)
+            self.assertEqual((cfg, results), analyze_program(book_example, analysis_type))
+            # Another process would find it as well
+            self.assertEqual(AnalysisCache(self.directory).analyze(book_example, analysis_type), (cfg, results))
+        self.assertEqual(cache.stats(), {'hits': 0, 'misses': 2, 'evictions': 0})
+        cache.analyze(parse("x := a + b; y := a * b; WHILE y > a + b DO a := a + 1; x := a + b END"))
+        self.assertEqual(cache.hits, 1)
+
+    def test_name_facts(self):
+        # The facts of live variables are plain strings
+        cache = AnalysisCache(self.directory)
+        expected = analyze_program(book_example, LiveVariables)
+        self.assertEqual(cache.analyze(book_example, LiveVariables), expected)
+        other = AnalysisCache(self.directory)
+        self.assertEqual(other.analyze(book_example, LiveVariables), expected)
+        self.assertEqual(other.hits, 1)
+
+    def test_truncated_file(self):
+        # A file cut short, say by a full disk, is analysed again
+        cache = AnalysisCache(self.directory)
+        expected = cache.analyze(book_example)
+        path = cache.path(cache.key(book_example, AvailableExpressionsAnalysis))
+        for size in (0, 20):
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+            self.assertEqual(AnalysisCache(self.directory).analyze(book_example), expected)
+
+    def test_key(self):
+        cache = AnalysisCache(self.directory)
+        self.assertEqual(cache.key(book_example, ReachingDefinitions), cache.key(parse("x := a + b; y := a * b; WHILE y > a + b DO a := a + 1; x := a + b END"), ReachingDefinitions))
+        self.assertNotEqual(cache.key(book_example, ReachingDefinitions), cache.key(book_example, AvailableExpressionsAnalysis))
+        self.assertNotEqual(cache.key(parse("x := 1"), ReachingDefinitions), cache.key(parse("x := 2"), ReachingDefinitions))
+
+    def test_least_recently_used_evicted(self):
+        cache = AnalysisCache(self.directory)
+        paths = []
+        for (age, program) in enumerate([increment_loop, book_example, while_with_conditional]):
+            cache.analyze(program)
+            paths.append(cache.path(cache.key(program, AvailableExpressionsAnalysis)))
+            os.utime(paths[-1], ns=(age, age))
+        cache.analyze(increment_loop) # now the most recently used
+        cache.max_bytes = sum(os.path.getsize(path) for path in paths) - 1
+        cache.evict()
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 3, 'evictions': 1})
+        self.assertEqual([os.path.exists(path) for path in paths], [True, False, True])
+
+
+class TestGenerator(unittest.TestCase):
+
+    def test_seeded(self):
+        for shape in ('straight', 'nested', 'fan', 'mixed'):
+            self.assertIs(generate(shape, 50, seed=3), generate(shape, 50, seed=3))
+        self.assertIsNot(generate('mixed', 50, seed=3), generate('mixed', 50, seed=4))
+
+    def test_shapes(self):
+        self.assertEqual(len(generate('straight', 300).statements), 300)
+        program = generate('nested', 2000)
+        depth = 0
+        while len(program.statements) > 1:
+            program = program.statements[1].body
+            depth += 1
+        self.assertEqual(depth, 2000)
+        (analysis, nodes, cfg) = build_cfg(generate('fan', 100))
+        self.assertEqual(sum(1 for node in nodes.values() if len(node.going_out) == 2), 100)
+        names = {var.name for stmt in generate('straight', 500, variables=4).statements for var in free_variables(stmt.expression)}
+        self.assertLessEqual(names, {'v0', 'v1', 'v2', 'v3'})
+
+    def test_benchmark(self):
+        results = benchmark.run(['mixed'], [40], ['reaching_definitions'], repeat=1)
+        self.assertEqual([r['stage'] for r in results['records']], list(benchmark.STAGES))
+        self.assertTrue(all(r['seconds'] >= 0 and r['peak_bytes'] > 0 for r in results['records']))
+        slower = {'records': [dict(r, seconds=r['seconds'] * 2 + 1) for r in results['records']]}
+        self.assertEqual(benchmark.compare(results, results), [])
+        self.assertEqual(len(benchmark.compare(slower, results)), 3)
+
+    def test_benchmark_output(self):
+        # Every mode writes to --output
+        (fd, path) = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            common = ['--shapes', 'mixed', '--sizes', '20', '--analyses', 'live_variables', '--repeat', '1',
+                      '--output', path]
+            for mode in (['--no-memory'], ['--sparse'], ['--throughput', '3'], ['--states'], ['--structured']):
+                os.remove(path)
+                self.assertEqual(benchmark.main(common + mode), 0)
+                with open(path) as f:
+                    self.assertTrue(json.load(f)['records'])
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_counters(self):
+        analysis = AvailableExpressionsAnalysis()
+        analysis.instrument = Instrumentation()
+        (nodes, cfg) = analysis.build_cfg(book_example)
+        analysis.analyze(nodes, cfg)
+        stats = json.loads(analysis.instrument.to_json())
+        self.assertEqual(stats['counters']['transfers'], analysis.transfer_count)
+        self.assertEqual(sum(stats['transfers'].values()), analysis.transfer_count)
+        self.assertEqual(stats['counters']['nodes'], 6)
+        self.assertEqual(stats['counters']['facts'], 3)
+        self.assertEqual(stats['sizes']['exit_max'], 2)
+        self.assertTrue({'create_cfg', 'mkDFS', 'gen_kill', 'fixpoint'} <= set(stats['phases']))
+        self.assertEqual(stats['events'], [])
+
+    def test_trace(self):
+        events = []
+        analysis = ReachingDefinitions()
+        analysis.instrument = Instrumentation(trace=events.append)
+        (nodes, cfg) = analysis.build_cfg(book_example)
+        analysis.analyze(nodes, cfg)
+        self.assertEqual(len(events), analysis.transfer_count)
+        self.assertEqual(events[0], {'event': 'transfer', 'node': 1, 'changed': True})
+
+
+class TestBasicBlocks(unittest.TestCase):
+
+    def assertSameResults(self, analysis_type, program):
+        results = []
+        for coalesce in (False, True):
+            analysis = analysis_type()
+            (nodes, cfg) = analysis.build_cfg(program)
+            solved = analysis.solve(nodes, cfg, coalesce=coalesce)
+            results.append({label: (node.entry, node.exit) for (label, node) in solved.items()})
+        self.assertEqual(results[1], results[0])
+        return analysis
+
+    def test_same_results(self):
+        programs = [book_example, increment_loop, conditional_assignment, nested_loops, while_with_conditional,
+                    parse("x := 1; IF x < 2 THEN Skip ELSE Skip; Skip END; WHILE x < 3 DO Skip END; Skip; "
+                          "WHILE x DO IF y THEN Skip ELSE Skip END END; y := x + 1")]
+        programs += [generate(shape, 30, seed, variables=4) for shape in ('straight', 'fan', 'mixed') for seed in range(10)]
+        for analysis_type in (AvailableExpressionsAnalysis, ReachingDefinitions):
+            for program in programs:
+                self.assertSameResults(analysis_type, program)
+
+    def test_blocks(self):
+        (analysis, nodes, cfg) = build_cfg(parse("a := 1; b := 2; WHILE a < b DO a := a + 1; Skip; b := b - 1 END; Skip; Skip"))
+        blocks = BasicBlocks(CompactCFG(nodes, cfg))
+        self.assertEqual(blocks.graph.edges(), [(1, 3), (3, 4), (3, 'exit'), (4, 3)])
+        self.assertEqual([[blocks.nodes.labels[i] for i in run] for run in blocks.members], [[1, 2], ['exit'], [3], [4, 5, 6]])
+        # The trailing Skips are bypassed
+        self.assertEqual([blocks.block[blocks.nodes.ids[label]] for label in (8, 9)], [None, None])
+
+    def test_fewer_transfers(self):
+        analysis = self.assertSameResults(AvailableExpressionsAnalysis, generate('straight', 1000))
+        self.assertEqual(analysis.transfer_count, 2)
+
+    def test_values_on_demand(self):
+        analysis = AvailableExpressionsAnalysis()
+        (nodes, cfg) = analysis.build_cfg(book_example)
+        graph = CompactCFG(nodes, cfg)
+        lattice = BitVectorLattice(Universe(analysis.facts(graph)))
+        (gen, kill) = analysis.gen_kill(graph, lattice)
+        from blocks import solve_blocks
+        solution = solve_blocks(graph, lattice, gen, kill, lattice.empty, must=True)
+        self.assertEqual(lattice.to_set(solution.node_exit(graph.ids[2])), {BinaryOperation('+', Variable('a'), Variable('b')),
+                                                                          BinaryOperation('*', Variable('a'), Variable('b'))})
+        self.assertEqual(len(solution.values), 2)
+
+
+class TestDefUseChains(unittest.TestCase):
+
+    def test_book_example(self):
+        analysis = ReachingDefinitions()
+        (nodes, cfg) = analysis.build_cfg(book_example)
+        chains = DefUseChains(nodes, cfg)
+        self.assertEqual(chains.reaching(3, 'y'), [2])
+        self.assertCountEqual(chains.reaching(3, Variable('a')), ['?', 4])
+        self.assertEqual(chains.reaching(5, 'b'), ['?'])
+        self.assertCountEqual(chains.reached(4), [(3, Variable('a')), (4, Variable('a')), (5, Variable('a'))])
+        self.assertEqual(chains.reached(5), [])
+        with self.assertRaises(KeyError):
+            chains.reaching(1, 'x')
+
+    def test_matches_reaching_definitions(self):
+        for seed in range(10):
+            program = generate('mixed', 40, seed, variables=4)
+            chains = DefUseChains(*ReachingDefinitions().build_cfg(program))
+            analysis = ReachingDefinitions()
+            (nodes, cfg) = analysis.build_cfg(program)
+            entries = 0
+            for (label, node) in analysis.analyze(nodes, cfg).items():
+                expr = node.stmt.expression if isinstance(node.stmt, Assignment) else node.expression
+                for var in (free_variables(expr) if expr is not None else ()):
+                    reaching = {l for (name, l) in node.entry if name == var.name}
+                    self.assertEqual(set(chains.reaching(label, var)), reaching)
+                    entries += len(reaching)
+            self.assertEqual(len(chains), entries)
+
+
+class TestSSA(unittest.TestCase):
+
+    def test_book_example(self):
+        (nodes, cfg) = ReachingDefinitions().build_cfg(book_example)
+        graph = CompactCFG(nodes, cfg)
+        ssa = SSA(graph)
+        idom = {graph.labels[i]: graph.labels[d] for (i, d) in enumerate(ssa.idom)}
+        self.assertEqual(idom, {1: 1, 2: 1, 3: 2, 4: 3, 5: 4, 'exit': 3})
+        # φs for the variables assigned in the loop, at its condition
+        phis = ssa.phis[graph.ids[3]]
+        self.assertEqual(set(phis), {Variable('a'), Variable('x')})
+        a = phis[Variable('a')]
+        self.assertEqual(ssa.value_at(3, Variable('a')), a)
+        self.assertEqual(ssa.value_at(4, Variable('a')), a)
+        self.assertEqual(ssa.value_at(5, Variable('a')), ssa.defs[graph.ids[4]])
+        self.assertEqual(sorted(pred for (pred, _) in ssa.arguments[a]), sorted([graph.ids[2], graph.ids[5]]))
+        self.assertEqual(sparse_reaching_definitions(ssa)[a], {'?', 4})
+
+    def test_loop_at_start(self):
+        x = Variable('x')
+        program = CompoundStatement([WhileLoop(BinaryOperation('<', x, Constant(5)),
+                                               Assignment(x, BinaryOperation('+', x, Constant(1))))])
+        graph = CompactCFG(*ReachingDefinitions().build_cfg(program))
+        ssa = SSA(graph)
+        phi = ssa.phis[ENTRY][x]
+        self.assertEqual(ssa.kind[phi], PHI)
+        self.assertIn((START, ssa.initial[x]), ssa.arguments[phi])
+        self.assertEqual(sparse_reaching_definitions(ssa)[phi], {'?', 2})
+
+    def test_matches_def_use_chains(self):
+        for shape in ('nested', 'fan', 'mixed'):
+            for seed in range(5):
+                (nodes, cfg) = ReachingDefinitions().build_cfg(generate(shape, 40, seed, variables=4))
+                chains = DefUseChains(nodes, cfg)
+                ssa = SSA(CompactCFG(nodes, cfg))
+                origins = sparse_reaching_definitions(ssa)
+                for (label, v) in chains.uses:
+                    var = chains.variables[v]
+                    self.assertEqual(origins[ssa.value_at(label, var)], set(chains.reaching(label, var)))
+
+    def test_benchmark(self):
+        results = benchmark.run_sparse(['mixed'], [40], repeat=1)
+        self.assertEqual(len(results['records']), 1)
+        self.assertGreater(results['records'][0]['sparse_seconds'], 0)
+        with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            benchmark.main(['--sparse', '--repeat', '0'])
+
+
+class TestLiveVariables(unittest.TestCase):
+
+    def test_book_example(self):
+        analysis = LiveVariables()
+        results = analysis.analyze(*analysis.build_cfg(book_example))
+        self.assertEqual(results[1].entry, {'a', 'b'})
+        self.assertEqual(results[2].exit, {'a', 'b', 'y'})
+        self.assertEqual(results[5].entry, {'a', 'b', 'y'})
+        self.assertEqual(results['exit'].entry, set())
+        # The solver visits the nodes backward, from the exit
+        self.assertEqual(list(results)[0], 'exit')
+        analysis = LiveVariables(live_at_exit={'x'})
+        results = analysis.analyze(*analysis.build_cfg(book_example))
+        self.assertEqual(results[3].entry, {'a', 'b', 'x', 'y'})
+        self.assertEqual(results[1].entry, {'a', 'b'})
+
+    def test_coming_in(self):
+        analysis = LiveVariables()
+        (nodes, cfg) = analysis.build_cfg(nested_loops)
+        graph = CompactCFG(nodes, cfg)
+        for (i, label) in enumerate(graph.labels):
+            self.assertCountEqual([p.label for p in nodes[label].coming_in],
+                                  [graph.labels[p] for p in graph.predecessors(i)])
+
+    def test_fixpoint(self):
+        for seed in range(5):
+            program = generate('mixed', 60, seed, variables=5)
+            expected = None
+            for (lattice_type, strategy, coalesce) in [(BitVectorLattice, WORKLIST, False),
+                                                       (SetLattice, ROUND_ROBIN, False),
+                                                       (BitVectorLattice, SCC, False),
+                                                       (BitVectorLattice, WORKLIST, True)]:
+                analysis = LiveVariables()
+                (nodes, cfg) = analysis.build_cfg(program)
+                results = analysis.solve(nodes, cfg, lattice_type, strategy, coalesce)
+                values = {label: (node.entry, node.exit) for (label, node) in results.items()}
+                if expected is None:
+                    expected = values
+                    for node in results.values():
+                        self.assertEqual(node.entry, node.gen | (node.exit - node.kill))
+                        self.assertEqual(node.exit, set().union(*(s.entry for s in node.going_out)))
+                self.assertEqual(values, expected)
+
+
+@unittest.skipIf(vectorized.np is None, "needs NumPy")
+class TestVectorized(unittest.TestCase):
+
+    def test_matches_scalar_solver(self):
+        # Programs of different sizes, some with more than 64 facts
+        programs = [book_example, increment_loop, conditional_assignment, nested_loops, while_with_conditional]
+        programs += [generate(shape, size, seed, variables=6)
+                     for shape in ('nested', 'fan', 'mixed') for (seed, size) in enumerate([5, 30, 120])]
+        for analysis_type in (AvailableExpressionsAnalysis, ReachingDefinitions, LiveVariables):
+            expected = [analyze_program(program, analysis_type) for program in programs]
+            self.assertEqual(vectorized.analyze_many(programs, analysis_type), expected)
+
+    def test_unreached_nodes(self):
+        analysis = ReachingDefinitions()
+        (nodes, cfg) = analysis.build_cfg(book_example)
+        unreached = Node()
+        unreached.label = 99
+        unreached.stmt = Assignment(Variable('y'), Constant(1))
+        nodes[99] = unreached
+        graph = CompactCFG(nodes, cfg + [(99, 3)])
+        lattice = BitVectorLattice(Universe(analysis.facts(graph)))
+        (gen, kill) = analysis.gen_kill(graph, lattice)
+        problem = (graph, lattice, gen, kill, analysis.boundary(graph, lattice))
+        expected = solve(*problem)
+        [solution] = vectorized.solve_many([problem])
+        self.assertEqual(solution.entry, expected.entry)
+        self.assertEqual(solution.exit, expected.exit)
+
+    def test_no_programs(self):
+        self.assertEqual(vectorized.solve_many([]), [])
+        self.assertEqual(vectorized.analyze_many([]), [])
+
+    def test_benchmark(self):
+        results = benchmark.run_throughput(5, [10], ['live_variables'], repeat=1)
+        self.assertEqual({(r['stage'], r['solver']) for r in results['records']},
+                         {(stage, solver) for stage in ('pipeline', 'solve') for solver in ('scalar', 'vectorized')})
+
+
+class TestPersistentSets(unittest.TestCase):
+
+    def test_set_operations(self):
+        universe = Universe(['a', 'b', 'c', 'd'])
+        ab = FactSet.from_items(universe, ['a', 'b'])
+        bc = FactSet.from_items(universe, ['b', 'c'])
+        self.assertEqual(ab | bc, {'a', 'b', 'c'})
+        self.assertEqual(ab & bc, FactSet.from_items(universe, ['b']))
+        self.assertEqual(ab - bc, {'a'})
+        self.assertEqual(ab ^ bc, frozenset({'a', 'c'}))
+        self.assertIsInstance(ab | bc, FactSet)
+        self.assertTrue(ab - bc <= ab < ab | bc)
+        self.assertFalse(ab.isdisjoint(bc))
+        self.assertIn('a', ab)
+        self.assertNotIn('x', ab)
+        self.assertEqual(len(ab), 2)
+        self.assertEqual(hash(ab), hash(frozenset({'a', 'b'})))
+        # With plain sets, and facts outside the universe
+        self.assertEqual({'b', 'x'} - ab, {'x'})
+        self.assertEqual(ab | {'x'}, {'a', 'b', 'x'})
+        self.assertEqual(ab & {'a', 'x'}, {'a'})
+        self.assertEqual(pickle.loads(pickle.dumps(ab)), ab)
+        self.assertEqual(repr(FactSet(universe)), 'set()')
+
+    def test_shared_states(self):
+        analysis = ReachingDefinitions()
+        results = analysis.analyze(*analysis.build_cfg(book_example))
+        # Nodes 3, 4 and 5 are all reached by the same definitions
+        self.assertIs(results[3].entry, results[3].exit)
+        self.assertIs(results[4].entry, results[3].entry)
+        self.assertIs(results[4].entry, analysis.solution.lattice.to_persistent(analysis.solution.entry[3]))
+        program = generate('mixed', 60, 1, variables=5)
+        for analysis_type in (AvailableExpressionsAnalysis, ReachingDefinitions, LiveVariables):
+            for lattice_type in (BitVectorLattice, SetLattice):
+                copied = analysis_type()
+                (nodes, cfg) = copied.build_cfg(program)
+                expected = {label: (node.gen, node.kill, node.entry, node.exit)
+                            for (label, node) in copied.solve(nodes, cfg, lattice_type, persistent=False).items()}
+                shared = analysis_type()
+                (nodes, cfg) = shared.build_cfg(program)
+                results = shared.solve(nodes, cfg, lattice_type)
+                self.assertEqual({label: (node.gen, node.kill, node.entry, node.exit)
+                                  for (label, node) in results.items()}, expected)
+                self.assertLess(len({id(node.entry) for node in results.values()}), len(results))
+
+    def test_benchmark(self):
+        results = benchmark.run_states(['mixed'], [40], ['available_expressions'])
+        (copied, shared, compact) = results['records']
+        self.assertEqual((copied['states'], shared['states'], compact['states']), ('set', 'persistent', 'compact'))
+        self.assertLess(shared['retained_bytes'], copied['retained_bytes'])
+        self.assertLess(compact['retained_bytes'], shared['retained_bytes'])
+
+
+class TestBudget(unittest.TestCase):
+
+    def solve(self, analysis_type, program, budget, strategy=WORKLIST, coalesce=False):
+        analysis = analysis_type()
+        analysis.budget = budget
+        (nodes, cfg) = analysis.build_cfg(program)
+        results = analysis.solve(nodes, cfg, strategy=strategy, coalesce=coalesce)
+        return analysis.solution, {label: (node.entry, node.exit) for (label, node) in results.items()}
+
+    def test_sound_when_out_of_budget(self):
+        program = generate('mixed', 80, 3, variables=5)
+        for analysis_type in (AvailableExpressionsAnalysis, ReachingDefinitions, LiveVariables):
+            (_, fixpoint) = self.solve(analysis_type, program, None)
+            for strategy in (WORKLIST, ROUND_ROBIN, SCC):
+                for coalesce in (False, True):
+                    (solution, partial) = self.solve(analysis_type, program, Budget(transfers=20), strategy, coalesce)
+                    self.assertEqual(solution.status, TRANSFERS)
+                    self.assertEqual(solution.transfers, 20)
+                    self.assertTrue(solution.unfinished)
+                    unfinished = {solution.graph.labels[i] for i in solution.unfinished} if not coalesce else None
+                    for (label, values) in partial.items():
+                        for (value, exact) in zip(values, fixpoint[label]):
+                            if analysis_type.must:
+                                self.assertLessEqual(value, exact)
+                            else:
+                                self.assertGreaterEqual(value, exact)
+                        if unfinished is not None and label not in unfinished:
+                            self.assertEqual(values, fixpoint[label])
+
+    def test_limits(self):
+        (solution, _) = self.solve(ReachingDefinitions, nested_loops, Budget(iterations=1), ROUND_ROBIN)
+        self.assertEqual((solution.status, solution.iterations), (ITERATIONS, 1))
+        (solution, results) = self.solve(ReachingDefinitions, nested_loops, Budget(seconds=0))
+        self.assertEqual((solution.status, solution.transfers), (DEADLINE, 0))
+        # Nothing was solved, so everything may reach everywhere
+        self.assertEqual(len(solution.unfinished), len(solution.graph))
+        self.assertEqual(results[1][0], set(solution.lattice.universe.items))
+        (solution, results) = self.solve(ReachingDefinitions, nested_loops, Budget(iterations=1000, seconds=60))
+        self.assertEqual((solution.status, solution.unfinished), (COMPLETE, []))
+        self.assertEqual(results, self.solve(ReachingDefinitions, nested_loops, None)[1])
+
+
+def execute(program, state, limit=10000):
+    # Runs the program on the state, with arithmetic modulo 2**16 to keep the
+    # numbers small. None if it takes more than limit steps.
+    operators = {'+': lambda a, b: (a + b) % 65536, '-': lambda a, b: (a - b) % 65536,
+                 '*': lambda a, b: (a * b) % 65536, '<': int.__lt__, '>': int.__gt__, '!=': int.__ne__}
+
+    def evaluate(expr):
+        if isinstance(expr, Variable):
+            return state[expr.name]
+        elif isinstance(expr, Constant):
+            return expr.value
+        return operators[expr.op](evaluate(expr.left), evaluate(expr.right))
+    stack = [program]
+    for _ in range(limit):
+        if not stack:
+            return state
+        stmt = stack.pop()
+        if isinstance(stmt, CompoundStatement):
+            stack.extend(reversed(stmt.statements))
+        elif isinstance(stmt, Assignment):
+            state[stmt.variable.name] = evaluate(stmt.expression)
+        elif isinstance(stmt, WhileLoop):
+            if evaluate(stmt.condition):
+                stack.extend([stmt, stmt.body])
+        elif isinstance(stmt, IfThenElse):
+            stack.append(stmt.true_branch if evaluate(stmt.condition) else stmt.false_branch)
+    return None
+
+
+class TestOptimize(unittest.TestCase):
+
+    def test_book_example(self):
+        (a, b, x, y, t1) = (Variable('a'), Variable('b'), Variable('x'), Variable('y'), Variable('t1'))
+        (program, eliminated) = eliminate_common_subexpressions(book_example)
+        self.assertEqual(eliminated, 1)
+        self.assertIs(program, CompoundStatement([
+            Assignment(t1, BinaryOperation('+', a, b)),
+            Assignment(x, t1),
+            Assignment(y, BinaryOperation('*', a, b)),
+            WhileLoop(BinaryOperation('>', y, t1), CompoundStatement([
+                Assignment(a, BinaryOperation('+', a, Constant(1))),
+                Assignment(t1, BinaryOperation('+', a, b)),
+                Assignment(x, t1)]))]))
+        self.assertEqual(eliminate_common_subexpressions(increment_loop), (increment_loop, 0))
+
+    def test_dead_assignments(self):
+        self.assertEqual(eliminate_dead_assignments(book_example), (book_example, 0))
+        (program, removed) = eliminate_dead_assignments(book_example, live_at_exit={'y'})
+        self.assertEqual(removed, 2)
+        self.assertNotIn('x', str(program))
+        # The temporaries are dead after the program, but not inside it
+        (optimized, _) = eliminate_common_subexpressions(book_example)
+        (program, removed) = eliminate_dead_assignments(optimized, live_at_exit={'a', 'b', 'y'})
+        self.assertEqual(removed, 2)
+        self.assertIn('t1', str(program))
+
+    def test_deep_expression(self):
+        total = " + ".join(f"a{i % 5}" for i in range(1500)) # past the recursion limit
+        program = parse(f"x := {total}; y := {total}")
+        (optimized, eliminated) = eliminate_common_subexpressions(program)
+        self.assertEqual(eliminated, 1499)
+        self.assertEqual(optimized.statements[1:], (Assignment(Variable('x'), Variable('t1')),
+                                                    Assignment(Variable('y'), Variable('t1'))))
+        self.assertEqual(eliminate_dead_assignments(optimized, ['x', 'y']), (optimized, 0))
+
+    def test_preserves_semantics(self):
+        names = ['v0', 'v1', 'v2']
+        checked = 0
+        for seed in range(40):
+            program = generate(['mixed', 'fan', 'nested'][seed % 3], 20, seed, variables=3)
+            rng = random.Random(seed)
+            state = {name: rng.randint(0, 5) for name in names}
+            expected = execute(program, dict(state))
+            (program, _) = eliminate_common_subexpressions(program)
+            (program, _) = eliminate_dead_assignments(program, names)
+            if expected is not None:
+                checked += 1
+                result = execute(program, dict(state), 100000)
+                self.assertEqual({name: result[name] for name in names}, expected)
+        self.assertGreater(checked, 10)
+
+
+class TestInterpreter(unittest.TestCase):
+
+    def test_while_with_conditional(self):
+        compiled = compile_program(while_with_conditional, profile=True)
+        self.assertEqual(compiled.run(), {'x': 0, 'y': 5})
+        # By the labels of the analyses: the condition is evaluated once more
+        # than the body runs, and the branches split the iterations
+        self.assertEqual(compiled.counts, {1: 1, 2: 1, 3: 11, 4: 10, 5: 10, 6: 5, 7: 5})
+        # The program sets x itself, other variables are left alone
+        self.assertEqual(compiled.run({'x': 4, 'z': 7}), {'x': 0, 'y': 5, 'z': 7})
+        self.assertEqual(compiled.counts[3], 11 + 11)
+        self.assertEqual(compile_program(while_with_conditional).counts, {})
+
+    def test_many_iterations(self):
+        program = parse("x := 1000000; y := 0; WHILE x > 0 DO x := x - 1; y := y + x % 3 END")
+        self.assertEqual(compile_program(program).run(), {'x': 0, 'y': 999999})
+
+    def test_deep_nesting(self):
+        # Thirty nested loops don't fit in one Python function
+        body = Assignment(Variable('n'), BinaryOperation('+', Variable('n'), Constant(1)))
+        for k in reversed(range(30)):
+            i = Variable(f"i{k}")
+            body = CompoundStatement([Assignment(i, Constant(0)),
+                                      WhileLoop(BinaryOperation('<', i, Constant(2 if k == 0 else 1)),
+                                                CompoundStatement([body, Assignment(i, BinaryOperation('+', i, Constant(1)))]))])
+        compiled = compile_program(body, profile=True)
+        self.assertEqual(compiled.run()['n'], 2)
+        self.assertEqual(max(compiled.counts.values()), 4)
+
+    def test_deep_expressions(self):
+        # Long sums don't nest in the generated code
+        program = parse("s := " + " + ".join(f"a{i % 5}" for i in range(3000)) +
+                        "; WHILE s < " + " + ".join("1" for _ in range(300)) + " DO s := s + 1 END")
+        state = {f"a{k}": k for k in range(5)}
+        self.assertEqual(compile_program(program).run(state)['s'], 6000)
+        self.assertEqual(compile_program(program).run({})['s'], 300)
+
+    def test_condition_with_operations(self):
+        # The condition is evaluated at the top of every iteration
+        compiled = compile_program(book_example, profile=True)
+        self.assertEqual(compiled.run({'a': 3, 'b': 3}), {'a': 6, 'b': 3, 'x': 9, 'y': 9})
+        self.assertEqual(compiled.counts[3], 4)
+
+    def test_agrees_with_reference(self):
+        for seed in range(20):
+            program = generate('straight', 30, seed, variables=4)
+            state = {f"v{k}": k + 1 for k in range(4)}
+            # The reference wraps around at 2**16, which commutes with + - *
+            result = compile_program(program).run(dict(state))
+            self.assertEqual({name: value % 65536 for (name, value) in result.items()}, execute(program, dict(state)))
+
+
+class TestStructured(unittest.TestCase):
+
+    def test_same_as_iterative(self):
+        programs = [book_example, increment_loop, while_with_conditional]
+        programs += [generate(shape, size, seed, variables=4) for shape in ('nested', 'fan', 'mixed')
+                     for size in (5, 40) for seed in range(3)]
+        for analysis_type in (AvailableExpressionsAnalysis, ReachingDefinitions, LiveVariables):
+            for program in programs:
+                (cfg, results) = analyze_program(program, analysis_type)
+                self.assertEqual(analyze_structured(program, analysis_type), (cfg, results))
+
+    def test_no_iteration(self):
+        # Every node is transferred once, however deep the loops nest
+        analysis = ReachingDefinitions()
+        fragment = build_fragment(analysis, generate('nested', 200, 0))
+        the_exit = Node()
+        the_exit.label = "exit"
+        for e in fragment.exits():
+            e.link(the_exit)
+        graph = CompactCFG(analysis.nodes, analysis.mkDFS(fragment.head(), set()))
+        for lattice_type in (BitVectorLattice, SetLattice):
+            lattice = lattice_type(Universe(analysis.facts(graph)))
+            (gen, kill) = analysis.gen_kill(graph, lattice)
+            boundary = analysis.boundary(graph, lattice)
+            expected = solve(graph, lattice, gen, kill, boundary)
+            solution = solve_structured(fragment, graph, lattice, gen, kill, boundary)
+            self.assertEqual((solution.entry, solution.exit), (expected.entry, expected.exit))
+            self.assertEqual(solution.transfers, len(graph))
+            self.assertGreater(expected.transfers, 2 * len(graph))
 
 
 class TestDynamicProgramStructure(unittest.TestCase):
@@ -0,0 +1,185 @@
+from typing import Dict, Iterable, List, Tuple
+from syntax import *
+from bitvector import Universe, BitVectorLattice
+from cfg import CompactCFG, ENTRY, EXIT
+from dataflow import FORWARD, Solution
+from AvailableExpressions import AvailableExpressionsAnalysis
+
+try:
+    import numpy as np
+except ImportError: # optional, only this module needs it
+    np = None
+
+# Vectorized solver for many programs at once. With thousands of small
+# programs, most of the time of solve() goes to the Python loop around every
+# transfer. Here the gen and kill bit vectors of all the nodes of all the
+# programs are packed into uint64 matrices, one row per node and one column
+# per 64 facts (as many as the largest universe needs), and every sweep
+# computes the meet and the transfer of all rows at once:
+#
+#   in = meet of out[sources[offsets[i]:offsets[i + 1]]]   (reduceat)
+#   out = (gen | (in & ~kill)) & mask
+#
+# until no row changes. The sources of every node end with an identity row
+# (all ones for a must analysis, zeros otherwise), so no node has an empty
+# meet, and those of an initial node with the boundary row of its program.
+# All rows are updated from the values of the previous sweep; from the same
+# initial values this reaches the same fixpoint as solve(), in more but much
+# cheaper sweeps. Needs NumPy.
+
+WORD = 64
+
+
+def words(width: int) -> int:
+    return max(1, (width + WORD - 1) // WORD)
+
+
+def pack(values: List[int], columns: int):
+    # Python ints as the rows of a uint64 matrix, least significant word first
+    if columns == 1:
+        return np.array(values, dtype=np.uint64).reshape(-1, 1)
+    size = 8 * columns
+    data = b''.join(v.to_bytes(size, 'little') for v in values)
+    return np.frombuffer(data, dtype='<u8').reshape(-1, columns).copy()
+
+
+def unpack(rows) -> List[int]:
+    if rows.shape[1] == 1:
+        return rows[:, 0].tolist()
+    size = rows.shape[1] * 8
+    data = np.ascontiguousarray(rows, dtype='<u8').tobytes()
+    return [int.from_bytes(data[i:i + size], 'little') for i in range(0, len(data), size)]
+
+
+def ints(values):
+    # An array.array of signed ints (the CSR arrays of a CompactCFG) as a
+    # NumPy array without copying, whatever the size of its C type
+    return np.frombuffer(values, dtype=f"i{values.itemsize}")
+
+
+def reachable(n: int, targets, sources, starts):
+    # Which of the n rows the edges sources[k] -> targets[k] lead to from
+    # the starts, breadth first with a whole level per step
+    order = np.argsort(sources, kind='stable')
+    out_targets = targets[order]
+    out_offsets = np.zeros(n + 1, dtype=np.intp)
+    np.cumsum(np.bincount(sources, minlength=n), out=out_offsets[1:])
+    reached = np.zeros(n, dtype=bool)
+    reached[starts] = True
+    frontier = starts
+    while len(frontier):
+        degree = out_offsets[frontier + 1] - out_offsets[frontier]
+        skip = np.cumsum(degree) - degree
+        edges = np.repeat(out_offsets[frontier] - skip, degree) + np.arange(int(degree.sum()))
+        frontier = np.unique(out_targets[edges])
+        frontier = frontier[~reached[frontier]]
+        reached[frontier] = True
+    return reached
+
+
+def solve_many(problems: List[Tuple], must: bool = False, direction: str = FORWARD) -> List[Solution]:
+    # solve() for every (graph, lattice, gen, kill, boundary) in problems,
+    # with BitVectorLattice values, all with the same must and direction.
+    # Returns their Solutions in the same order; transfers counts every row
+    # of every sweep, iterations the sweeps.
+    if np is None:
+        raise ImportError("vectorized.solve_many needs NumPy")
+    if not problems:
+        return []
+    columns = words(max((len(lattice.universe) for (_, lattice, _, _, _) in problems), default=0))
+    start = ENTRY if direction == FORWARD else EXIT
+    sizes = np.array([len(graph) for (graph, _, _, _, _) in problems], dtype=np.intp)
+    base = np.zeros(len(problems) + 1, dtype=np.intp) # first row of each program
+    np.cumsum(sizes, out=base[1:])
+    n = int(base[-1])
+    identity = n + len(problems) # the boundary rows come after the node rows
+
+    # The flow predecessors of all the rows, in CSR form like a CompactCFG
+    degrees = []
+    preds = []
+    gens = []
+    kills = []
+    for (p, (graph, _, gen, kill, _)) in enumerate(problems):
+        if direction == FORWARD:
+            (in_offsets, in_nodes) = (graph.pred_offsets, graph.pred_sources)
+        else:
+            (in_offsets, in_nodes) = (graph.succ_offsets, graph.succ_targets)
+        degree = np.diff(ints(in_offsets))
+        nodes = ints(in_nodes) + base[p]
+        gens.extend(gen)
+        kills.extend(kill)
+        degrees.append(degree)
+        preds.append(nodes)
+    degree = np.concatenate(degrees)
+    starts = base[:-1] + start
+    counts = degree + 1
+    counts[starts] += 1
+    offsets = np.zeros(n, dtype=np.intp)
+    np.cumsum(counts[:-1], out=offsets[1:])
+    sources = np.full(int(counts.sum()), identity, dtype=np.intp)
+    owner = np.repeat(np.arange(n), degree)
+    first = np.zeros(n, dtype=np.intp)
+    np.cumsum(degree[:-1], out=first[1:])
+    sources[offsets[owner] + np.arange(len(owner)) - first[owner]] = np.concatenate(preds)
+    sources[offsets[starts] + degree[starts]] = np.arange(n, identity)
+    reached = reachable(n, owner, np.concatenate(preds), starts)
+
+    gen = pack(gens, columns)
+    kill = pack(kills, columns)
+    masks = pack([lattice.universe.full for (_, lattice, _, _, _) in problems], columns)
+    mask = np.repeat(masks, sizes, axis=0)
+    rows = np.empty((identity + 1, columns), dtype=np.uint64)
+    rows[:n] = mask if must else 0
+    rows[n:identity] = pack([boundary for (_, _, _, _, boundary) in problems], columns)
+    rows[identity] = np.iinfo(np.uint64).max if must else 0
+    meet = np.bitwise_and if must else np.bitwise_or
+    not_kill = ~kill
+    # As in solve(), nodes the flow doesn't reach keep their initial value
+    init = None if reached.all() else rows[:n].copy()
+
+    sweeps = 0
+    while True:
+        sweeps += 1
+        before = meet.reduceat(rows[sources], offsets, axis=0) & mask
+        after = (gen | (before & not_kill)) & mask
+        if init is not None:
+            before = np.where(reached[:, None], before, init)
+            after = np.where(reached[:, None], after, init)
+        if np.array_equal(after, rows[:n]):
+            break
+        rows[:n] = after
+
+    before = unpack(before)
+    after = unpack(after)
+    solutions = []
+    for (p, (graph, lattice, gen, kill, _)) in enumerate(problems):
+        (b, a) = (before[base[p]:base[p + 1]], after[base[p]:base[p + 1]])
+        if direction == FORWARD:
+            solution = Solution(graph, lattice, gen, kill, b, a)
+        else:
+            solution = Solution(graph, lattice, gen, kill, a, b)
+        solution.transfers = sweeps * len(graph)
+        solution.iterations = sweeps
+        solutions.append(solution)
+    return solutions
+
+
+def analyze_many(programs: Iterable[Statement], analysis_type=AvailableExpressionsAnalysis) -> List[Tuple[List[Tuple], Dict]]:
+    # Like batch.analyze_program for each of the programs, solved together:
+    # [(cfg, {label: (entry, exit)})]
+    problems = []
+    cfgs = []
+    for program in programs:
+        analysis = analysis_type()
+        (nodes, cfg) = analysis.build_cfg(program)
+        graph = CompactCFG(nodes, cfg)
+        lattice = BitVectorLattice(Universe(analysis.facts(graph)))
+        (gen, kill) = analysis.gen_kill(graph, lattice)
+        problems.append((graph, lattice, gen, kill, analysis.boundary(graph, lattice)))
+        cfgs.append(cfg)
+    results = []
+    for (cfg, solution) in zip(cfgs, solve_many(problems, analysis_type.must, analysis_type.direction)):
+        (graph, lattice) = (solution.graph, solution.lattice)
+        results.append((cfg, {label: (lattice.to_set(solution.entry[i]), lattice.to_set(solution.exit[i]))
+                              for (i, label) in enumerate(graph.labels)}))
+    return results
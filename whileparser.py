@@ -0,0 +1,231 @@
+import io
+import re
+from typing import Iterator, List, TextIO, Union
+from syntax import *
+
+# Parser for the textual WHILE language of the comments in examples.py:
+#
+#   x := a + b;
+#   WHILE y > a + b DO
+#     a := a + 1;
+#     x := a + b
+#   END;
+#   IF x % 2 THEN y := y + 1 ELSE Skip END
+#
+# Statements are separated by ';' (a ';' before END, ELSE or the end of the
+# program is allowed). IF needs an END, and without ELSE the false branch is
+# a Skip. Expressions have the usual precedence: * / % over + - over the
+# relational operators, all left associative, and parentheses. '#' starts a
+# comment up to the end of the line.
+#
+# The source is read in chunks, and neither the tokenizer nor the parser
+# recurses, so the size of the source and the nesting depth of the program
+# are only limited by the memory for the tree itself.
+
+KEYWORDS = {'WHILE', 'DO', 'END', 'IF', 'THEN', 'ELSE', 'SKIP', 'Skip'}
+
+PRECEDENCE = {'*': 3, '/': 3, '%': 3, '+': 2, '-': 2}
+PRECEDENCE.update((op, 1) for op in RELATIONAL_OPERATORS)
+
+# Every token, then newlines (to count lines) and comments, and a single
+# character that is none of these as an error
+_token = re.compile(r"\d+|[A-Za-z_]\w*|:=|<=|>=|==|!=|[-+*/%<>();]|\n|#[^\n]*|\S")
+
+EOF = '' # what Parser.next gives after the last token
+
+# Characters that no token continues past: a chunk can be cut after any of
+# them (outside of a comment)
+_boundaries = frozenset(' \t\r\n\f\v;()+-*/%')
+
+
+def tokenize(stream: TextIO, chunk_size: int = 1 << 16) -> Iterator[List[str]]:
+    # Yields the tokens of the stream a chunk at a time, with a '\n' token for
+    # every newline. Every chunk is cut after its last boundary character, so
+    # even a program on a single line is read a chunk at a time; the rest
+    # waits for the next chunk. A comment that runs on past the chunk is
+    # kept as just its '#', since its text doesn't matter.
+    rest = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        text = rest + chunk
+        comment = text.find('#', text.rfind('\n') + 1)
+        if comment >= 0:
+            (text, rest) = (text[:comment], '#')
+        else:
+            cut = len(text)
+            while cut and text[cut - 1] not in _boundaries:
+                cut -= 1
+            (text, rest) = (text[:cut], text[cut:])
+        yield _token.findall(text)
+    yield _token.findall(rest)
+
+
+class Parser:
+
+    def __init__(self, chunks: Iterator[List[str]]) -> None:
+        self.chunks = chunks
+        self.tokens = [] # tokens of the current chunk
+        self.pos = 0 # position of the next token in it
+        self.line = 1 # line the current chunk starts on
+        self.variables = {} # name -> Variable
+        self.constants = {} # token -> Constant
+
+    def next(self) -> str:
+        tokens = self.tokens
+        while True:
+            if self.pos == len(tokens):
+                self.line += tokens.count('\n')
+                tokens = self.tokens = next(self.chunks, None)
+                self.pos = 0
+                if tokens is None:
+                    self.tokens = []
+                    return EOF
+                continue
+            token = tokens[self.pos]
+            self.pos += 1
+            if token != '\n' and token[0] != '#':
+                return token
+
+    def error(self, message: str, token: str):
+        line = self.line + self.tokens[:self.pos].count('\n')
+        found = repr(token) if token else 'end of input'
+        return SyntaxError(f"line {line}: {message}, found {found}")
+
+    def expect(self, expected: str) -> None:
+        token = self.next()
+        if token != expected:
+            raise self.error(f"expected {expected!r}", token)
+
+    def expression(self):
+        # Shunting yard: returns the expression and the first token after it
+        operands = []
+        operators = [] # operators and open parentheses
+        token = self.next()
+        while True:
+            # An operand, after any number of open parentheses
+            while token == '(':
+                operators.append(token)
+                token = self.next()
+            if token == '-':
+                token = self.next()
+                if not token.isdigit():
+                    raise self.error("expected a number after '-'", token)
+                token = '-' + token
+            if token in self.variables:
+                operands.append(self.variables[token])
+            elif token in self.constants:
+                operands.append(self.constants[token])
+            elif token[:1].isdigit() or token[:1] == '-':
+                operands.append(self.constants.setdefault(token, Constant(int(token))))
+            elif token[:1].isalpha() or token[:1] == '_':
+                if token in KEYWORDS:
+                    raise self.error("expected an expression", token)
+                operands.append(self.variables.setdefault(token, Variable(token)))
+            else:
+                raise self.error("expected an expression", token)
+            token = self.next()
+            # Close parentheses, then either an operator or the end
+            while token == ')':
+                while operators and operators[-1] != '(':
+                    self._reduce(operands, operators)
+                if not operators:
+                    raise self.error("unbalanced parentheses", token)
+                operators.pop()
+                token = self.next()
+            precedence = PRECEDENCE.get(token)
+            if precedence is None:
+                break
+            while operators and operators[-1] != '(' and PRECEDENCE[operators[-1]] >= precedence:
+                self._reduce(operands, operators)
+            operators.append(token)
+            token = self.next()
+        while operators:
+            if operators[-1] == '(':
+                raise self.error("unbalanced parentheses", token)
+            self._reduce(operands, operators)
+        return operands[0], token
+
+    @staticmethod
+    def _reduce(operands: List, operators: List) -> None:
+        right = operands.pop()
+        left = operands.pop()
+        operands.append(BinaryOperation(operators.pop(), left, right))
+
+    def program(self) -> CompoundStatement:
+        # Every open WHILE and IF is a frame on the stack:
+        # [keyword, condition, true branch (IF after ELSE), statements]
+        stack = [[None, None, None, []]]
+        token = self.next()
+        while True:
+            frame = stack[-1]
+            statements = frame[3]
+            # token starts a statement, or ends the innermost block
+            closes = (token == EOF) if frame[0] is None else token in ('END', 'ELSE')
+            if closes:
+                if not statements:
+                    raise self.error("expected a statement", token)
+                if frame[0] is None:
+                    return CompoundStatement(statements)
+                elif token == 'ELSE':
+                    if frame[0] != 'IF' or frame[2] is not None:
+                        raise self.error("unexpected ELSE", token)
+                    frame[2] = statements
+                    frame[3] = []
+                    token = self.next()
+                    continue
+                stack.pop()
+                if frame[0] == 'WHILE':
+                    stmt = WhileLoop(frame[1], CompoundStatement(statements))
+                elif frame[2] is None:
+                    stmt = IfThenElse(frame[1], CompoundStatement(statements), CompoundStatement([Skip()]))
+                else:
+                    stmt = IfThenElse(frame[1], CompoundStatement(frame[2]), CompoundStatement(statements))
+                stack[-1][3].append(stmt)
+                token = self.next()
+            elif token == 'WHILE':
+                (condition, token) = self.expression()
+                if token != 'DO':
+                    raise self.error("expected 'DO'", token)
+                stack.append(['WHILE', condition, None, []])
+                token = self.next()
+                continue
+            elif token == 'IF':
+                (condition, token) = self.expression()
+                if token != 'THEN':
+                    raise self.error("expected 'THEN'", token)
+                stack.append(['IF', condition, None, []])
+                token = self.next()
+                continue
+            elif token in ('SKIP', 'Skip'):
+                statements.append(Skip())
+                token = self.next()
+            elif token[:1].isalpha() or token[:1] == '_':
+                if token in KEYWORDS:
+                    raise self.error("expected a statement", token)
+                variable = self.variables.setdefault(token, Variable(token))
+                self.expect(':=')
+                (expression, token) = self.expression()
+                statements.append(Assignment(variable, expression))
+            elif token == EOF:
+                raise self.error("expected 'END'", token)
+            else:
+                raise self.error("expected a statement", token)
+            # After a statement: ';' or the end of the block
+            if token == ';':
+                token = self.next()
+            elif token not in ('END', 'ELSE', EOF):
+                raise self.error("expected ';'", token)
+
+
+def parse(source: Union[str, TextIO], chunk_size: int = 1 << 16) -> CompoundStatement:
+    # Parses a program given as a string or a text stream
+    if isinstance(source, str):
+        source = io.StringIO(source)
+    return Parser(tokenize(source, chunk_size)).program()
+
+
+def parse_file(path: str, chunk_size: int = 1 << 16) -> CompoundStatement:
+    with open(path) as stream:
+        return parse(stream, chunk_size)